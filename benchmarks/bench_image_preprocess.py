@@ -0,0 +1,85 @@
+# benchmarks/bench_image_preprocess.py
+"""
+Throughput benchmark for the image preprocessing stage.
+
+Builds synthetic photos (JPEG, 12 MP by default), downsamples them with
+src.images.preprocess_image in a process pool of increasing size, and
+reports images per second overall and per worker core, plus the size
+reduction. Requires Pillow.
+
+Run from the project root:
+
+    python -m benchmarks.bench_image_preprocess --images 32 --size 4000x3000
+"""
+
+import argparse
+import base64
+import io
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SHIM_PORT", "11434")
+
+from src.images import preprocess_image  # noqa: E402
+
+try:
+    from PIL import Image, ImageFilter
+except ImportError:
+    Image = None
+
+
+def make_photo(width: int, height: int, seed: int) -> bytes:
+    """A blurred noise image: compresses roughly like a real photo."""
+    rng = random.Random(seed)
+    small = Image.frombytes("RGB", (width // 16, height // 16), rng.randbytes(width // 16 * (height // 16) * 3))
+    image = small.resize((width, height), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(2))
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=90)
+    return base64.b64encode(out.getvalue())
+
+
+def run(images: list, workers: int, max_edge: int, quality: int) -> tuple:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Warm the workers so process start-up is not measured.
+        list(pool.map(abs, range(workers)))
+        started = time.perf_counter()
+        results = list(pool.map(preprocess_image, images, [max_edge] * len(images),
+                                [0] * len(images), [quality] * len(images)))
+        elapsed = time.perf_counter() - started
+    return elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=32)
+    parser.add_argument("--size", default="4000x3000")
+    parser.add_argument("--max-edge", type=int, default=1568)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if Image is None:
+        raise SystemExit("Pillow is not installed (pip install .[images]).")
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    distinct = [make_photo(width, height, seed) for seed in range(min(args.images, 4))]
+    images = [distinct[i % len(distinct)] for i in range(args.images)]
+    in_mb = sum(len(i) for i in images) / 1e6
+    print(f"{args.images} x {width}x{height} JPEG, {in_mb:.1f} MB base64 in, max edge {args.max_edge}")
+
+    workers = 1
+    while True:
+        elapsed, results = run(images, workers, args.max_edge, args.quality)
+        out_mb = sum(len(r[1]) if r else len(i) for r, i in zip(results, images)) / 1e6
+        rate = args.images / elapsed
+        print(f"{workers:>3} worker(s): {rate:7.1f} images/s  {rate / workers:6.1f} images/s/core  "
+              f"{out_mb:.1f} MB out ({out_mb / in_mb:.0%})")
+        if workers >= args.max_workers:
+            break
+        workers = min(workers * 2, args.max_workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# benchmarks/bench_ingest_memory.py
+"""
+Memory benchmark for large multimodal request bodies.
+
+Compares the regular path (read the whole body, json.loads, translate,
+json.dumps for httpx) with src.ingest (incremental scan, images spilled to a
+spool, outgoing body streamed). Each variant runs in a fresh subprocess and
+reports its peak RSS growth per MB of image data.
+
+Run from the project root:
+
+    python -m benchmarks.bench_ingest_memory --images 4 --image-mb 8
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SHIM_PORT", "11434")
+
+READ_SIZE = 64 * 1024
+
+
+def _status_kib(field: str) -> int:
+    """VmRSS / VmHWM from /proc, in KiB (Linux only)."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise RuntimeError(f"{field} not available")
+
+
+def write_body(path: str, images: int, image_mb: float):
+    image = base64.b64encode(os.urandom(int(image_mb * 1024 * 1024 * 3 / 4))).decode("ascii")
+    document = {
+        "model": "bench",
+        "stream": False,
+        "messages": [{"role": "user", "content": "Describe these.", "images": [image] * images}],
+    }
+    with open(path, "w") as f:
+        json.dump(document, f)
+    return len(image) * images
+
+
+def translate(ollama_data: dict) -> dict:
+    from src.routes.chat import translate_ollama_messages_to_openai
+    return {"model": ollama_data["model"], "messages": translate_ollama_messages_to_openai(ollama_data["messages"])}
+
+
+def run_regular(path: str) -> int:
+    with open(path, "rb") as f:
+        body = b"".join(iter(lambda: f.read(READ_SIZE), b""))
+    payload = translate(json.loads(body))
+    del body
+    # What httpx does with json=...
+    outgoing = json.dumps(payload).encode("utf-8")
+    return len(outgoing)
+
+
+def run_spilled(path: str) -> int:
+    from src.ingest import SpillingJSONReader, upstream_body_kwargs
+
+    reader = SpillingJSONReader(spill_threshold=64 * 1024, max_memory=4 * 1024 * 1024)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b""):
+            reader.feed(chunk)
+    data, spool = reader.finish()
+    body = upstream_body_kwargs(translate(data), spool)["content"]
+
+    async def drain():
+        sent = 0
+        async for part in body:
+            sent += len(part)
+        return sent
+
+    try:
+        return asyncio.run(drain())
+    finally:
+        spool.close()
+
+
+def child(mode: str, path: str):
+    # Warm imports so they do not count towards the measurement.
+    import src.ingest  # noqa: F401
+    import src.routes.chat  # noqa: F401
+    baseline = _status_kib("VmRSS")
+    started = time.perf_counter()
+    sent = (run_regular if mode == "regular" else run_spilled)(path)
+    elapsed = time.perf_counter() - started
+    peak = _status_kib("VmHWM")
+    print(json.dumps({"mode": mode, "sent": sent, "peak_growth_kib": peak - baseline, "seconds": elapsed}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--image-mb", type=float, default=8.0, help="base64 size of each image, in MB")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "body.json")
+        image_bytes = write_body(path, args.images, args.image_mb)
+        image_mb = image_bytes / (1024 * 1024)
+        print(f"{args.images} image(s), {image_mb:.1f} MB of base64 image data")
+        results = {}
+        for mode in ("regular", "spilled"):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_ingest_memory", "--child", mode, path],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            results[mode] = json.loads(out.strip().splitlines()[-1])
+
+        if results["regular"]["sent"] != results["spilled"]["sent"]:
+            print("WARNING: outgoing body sizes differ")
+        for mode, result in results.items():
+            growth_mb = result["peak_growth_kib"] / 1024
+            print(f"{mode:>8}: peak RSS +{growth_mb:7.1f} MB  "
+                  f"({growth_mb / image_mb:5.2f} MB per image-MB, {result['seconds'] * 1000:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+# benchmarks/bench_load.py
+"""
+End-to-end load benchmark against a fake LM Studio backend.
+
+Starts benchmarks.fake_backend and the shim (uvicorn) as subprocesses, then
+drives /api/chat and /api/generate, streaming and non-streaming, with and
+without images, and the /v1/chat/completions passthrough at a fixed
+concurrency. The same requests are also sent
+straight to the fake backend, so the backend's own TTFT and token pacing
+can be subtracted out and what remains is the latency the shim adds.
+
+Per scenario it reports throughput, p50/p99 added latency (time to first
+byte and total), shim CPU time per token and the shim's peak RSS. --json
+writes the results for regression tracking.
+
+Run from the project root:
+
+    python -m benchmarks.bench_load --requests 400 --concurrency 16 --ttft 0.02 --tps 500
+    python -m benchmarks.bench_load --scenarios chat-stream --fragment 5 --json results.json
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+
+import httpx
+
+from benchmarks.fake_backend import add_arguments, config_from_args
+
+SCENARIOS = {
+    # name: (route, stream, images)
+    "chat-stream": ("chat", True, False),
+    "chat": ("chat", False, False),
+    "chat-stream-images": ("chat", True, True),
+    "chat-images": ("chat", False, True),
+    "generate-stream": ("generate", True, False),
+    "generate": ("generate", False, False),
+    "generate-stream-images": ("generate", True, True),
+    "generate-images": ("generate", False, True),
+    # The OpenAI passthrough (/v1/chat/completions) sends the backend's request as is.
+    "openai-stream": ("openai", True, False),
+    "openai": ("openai", False, False),
+}
+MODEL = "bench-model"
+PROMPT = "Write a short story about a lighthouse."
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def proc_cpu_seconds(pid: int) -> float:
+    """utime + stime of a process, from /proc (Linux only)."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def proc_peak_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def percentile(values: list, fraction: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def wait_for_http(url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def build_requests(route: str, stream: bool, images: bool, tokens: int, image: str) -> tuple[dict, dict]:
+    """The Ollama request for the shim and the equivalent OpenAI request for the backend."""
+    options = {"num_predict": tokens}
+    content = [{"type": "text", "text": PROMPT}]
+    if images:
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image}"}})
+    openai = {"model": MODEL, "messages": [{"role": "user", "content": content}], "stream": stream,
+              "max_tokens": tokens}
+
+    if route == "chat":
+        message = {"role": "user", "content": PROMPT}
+        if images:
+            message["images"] = [image]
+        ollama = {"model": MODEL, "messages": [message], "stream": stream, "options": options}
+    else:
+        ollama = {"model": MODEL, "prompt": PROMPT, "stream": stream, "options": options}
+        if images:
+            ollama["images"] = [image]
+    return ollama, openai
+
+
+async def timed_request(client: httpx.AsyncClient, url: str, body: dict) -> tuple[float, float] | None:
+    """Returns (time to first body byte, total time), or None on failure."""
+    started = time.perf_counter()
+    first = None
+    try:
+        async with client.stream("POST", url, json=body) as response:
+            async for _ in response.aiter_raw():
+                if first is None:
+                    first = time.perf_counter() - started
+            if response.status_code != 200:
+                return None
+    except httpx.HTTPError:
+        return None
+    total = time.perf_counter() - started
+    return (first if first is not None else total), total
+
+
+async def drive(url: str, body: dict, requests: int, concurrency: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results = []
+    async with httpx.AsyncClient(limits=limits, timeout=120.0) as client:
+        remaining = iter(range(requests))
+
+        async def worker():
+            for _ in remaining:
+                results.append(await timed_request(client, url, body))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ok = [result for result in results if result is not None]
+    return {
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "seconds": elapsed,
+        "ttfb": [first for first, _ in ok],
+        "total": [total for _, total in ok],
+    }
+
+
+def run_scenario(name: str, args, shim: subprocess.Popen, shim_url: str, backend_url: str, image: str) -> dict:
+    route, stream, images = SCENARIOS[name]
+    ollama, openai = build_requests(route, stream, images, args.tokens, image)
+    if route == "openai":
+        shim_endpoint, shim_body = f"{shim_url}/v1/chat/completions", openai
+    else:
+        shim_endpoint, shim_body = f"{shim_url}/api/{route}", ollama
+
+    # Warm-up: connection pools, model discovery, lazy imports.
+    asyncio.run(drive(shim_endpoint, shim_body, args.concurrency, args.concurrency))
+
+    cpu = proc_cpu_seconds(shim.pid)
+    shim_run = asyncio.run(drive(shim_endpoint, shim_body, args.requests, args.concurrency))
+    cpu = proc_cpu_seconds(shim.pid) - cpu
+    direct = asyncio.run(drive(f"{backend_url}/v1/chat/completions", openai, args.requests, args.concurrency))
+
+    tokens = shim_run["ok"] * args.tokens
+    latency = {}
+    for metric in ("ttfb", "total"):
+        for label, fraction in (("p50", 0.50), ("p99", 0.99)):
+            shim_value = percentile(shim_run[metric], fraction)
+            direct_value = percentile(direct[metric], fraction)
+            latency[f"{metric}_{label}_ms"] = shim_value and shim_value * 1000
+            latency[f"added_{metric}_{label}_ms"] = (
+                (shim_value - direct_value) * 1000 if shim_value is not None and direct_value is not None else None
+            )
+
+    return {
+        "scenario": name,
+        "route": route,
+        "stream": stream,
+        "images": images,
+        "requests": args.requests,
+        "ok": shim_run["ok"],
+        "errors": shim_run["errors"],
+        "throughput_rps": shim_run["ok"] / shim_run["seconds"],
+        "tokens_per_second": tokens / shim_run["seconds"],
+        **latency,
+        "cpu_us_per_token": cpu / tokens * 1e6 if tokens else None,
+        "peak_rss_mb": proc_peak_rss_mb(shim.pid),
+    }
+
+
+def format_ms(value) -> str:
+    return "     -" if value is None else f"{value:6.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--image-kb", type=int, default=256, help="base64 size of the image, in KB")
+    parser.add_argument("--json", metavar="PATH", help="write machine-readable results here ('-' for stdout)")
+    parser.add_argument("--verbose", action="store_true", help="show the shim's log output")
+    add_arguments(parser)
+    args = parser.parse_args()
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    backend_config = config_from_args(args)
+    image = base64.b64encode(b"\x89PNG\r\n\x1a\n" + os.urandom(args.image_kb * 768)).decode("ascii")
+    backend_port, shim_port = free_port(), free_port()
+    backend_url = f"http://127.0.0.1:{backend_port}"
+    shim_url = f"http://127.0.0.1:{shim_port}"
+
+    backend_cmd = [sys.executable, "-m", "benchmarks.fake_backend", "--port", str(backend_port)]
+    for option in ("ttft", "tps", "tokens", "fragment", "fail_rate", "drop_rate"):
+        backend_cmd += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    env = dict(os.environ, LM_STUDIO_BASE_URL=backend_url, LM_STUDIO_BACKENDS="", SHIM_PORT=str(shim_port),
+               LOG_LEVEL="WARNING", FILE_LOG_LEVEL="WARNING")
+    shim_cmd = [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1", "--port", str(shim_port),
+                "--log-level", "warning", "--no-access-log"]
+
+    backend = subprocess.Popen(backend_cmd, stdout=subprocess.DEVNULL)
+    # Injected failures make the shim log tracebacks; keep them off the report unless asked.
+    shim = subprocess.Popen(shim_cmd, env=env, stderr=None if args.verbose else subprocess.DEVNULL)
+    results = []
+    try:
+        wait_for_http(f"{backend_url}/v1/models", backend)
+        wait_for_http(f"{shim_url}/", shim)
+        print(f"{args.requests} requests/scenario, concurrency {args.concurrency}, {args.tokens} tokens, "
+              f"ttft {args.ttft * 1000:.0f} ms, {args.tps or 'unpaced'} tok/s, fragment {args.fragment}")
+        print(f"{'scenario':>24} {'req/s':>8} {'+ttfb p50':>9} {'p99':>6} {'+total p50':>10} {'p99':>6} "
+              f"{'µs CPU/tok':>10} {'peak RSS':>9} {'errors':>6}")
+        for name in names:
+            result = run_scenario(name, args, shim, shim_url, backend_url, image)
+            results.append(result)
+            print(f"{name:>24} {result['throughput_rps']:8.1f} "
+                  f"{format_ms(result['added_ttfb_p50_ms']):>9} {format_ms(result['added_ttfb_p99_ms'])} "
+                  f"{format_ms(result['added_total_p50_ms']):>10} {format_ms(result['added_total_p99_ms'])} "
+                  f"{result['cpu_us_per_token'] or 0:10.1f} {result['peak_rss_mb']:7.1f}MB {result['errors']:6d}")
+    finally:
+        for process in (shim, backend):
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    if args.json:
+        report = {
+            "benchmark": "bench_load",
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "settings": {"requests": args.requests, "concurrency": args.concurrency, "image_kb": args.image_kb,
+                         "backend": asdict(backend_config)},
+            "results": results,
+        }
+        output = json.dumps(report, indent=2)
+        if args.json == "-":
+            print(output)
+        else:
+            with open(args.json, "w") as f:
+                f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# benchmarks/bench_ndjson_encoder.py
+"""
+Microbenchmark for the per-token work in stream_translator.
+
+Compares the original per-event code (json.loads, a fresh dict, a
+datetime-based timestamp, json.dumps and a debug f-string) with
+src.ndjson (orjson parsing when installed, ChunkEncoder, coarse clock),
+reporting ns per token. Also times the full stream_translator over
+pre-framed SSE bytes.
+
+Run from the project root:
+
+    python -m benchmarks.bench_ndjson_encoder --tokens 200000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+os.environ.setdefault("SHIM_PORT", "11434")
+
+from src import ndjson  # noqa: E402
+from src.ndjson import ChunkEncoder  # noqa: E402
+from src.utils import stream_translator, get_iso_timestamp  # noqa: E402
+
+SAMPLE_TOKENS = ["The", " quick", " brown", " fox", " jumps", " över", " the", " lazy", " 犬", " 🦙", "."]
+MODEL = "mistralai/magistral-small-2509"
+
+logger = logging.getLogger("bench")
+logger.setLevel(logging.INFO)
+
+
+def build_events(n_tokens: int) -> list:
+    return [
+        json.dumps({
+            "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 1720000001, "model": MODEL,
+            "choices": [{"index": 0, "delta": {"content": SAMPLE_TOKENS[i % len(SAMPLE_TOKENS)]},
+                         "finish_reason": None}],
+        })
+        for i in range(n_tokens)
+    ]
+
+
+def legacy(events: list) -> int:
+    """The pre-ChunkEncoder per-token code from stream_translator."""
+    out = 0
+    for event_data in events:
+        openai_chunk = json.loads(event_data)
+        content = openai_chunk["choices"][0].get("delta", {}).get("content")
+        ollama_chunk = {
+            "model": MODEL,
+            "created_at": get_iso_timestamp(),
+            "message": {"role": "assistant", "content": content},
+            "done": False
+        }
+        logger.debug(f"Streaming chunk: {ollama_chunk}")
+        out += len(json.dumps(ollama_chunk) + "\n")
+    return out
+
+
+def fast(events: list) -> int:
+    encoder = ChunkEncoder("chat", MODEL)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    out = 0
+    for event_data in events:
+        openai_chunk = ndjson.loads(event_data)
+        content = openai_chunk["choices"][0].get("delta", {}).get("content")
+        line = encoder.token(content)
+        if debug:
+            logger.debug(f"Streaming chunk: {line!r}")
+        out += len(line)
+    return out
+
+
+class FakeStream:
+    def __init__(self, body: bytes, chunk_size: int = 4096):
+        self.chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+
+    async def aiter_bytes(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def aclose(self):
+        pass
+
+
+async def drain(stream) -> int:
+    lines = 0
+    async for _ in stream_translator(stream, "chat", MODEL):
+        lines += 1
+    return lines
+
+
+def timed(fn, *args) -> float:
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    events = build_events(args.tokens)
+    body = "".join(f"data: {e}\n\n" for e in events).encode() + b"data: [DONE]\n\n"
+    print(f"{args.tokens} tokens, JSON backend: {'orjson' if ndjson.orjson else 'json'}")
+
+    best = {
+        "legacy": min(timed(legacy, events) for _ in range(args.repeat)),
+        "encoder": min(timed(fast, events) for _ in range(args.repeat)),
+        "stream_translator": min(timed(asyncio.run, drain(FakeStream(body))) for _ in range(args.repeat)),
+    }
+    for name, seconds in best.items():
+        print(f"{name:>18}: {seconds / args.tokens * 1e9:8.0f} ns/token")
+    print(f"{'speed-up':>18}: {best['legacy'] / best['encoder']:8.2f}x (per-token encode path)")
+
+
+if __name__ == "__main__":
+    main()
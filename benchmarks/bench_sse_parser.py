@@ -0,0 +1,128 @@
+# benchmarks/bench_sse_parser.py
+"""
+Microbenchmark for the upstream SSE framing in stream_translator.
+
+Compares the original per-chunk `decode()` + `splitlines()` approach with
+src.sse.SSEParser, reporting CPU time per token and how many tokens each
+approach loses when the stream is split at random byte boundaries.
+
+Run from the project root:
+
+    python -m benchmarks.bench_sse_parser --tokens 20000 --max-chunk 64
+"""
+
+import argparse
+import json
+import random
+import time
+
+from src.sse import SSEParser
+
+SAMPLE_TOKENS = ["The", " quick", " brown", " fox", " jumps", " över", " the", " lazy", " 犬", " 🦙", "."]
+
+
+def build_body(n_tokens: int) -> tuple:
+    tokens = [SAMPLE_TOKENS[i % len(SAMPLE_TOKENS)] for i in range(n_tokens)]
+    events = [
+        "data: " + json.dumps({"id": "x", "choices": [{"index": 0, "delta": {"content": t}}]}, ensure_ascii=False) + "\n\n"
+        for t in tokens
+    ]
+    events.append("data: [DONE]\n\n")
+    return tokens, "".join(events).encode("utf-8")
+
+
+def split(body: bytes, max_chunk: int, seed: int) -> list:
+    rng = random.Random(seed)
+    chunks, i = [], 0
+    while i < len(body):
+        step = rng.randint(1, max_chunk)
+        chunks.append(body[i:i + step])
+        i += step
+    return chunks
+
+
+def legacy_parse(chunks: list) -> list:
+    """The pre-SSEParser logic from stream_translator."""
+    out = []
+    for chunk in chunks:
+        try:
+            chunk_str = chunk.decode("utf-8")
+        except UnicodeDecodeError:
+            continue
+        for line in chunk_str.splitlines():
+            if line.startswith("data: "):
+                line = line[6:]
+            if line.strip() == "[DONE]":
+                break
+            if not line.strip():
+                continue
+            try:
+                content = json.loads(line)["choices"][0]["delta"].get("content")
+            except (ValueError, LookupError, TypeError, AttributeError):
+                continue
+            if content:
+                out.append(content)
+    return out
+
+
+def incremental_parse(chunks: list) -> list:
+    out = []
+    parser = SSEParser()
+    for chunk in chunks:
+        for data in parser.feed(chunk):
+            if data == "[DONE]":
+                return out
+            content = json.loads(data)["choices"][0]["delta"].get("content")
+            if content:
+                out.append(content)
+    return out
+
+
+def framing_only(chunks: list) -> int:
+    """SSEParser without the json.loads cost, to isolate framing overhead."""
+    parser = SSEParser()
+    n = 0
+    for chunk in chunks:
+        n += len(parser.feed(chunk))
+    return n
+
+
+def measure(fn, chunks, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time_ns()
+        fn(chunks)
+        best = min(best, time.process_time_ns() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=20000)
+    parser.add_argument("--max-chunk", type=int, default=64, help="Largest random chunk size in bytes.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tokens, body = build_body(args.tokens)
+    chunks = split(body, args.max_chunk, args.seed)
+    whole = [body]
+
+    print(f"{args.tokens} tokens, {len(body)} bytes, {len(chunks)} chunks (max {args.max_chunk} B)")
+    print(f"{'variant':<32}{'ns/token':>12}{'tokens out':>14}{'correct':>10}")
+    for name, fn, data in [
+        ("legacy, single chunk", legacy_parse, whole),
+        ("legacy, random chunks", legacy_parse, chunks),
+        ("SSEParser, single chunk", incremental_parse, whole),
+        ("SSEParser, random chunks", incremental_parse, chunks),
+    ]:
+        ns = measure(fn, data, args.repeat)
+        got = fn(data)
+        print(f"{name:<32}{ns / args.tokens:>12.0f}{len(got):>14}{str(got == tokens):>10}")
+
+    ns = measure(framing_only, chunks, args.repeat)
+    print(f"{'SSEParser framing only':<32}{ns / args.tokens:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# benchmarks/bench_stream_flush.py
+"""
+Benchmark for stream flush policies.
+
+Runs stream_translator over a pre-framed upstream body with different
+flush policies and writes every yielded chunk to a real socket, framed the
+way an HTTP/1.1 chunked response is. Reports socket writes (one send()
+syscall each) and process CPU time per token.
+
+Run from the project root:
+
+    python -m benchmarks.bench_stream_flush --tokens 50000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+
+os.environ.setdefault("SHIM_PORT", "11434")
+
+from src.flush import FlushPolicy  # noqa: E402
+from src.utils import stream_translator  # noqa: E402
+
+POLICIES = ["token", "tokens=16", "bytes=4096", "ms=50", "tokens=64,bytes=8192,ms=100"]
+SAMPLE_TOKENS = ["The", " quick", " brown", " fox", " jumps", " over", " the", " lazy", " dog", "."]
+
+
+class FakeStream:
+    def __init__(self, events: list):
+        self.events = events
+
+    async def aiter_bytes(self):
+        for event in self.events:
+            yield event
+
+    async def aclose(self):
+        pass
+
+
+def build_events(n_tokens: int) -> list:
+    events = [
+        ("data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": SAMPLE_TOKENS[i % 10]}}]}) + "\n\n").encode()
+        for i in range(n_tokens)
+    ]
+    return events + [b"data: [DONE]\n\n"]
+
+
+def drain_socket(sock: socket.socket):
+    while sock.recv(1 << 20):
+        pass
+
+
+async def relay(events: list, policy: FlushPolicy, sock: socket.socket) -> int:
+    writes = 0
+    async for data in stream_translator(FakeStream(events), "chat", "bench-model", flush_policy=policy):
+        # HTTP/1.1 chunked framing, as h11 writes it.
+        sock.sendall(b"%x\r\n%s\r\n" % (len(data), data))
+        writes += 1
+    return writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=50000)
+    args = parser.parse_args()
+
+    events = build_events(args.tokens)
+    print(f"{args.tokens} tokens per run")
+    baseline = None
+    for spec in POLICIES:
+        writer, reader = socket.socketpair()
+        thread = threading.Thread(target=drain_socket, args=(reader,), daemon=True)
+        thread.start()
+        cpu = time.process_time()
+        writes = asyncio.run(relay(events, FlushPolicy.parse(spec), writer))
+        cpu = time.process_time() - cpu
+        writer.close()
+        thread.join()
+        reader.close()
+        baseline = baseline or cpu
+        print(f"{spec:>28}: {writes:7d} writes  {cpu / args.tokens * 1e9:7.0f} ns CPU/token  "
+              f"({baseline / cpu:4.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
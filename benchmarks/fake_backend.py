@@ -0,0 +1,188 @@
+# benchmarks/fake_backend.py
+"""
+Fake OpenAI-compatible backend (LM Studio stand-in) for benchmarks.
+
+A deliberately small asyncio HTTP/1.1 server, so the backend itself costs
+next to nothing and the shim's overhead is what gets measured. It serves
+GET /v1/models and POST /v1/chat/completions (streaming and not), with a
+configurable time to first token, token rate, SSE fragmentation and
+failure injection.
+
+Run standalone:
+
+    python -m benchmarks.fake_backend --port 1234 --ttft 0.05 --tps 100 --fragment 7
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, asdict
+
+TOKEN = " lorem"
+
+
+@dataclass
+class FakeBackendConfig:
+    model: str = "bench-model"
+    # Seconds before the first token (prefill).
+    ttft: float = 0.0
+    # Tokens per second per request; 0 sends them as fast as possible.
+    tps: float = 0.0
+    # Completion length when the request does not set max_tokens.
+    tokens: int = 64
+    # Split each SSE event into writes of at most this many bytes (0 = whole events).
+    fragment: int = 0
+    # Probability of answering 500, and of dropping a stream half-way.
+    fail_rate: float = 0.0
+    drop_rate: float = 0.0
+    seed: int = 0
+
+
+class FakeBackend:
+    def __init__(self, config: FakeBackendConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.server = None
+        self.requests = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self.server = await asyncio.start_server(self._serve, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+
+                if method == "GET" and path.startswith("/v1/models"):
+                    await self._send_json(writer, 200, {"object": "list", "data": [
+                        {"id": self.config.model, "object": "model", "owned_by": "bench"}]})
+                elif method == "POST" and path.startswith("/v1/chat/completions"):
+                    if not await self._chat(writer, json.loads(body)):
+                        return
+                else:
+                    await self._send_json(writer, 404, {"error": "not found"})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_json(self, writer, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def _chat(self, writer, payload: dict) -> bool:
+        """Answers one completion; returns False if the connection was dropped."""
+        config = self.config
+        if config.fail_rate and self.rng.random() < config.fail_rate:
+            await self._send_json(writer, 500, {"error": "injected failure"})
+            return True
+
+        n_tokens = payload.get("max_tokens") or config.tokens
+        interval = 1 / config.tps if config.tps else 0.0
+        if config.ttft:
+            await asyncio.sleep(config.ttft)
+
+        if not payload.get("stream"):
+            if interval:
+                await asyncio.sleep(interval * (n_tokens - 1))
+            await self._send_json(writer, 200, {
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                "model": payload.get("model", config.model),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": TOKEN * n_tokens},
+                             "finish_reason": "length"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": n_tokens, "total_tokens": 10 + n_tokens},
+            })
+            return True
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        drop_at = n_tokens // 2 if config.drop_rate and self.rng.random() < config.drop_rate else None
+        model = json.dumps(payload.get("model", config.model))
+        started = time.perf_counter()
+        for i in range(n_tokens):
+            if i == drop_at:
+                writer.transport.abort()
+                return False
+            event = ('data: {"id":"chatcmpl-bench","object":"chat.completion.chunk","model":' + model +
+                     ',"choices":[{"index":0,"delta":{"content":"' + TOKEN + '"},"finish_reason":null}]}\n\n').encode()
+            await self._write_event(writer, event)
+            if interval:
+                # Paced against the start, so timer slack does not accumulate.
+                delay = started + (i + 1) * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        if payload.get("stream_options", {}).get("include_usage"):
+            usage = {"prompt_tokens": 10, "completion_tokens": n_tokens, "total_tokens": 10 + n_tokens}
+            await self._write_event(writer, ("data: " + json.dumps({"choices": [], "usage": usage}) + "\n\n").encode())
+        await self._write_event(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    async def _write_event(self, writer, event: bytes):
+        step = self.config.fragment
+        pieces = [event] if not step else [event[i:i + step] for i in range(0, len(event), step)]
+        for piece in pieces:
+            writer.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+            if step:
+                await writer.drain()
+        await writer.drain()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    defaults = FakeBackendConfig()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft, help="seconds before the first token")
+    parser.add_argument("--tps", type=float, default=defaults.tps, help="tokens/s per request (0 = unpaced)")
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="completion length")
+    parser.add_argument("--fragment", type=int, default=defaults.fragment, help="max bytes per SSE write")
+    parser.add_argument("--fail-rate", type=float, default=defaults.fail_rate, help="fraction answered with 500")
+    parser.add_argument("--drop-rate", type=float, default=defaults.drop_rate, help="fraction of streams cut off")
+
+
+def config_from_args(args) -> FakeBackendConfig:
+    return FakeBackendConfig(ttft=args.ttft, tps=args.tps, tokens=args.tokens, fragment=args.fragment,
+                             fail_rate=args.fail_rate, drop_rate=args.drop_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    add_arguments(parser)
+    args = parser.parse_args()
+    config = config_from_args(args)
+
+    async def serve():
+        backend = FakeBackend(config)
+        port = await backend.start(args.host, args.port)
+        print(f"Fake backend on http://{args.host}:{port} {json.dumps(asdict(config))}", flush=True)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 #!/bin/bash
-# Development script to start Ollama Shim
-# For production, use systemd service (see ollama-shim.service)
+# Script to start Ollama Shim (development mode unless --production is given)
+# For production deployments, use systemd service (see ollama-shim.service)
 
 # Get the script's directory and project root
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
@@ -9,7 +9,7 @@ PROJECT_ROOT="$(dirname "$SCRIPT_DIR")"
 cd "$PROJECT_ROOT" || exit 1
 
 # Check if already running
-if pgrep -f "uvicorn src.main:app" > /dev/null; then
+if pgrep -f "uvicorn src.main:app|python -m src.main" > /dev/null; then
     echo "Error: Ollama Shim appears to be already running"
     echo "Use stop.sh to stop it first, or run: pkill -f 'uvicorn src.main:app'"
     exit 1
@@ -31,9 +31,17 @@ if [ ! -f .env ]; then
 fi
 
 # Start server (Python/pydantic handles .env loading and validation)
-echo "Starting Ollama Shim in development mode..."
+# Usage: run.sh [--production]   (or set SHIM_MODE=production in .env)
+if [ "$1" = "--production" ]; then
+    echo "Starting Ollama Shim in production mode..."
+    MODE_ARGS="--mode production"
+else
+    echo "Starting Ollama Shim (SHIM_MODE from .env, development by default)..."
+    MODE_ARGS=""
+fi
 echo "Press Ctrl+C to stop the server."
 echo ""
 
-# Run in foreground with auto-reload for development
-python -m uvicorn src.main:app --host 0.0.0.0 --reload
+# Runs in the foreground; development mode auto-reloads, production mode
+# uses the worker/keep-alive/drain settings from .env (see src/server.py).
+python -m src.main $MODE_ARGS
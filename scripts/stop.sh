@@ -4,24 +4,27 @@
 
 echo "Stopping Ollama Shim..."
 
-if ! pgrep -f "uvicorn src.main:app" > /dev/null; then
+if ! pgrep -f "uvicorn src.main:app|python -m src.main" > /dev/null; then
     echo "Ollama Shim is not running."
     exit 0
 fi
 
-# Kill the process
-pkill -f "uvicorn src.main:app"
+# SIGTERM lets in-flight streams finish (up to SHIM_DRAIN_TIMEOUT in production mode)
+pkill -f "uvicorn src.main:app|python -m src.main"
 
-# Wait a moment and verify
-sleep 1
+# Wait for the drain and verify
+for _ in $(seq 1 "${SHIM_DRAIN_TIMEOUT:-30}"); do
+    pgrep -f "uvicorn src.main:app|python -m src.main" > /dev/null || break
+    sleep 1
+done
 
-if pgrep -f "uvicorn src.main:app" > /dev/null; then
+if pgrep -f "uvicorn src.main:app|python -m src.main" > /dev/null; then
     echo "Warning: Process still running. Forcing shutdown..."
-    pkill -9 -f "uvicorn src.main:app"
+    pkill -9 -f "uvicorn src.main:app|python -m src.main"
     sleep 1
 fi
 
-if pgrep -f "uvicorn src.main:app" > /dev/null; then
+if pgrep -f "uvicorn src.main:app|python -m src.main" > /dev/null; then
     echo "Error: Failed to stop Ollama Shim"
     exit 1
 else
@@ -2,7 +2,6 @@ import httpx
 import asyncio
 import json
 from datetime import datetime
-import re
 from fastapi import HTTPException
 from config import PRIMARY_MODEL_URL, API_TIMEOUT, RESPONSE_TIMEOUT, LM_STUDIO_BASE_URL
 
@@ -21,25 +20,6 @@ def map_ollama_options_to_openai(ollama_options: dict) -> dict:
         openai_params["max_tokens"] = ollama_options["num_predict"]
     return openai_params
 
-def parse_model_id(model_id: str) -> dict:
-    """Parses a model ID to extract parameter size and quantization level."""
-    details = {
-        "parameter_size": "N/A",
-        "quantization_level": "N/A",
-    }
-
-    # Look for parameter size like 7b, 13b, 70b
-    param_match = re.search(r'(\d+b)', model_id, re.IGNORECASE)
-    if param_match:
-        details["parameter_size"] = param_match.group(1).upper()
-
-    # Look for quantization level like Q4_K_M, Q5_0
-    quant_match = re.search(r'(q\d(_[a-z_]+)?)', model_id, re.IGNORECASE)
-    if quant_match:
-        details["quantization_level"] = quant_match.group(1).upper()
-
-    return details
-
 async def stream_and_transform_llm_response(payload: dict):
     """Streams response from LLM, transforms it to Ollama format, and yields it."""
     model_name = payload.get("model", "unknown_model")
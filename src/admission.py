@@ -0,0 +1,128 @@
+# src/admission.py
+
+# Per-backend admission control.
+#
+# LM Studio thrashes when it is handed dozens of concurrent generations, and
+# then every caller's latency collapses. Each backend therefore only runs a
+# bounded number of requests at once; the rest wait in a bounded priority
+# queue, and requests that cannot be queued (or wait too long) are rejected
+# right away with a Retry-After hint instead of piling up.
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted to a backend."""
+
+    def __init__(self, status_code: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def request_priority(headers, ollama_data: dict, large_request_tokens: int) -> int:
+    """
+    Works out a request's priority class.
+
+    An explicit 'X-Priority' header (high, normal, low) wins. Otherwise
+    requests asking for a lot of output (a large or unlimited 'num_predict')
+    are treated as low priority so they do not hold up short interactive ones.
+    """
+    header = (headers.get("x-priority") or "").strip().lower()
+    if header in PRIORITIES:
+        return PRIORITIES[header]
+
+    num_predict = (ollama_data.get("options") or {}).get("num_predict")
+    if isinstance(num_predict, int) and (num_predict < 0 or num_predict >= large_request_tokens):
+        return PRIORITIES["low"]
+    return PRIORITIES["normal"]
+
+
+class AdmissionController:
+    """
+    Concurrency limiter with a bounded priority wait queue.
+
+    Slots are handed directly from a finishing request to the highest
+    priority waiter (FIFO within a class), so a newcomer can never jump the
+    queue. A 'max_concurrency' of 0 disables the limit.
+    """
+
+    def __init__(self, max_concurrency: int = 0, max_queue: int = 32, queue_timeout: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # (priority, sequence, future); futures abandoned by their waiter
+        # are skipped when popped.
+        self._queue = []
+        self._sequence = itertools.count()
+        # Moving average of how long a request holds its slot, used for the
+        # Retry-After estimate.
+        self._avg_hold = 1.0
+
+    async def acquire(self, priority: int = PRIORITIES["normal"]) -> float:
+        """
+        Waits for a slot and returns the time spent queued, in seconds.
+        Raises AdmissionRejected if the queue is full or the wait times out.
+        """
+        if self.max_concurrency <= 0 or (self.active < self.max_concurrency and not self.waiting):
+            self.active += 1
+            return 0.0
+
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(429, "Backend is at capacity and its queue is full.", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), future))
+        self.waiting += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise AdmissionRejected(503, "Timed out waiting for a backend slot.", self.retry_after()) from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled.
+                self.release()
+            raise
+        finally:
+            if not future.done() or future.cancelled():
+                self.waiting -= 1
+        return time.monotonic() - started
+
+    def release(self, held_for: float | None = None):
+        """Frees a slot, handing it to the next waiter if there is one."""
+        if held_for is not None:
+            self._avg_hold += 0.2 * (held_for - self._avg_hold)
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                self.waiting -= 1
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def retry_after(self) -> int:
+        """Rough number of seconds until a slot frees up for a new request."""
+        slots = max(self.max_concurrency, 1)
+        return max(1, math.ceil(self._avg_hold * (self.waiting + 1) / slots))
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
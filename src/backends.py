@@ -0,0 +1,348 @@
+# src/backends.py
+
+# Pool of LM Studio backends.
+#
+# The shim can spread load over several LM Studio hosts. Each backend has a
+# weight and an in-flight request counter; requests go to the backend with
+# the fewest outstanding requests relative to its weight (or the better of
+# two random picks, for large pools).
+#
+# Each backend also has a circuit breaker. It opens on a run of consecutive
+# failures or a high error rate over recent requests (connection errors,
+# timeouts, 5xx), and while it is open requests for that backend are refused
+# at once with BackendUnavailable (503) instead of each waiting for a
+# connect timeout. After a cooldown, or as soon as the health prober
+# (health.py) gets an answer, the circuit goes half-open: one trial request
+# is let through, and its outcome closes or re-opens the circuit.
+#
+# The pool also keeps an index of which models each backend has loaded (fed
+# by the model discovery in catalog.py), so requests can be routed to a host
+# that already has the model resident instead of forcing a slow model swap.
+
+import math
+import random
+import time
+from collections import deque
+
+from .config import settings, logger
+from .admission import AdmissionController
+from .metrics import model_labels
+
+
+class NoBackendAvailable(Exception):
+    """Raised when no backend can take a request."""
+
+
+class BackendUnavailable(Exception):
+    """Raised when every backend that could take a request has an open circuit."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+CIRCUIT_STATES = (CLOSED, HALF_OPEN, OPEN)
+
+
+class Backend:
+    """One LM Studio instance and its live load / health state."""
+
+    __slots__ = ("base_url", "weight", "in_flight", "consecutive_failures", "unhealthy_until",
+                 "total_requests", "total_failures", "chat_completions_url", "models_url",
+                 "embeddings_url", "models", "models_updated_at", "admission",
+                 "circuit", "outcomes", "trial_in_flight", "last_probe")
+
+    def __init__(self, base_url: str, weight: float = 1.0):
+        self.base_url = base_url.rstrip('/')
+        self.weight = weight
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        # While the circuit is open: when it may go half-open.
+        self.unhealthy_until = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.chat_completions_url = f"{self.base_url}/v1/chat/completions"
+        self.models_url = f"{self.base_url}/v1/models"
+        self.embeddings_url = f"{self.base_url}/v1/embeddings"
+        # Model ids last reported by the backend's /v1/models; None until discovered.
+        self.models = None
+        self.models_updated_at = 0.0
+        # Concurrency limit and wait queue; unlimited unless the pool sets one.
+        self.admission = AdmissionController()
+        # Circuit breaker state; 'outcomes' holds recent results (True = failed).
+        self.circuit = CLOSED
+        self.outcomes = deque(maxlen=20)
+        self.trial_in_flight = False
+        # Result of the last health probe: None until probed, else (ok, monotonic time).
+        self.last_probe = None
+
+    def __repr__(self):
+        return f"Backend({self.base_url!r}, weight={self.weight})"
+
+    def circuit_state(self, now: float | None = None) -> str:
+        """The circuit state, moving an open circuit to half-open once its cooldown is over."""
+        if self.circuit == OPEN and self.unhealthy_until <= (time.monotonic() if now is None else now):
+            self.circuit = HALF_OPEN
+        return self.circuit
+
+    def is_healthy(self, now: float | None = None) -> bool:
+        """Whether the circuit lets requests through (closed, or half-open without a trial running)."""
+        state = self.circuit_state(now)
+        return state == CLOSED or (state == HALF_OPEN and not self.trial_in_flight)
+
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def load(self) -> float:
+        """Outstanding requests relative to the backend's weight."""
+        return (self.in_flight + 1) / self.weight
+
+    def stats(self) -> dict:
+        return {
+            "url": self.base_url,
+            "weight": self.weight,
+            "healthy": self.is_healthy(),
+            "circuit": self.circuit_state(),
+            "error_rate": round(self.error_rate(), 3),
+            "last_probe": None if self.last_probe is None else {
+                "ok": self.last_probe[0], "seconds_ago": round(time.monotonic() - self.last_probe[1], 1)},
+            "in_flight": self.in_flight,
+            "total_requests": self.total_requests,
+            "total_failures": self.total_failures,
+            "consecutive_failures": self.consecutive_failures,
+            "models": sorted(self.models) if self.models is not None else None,
+            "admission": self.admission.stats(),
+        }
+
+
+class BackendPool:
+    """
+    Selects a backend per request and tracks its outstanding requests.
+
+    Call acquire() to pick a backend and count the request against it, then
+    release() exactly once when the request (including any stream) is over.
+    Admission to the backend itself goes through its 'admission' controller.
+    """
+
+    STRATEGIES = ("least_outstanding", "p2c")
+    # What to do with a request for a model no backend reports as loaded:
+    # "any" sends it to any backend (which may load the model on demand),
+    # "reject" refuses it.
+    FALLBACK_POLICIES = ("any", "reject")
+
+    def __init__(self, backends: list, strategy: str = "least_outstanding",
+                 failure_threshold: int = 3, cooldown: float = 30.0, fallback: str = "any",
+                 max_concurrency: int = 0, max_queue: int = 32, queue_timeout: float = 30.0,
+                 error_rate: float = 0.5, error_window: int = 20):
+        if not backends:
+            raise ValueError("A backend pool needs at least one backend.")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown backend selection strategy: {strategy!r}")
+        if fallback not in self.FALLBACK_POLICIES:
+            raise ValueError(f"Unknown model routing fallback policy: {fallback!r}")
+        self.backends = backends
+        self.fallback = fallback
+        # model id -> backends reporting it as loaded
+        self.model_index = {}
+        for backend in backends:
+            backend.admission = AdmissionController(max_concurrency, max_queue, queue_timeout)
+            backend.outcomes = deque(maxlen=max(1, error_window))
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        # Error rate over the last 'error_window' outcomes that opens the
+        # circuit, judged once at least half the window has been seen.
+        self.error_rate = error_rate
+        self.error_window = max(1, error_window)
+
+    @classmethod
+    def from_settings(cls, settings) -> "BackendPool":
+        return cls(
+            parse_backends(settings.LM_STUDIO_BACKENDS or settings.LM_STUDIO_BASE_URL),
+            strategy=settings.BACKEND_SELECTION,
+            failure_threshold=settings.BACKEND_FAILURE_THRESHOLD,
+            cooldown=settings.BACKEND_COOLDOWN,
+            fallback=settings.MODEL_ROUTING_FALLBACK,
+            max_concurrency=settings.BACKEND_MAX_CONCURRENCY,
+            max_queue=settings.ADMISSION_QUEUE_SIZE,
+            queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+            error_rate=settings.BACKEND_ERROR_RATE,
+            error_window=settings.BACKEND_ERROR_WINDOW,
+        )
+
+    @property
+    def primary(self) -> Backend:
+        return self.backends[0]
+
+    def healthy_backends(self) -> list:
+        now = time.monotonic()
+        return [b for b in self.backends if b.is_healthy(now)]
+
+    def update_models(self, backend: Backend, model_ids):
+        """Records the models a backend reported and rebuilds the index."""
+        backend.models = frozenset(model_ids)
+        backend.models_updated_at = time.monotonic()
+        index = {}
+        for b in self.backends:
+            for model_id in b.models or ():
+                index.setdefault(model_id, []).append(b)
+        self.model_index = index
+        # Reported models always get their own metrics label.
+        model_labels.known = frozenset(index)
+
+    def candidates_for(self, model: str | None) -> list:
+        """
+        Returns the backends a request for 'model' may be sent to: those that
+        have it loaded, or else whatever the fallback policy allows.
+        """
+        if not model or not self.model_index:
+            # Nothing discovered yet; every backend is a candidate.
+            return self.backends
+        candidates = self.model_index.get(model)
+        if candidates:
+            return candidates
+        if self.fallback == "reject":
+            raise NoBackendAvailable(f"model '{model}' not found on any backend")
+        return self.backends
+
+    def select(self, candidates: list | None = None) -> Backend:
+        """Picks a backend from 'candidates' (default: the whole pool)."""
+        candidates = self.backends if candidates is None else candidates
+        if not candidates:
+            raise NoBackendAvailable("No backend is configured for this request.")
+
+        now = time.monotonic()
+        healthy = [b for b in candidates if b.is_healthy(now)]
+        if not healthy:
+            # Every candidate's circuit is open (or busy with its trial
+            # request): refuse now rather than wait on a dead backend.
+            retry_after = min(max(b.unhealthy_until - now, 1.0) for b in candidates)
+            raise BackendUnavailable(
+                f"LM Studio backend unavailable (circuit open for {', '.join(b.base_url for b in candidates)}); "
+                f"retry in {math.ceil(retry_after)}s.",
+                retry_after=math.ceil(retry_after),
+            )
+        if len(healthy) == 1:
+            return healthy[0]
+
+        if self.strategy == "p2c":
+            # Two distinct backends, weighted, without replacement; a repeat
+            # pick would skip the comparison.
+            first = random.choices(healthy, weights=[b.weight for b in healthy])[0]
+            others = [b for b in healthy if b is not first]
+            second = random.choices(others, weights=[b.weight for b in others])[0]
+            return first if first.load() <= second.load() else second
+
+        best_load = min(b.load() for b in healthy)
+        return random.choice([b for b in healthy if b.load() == best_load])
+
+    def acquire(self, candidates: list | None = None) -> Backend:
+        backend = self.select(candidates)
+        backend.in_flight += 1
+        backend.total_requests += 1
+        if backend.circuit == HALF_OPEN:
+            # This request is the trial; others are refused until it is over.
+            backend.trial_in_flight = True
+        return backend
+
+    def release(self, backend: Backend, ok: bool | None = True):
+        """
+        Ends a request, recording its outcome; 'ok' is None when it says
+        nothing about the backend (e.g. it was cancelled, or its success
+        was already recorded).
+        """
+        backend.in_flight -= 1
+        if ok is None:
+            # An unfinished trial makes way for the next request.
+            if backend.circuit == HALF_OPEN:
+                backend.trial_in_flight = False
+        elif ok:
+            self.record_success(backend)
+        else:
+            self.record_failure(backend)
+
+    def record_success(self, backend: Backend):
+        backend.consecutive_failures = 0
+        backend.outcomes.append(False)
+        if backend.circuit != CLOSED:
+            logger.info(f"Backend {backend.base_url} answered again; closing its circuit.")
+            self._close(backend)
+
+    def record_failure(self, backend: Backend):
+        backend.total_failures += 1
+        backend.consecutive_failures += 1
+        backend.outcomes.append(True)
+        state = backend.circuit_state()
+        if state == HALF_OPEN:
+            self._open(backend, "its trial request failed")
+        elif state == CLOSED:
+            if backend.consecutive_failures >= self.failure_threshold:
+                self._open(backend, f"it failed {backend.consecutive_failures} time(s) in a row")
+            elif (len(backend.outcomes) * 2 >= self.error_window
+                  and backend.error_rate() >= self.error_rate):
+                self._open(backend, f"{backend.error_rate():.0%} of its recent requests failed")
+
+    def record_probe(self, backend: Backend, ok: bool):
+        """Feeds a health probe result into the backend's circuit."""
+        backend.last_probe = (ok, time.monotonic())
+        if not ok:
+            self.record_failure(backend)
+        elif backend.circuit_state() == OPEN:
+            # It answers again: let the next request through as the trial
+            # instead of waiting out the cooldown.
+            logger.info(f"Health probe reached {backend.base_url}; circuit half-open.")
+            backend.circuit = HALF_OPEN
+            backend.unhealthy_until = 0.0
+
+    def _open(self, backend: Backend, reason: str):
+        backend.circuit = OPEN
+        backend.trial_in_flight = False
+        backend.unhealthy_until = time.monotonic() + self.cooldown
+        logger.warning(f"Opening the circuit for backend {backend.base_url} for {self.cooldown:.0f}s: {reason}.")
+
+    def _close(self, backend: Backend):
+        backend.circuit = CLOSED
+        backend.trial_in_flight = False
+        backend.unhealthy_until = 0.0
+        backend.outcomes.clear()
+
+    def reset_health(self):
+        """Closes every circuit and forgets recorded outcomes."""
+        for backend in self.backends:
+            backend.consecutive_failures = 0
+            self._close(backend)
+
+    def is_ready(self) -> bool:
+        """Whether at least one backend's circuit is not open."""
+        now = time.monotonic()
+        return any(b.circuit_state(now) != OPEN for b in self.backends)
+
+    def stats(self) -> list:
+        return [b.stats() for b in self.backends]
+
+    def index_snapshot(self) -> dict:
+        """The model -> backend URLs routing index, for inspection."""
+        return {model: [b.base_url for b in backends] for model, backends in sorted(self.model_index.items())}
+
+
+def parse_backends(spec: str) -> list:
+    """
+    Parses a comma-separated backend list. Each entry is a base URL,
+    optionally followed by '|<weight>', e.g.
+    "http://gpu1:1234|2,http://gpu2:1234".
+    """
+    backends = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        url, _, weight = entry.partition("|")
+        weight = float(weight) if weight else 1.0
+        if weight <= 0:
+            raise ValueError(f"Backend weight must be positive: {entry!r}")
+        backends.append(Backend(url.strip(), weight))
+    return backends
+
+
+backend_pool = BackendPool.from_settings(settings)
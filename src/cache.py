@@ -0,0 +1,114 @@
+# src/cache.py
+
+# Opt-in cache of upstream completions for deterministic requests.
+#
+# Batch pipelines often resend the exact same prompt with a fixed seed or a
+# temperature of 0. For those requests LM Studio would produce the same
+# answer again, so the shim can serve it from memory instead of spending a
+# full GPU generation on it.
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+# Keys that do not change what the model generates, only how it is delivered.
+_NON_SEMANTIC_KEYS = ("stream", "stream_options")
+
+
+def payload_cache_key(openai_payload: dict) -> str:
+    """
+    Returns a canonical hash of a translated OpenAI payload.
+
+    The payload is serialized with sorted keys and no whitespace, so two
+    requests that differ only in key order or in streaming mode share a key.
+    """
+    canonical = {k: v for k, v in openai_payload.items() if k not in _NON_SEMANTIC_KEYS}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(openai_payload: dict) -> bool:
+    """A request is cacheable when it is greedy (temperature 0) or seeded."""
+    return openai_payload.get("temperature") == 0 or openai_payload.get("seed") is not None
+
+
+class ResponseCache:
+    """
+    LRU cache of OpenAI chat completion responses.
+
+    Bounded by entry count and by the approximate serialized size of the
+    stored responses; entries also expire after a TTL. Entries are plain
+    dicts in the non-streaming OpenAI response shape, so a cached answer can
+    be served to either a streaming or a non-streaming caller.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 600.0, enabled: bool = False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        # key -> (expires_at, size, response)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key_for(self, openai_payload: dict) -> str | None:
+        """Returns the cache key for a payload, or None if it must not be cached."""
+        if not self.enabled or not is_deterministic(openai_payload):
+            return None
+        return payload_cache_key(openai_payload)
+
+    def get(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, size, response = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def put(self, key: str, response: dict):
+        size = len(json.dumps(response, separators=(",", ":")))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, response)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,219 @@
+# src/catalog.py
+
+# Cached model catalog behind /api/tags.
+#
+# UIs such as Open WebUI and the ComfyUI nodes poll /api/tags constantly.
+# Rather than forwarding every poll to LM Studio's /v1/models, the catalog
+# is kept in memory for a TTL. Once stale, it keeps being served while a
+# single background refresh runs, and concurrent cache misses share one
+# upstream call.
+#
+# Every refresh also updates the backend pool's model -> backends index used
+# for model-aware routing, and a discovery loop refreshes it on a schedule.
+
+import asyncio
+import re
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from .config import settings, logger
+from .backends import backend_pool
+from .utils import get_client, is_backend_failure
+
+
+@lru_cache(maxsize=1024)
+def parse_model_id(model_id: str) -> dict:
+    """Parses a model ID to extract family, parameter size and quantization level."""
+    details = {
+        "family": model_id.split('-')[0] if '-' in model_id else "unknown",
+        "parameter_size": "N/A",
+        "quantization_level": "N/A",
+    }
+
+    # Look for parameter size like 7b, 13b, 70b
+    param_match = re.search(r'(\d+(?:\.\d+)?b)(?![a-z])', model_id, re.IGNORECASE)
+    if param_match:
+        details["parameter_size"] = param_match.group(1).upper()
+
+    # Look for quantization level like Q4_K_M, Q5_0
+    quant_match = re.search(r'(q\d(_[a-z0-9_]+)?)', model_id, re.IGNORECASE)
+    if quant_match:
+        details["quantization_level"] = quant_match.group(1).upper()
+
+    return details
+
+
+def to_ollama_model(model: dict) -> dict:
+    """Converts one entry of an OpenAI /v1/models listing to an Ollama /api/tags entry."""
+    model_id = model["id"]
+    details = parse_model_id(model_id)
+    family = details["family"]
+    modified_time = datetime.fromtimestamp(
+        model.get("created", time.time()), tz=timezone.utc
+    ).isoformat().replace('+00:00', 'Z')
+
+    return {
+        "name": model_id,
+        "model": model_id,
+        "modified_at": modified_time,
+        "size": model.get("size", 0),
+        "digest": model_id,
+        "details": {
+            "format": "gguf",
+            "family": family,
+            "families": [family] if family != "unknown" else None,
+            "parameter_size": details["parameter_size"],
+            "quantization_level": details["quantization_level"]
+        }
+    }
+
+
+async def fetch_backend_models(backend) -> list:
+    """Fetches the raw /v1/models listing of one backend."""
+    logger.debug(f"Calling LM Studio for models at: {backend.models_url}")
+    try:
+        response = await get_client().get(backend.models_url)
+        response.raise_for_status()
+    except Exception as e:
+        if is_backend_failure(e):
+            backend_pool.record_failure(backend)
+        raise
+    backend_pool.record_success(backend)
+    models = response.json().get("data", [])
+    backend_pool.update_models(backend, [m["id"] for m in models if m.get("id")])
+    return models
+
+
+async def fetch_lm_studio_models() -> list:
+    """
+    Fetches the model listings of every healthy backend and merges them into
+    one list of Ollama entries, de-duplicated by model id.
+
+    Backends that fail are skipped; the error is raised only if none answered.
+    """
+    backends = backend_pool.healthy_backends() or backend_pool.backends
+    results = await asyncio.gather(*(fetch_backend_models(b) for b in backends), return_exceptions=True)
+
+    merged = {}
+    errors = []
+    for backend, result in zip(backends, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"Could not list models on {backend.base_url}: {result}")
+            errors.append(result)
+            continue
+        for model in result:
+            model_id = model.get("id")
+            if model_id and model_id not in merged:
+                merged[model_id] = to_ollama_model(model)
+
+    if errors and len(errors) == len(backends):
+        raise errors[0]
+    return list(merged.values())
+
+
+class ModelCatalog:
+    """
+    TTL cache around a model-listing coroutine, with stale-while-revalidate.
+
+    - Fresh data (younger than 'ttl') is returned as-is.
+    - Stale data (younger than 'max_stale') is returned immediately while a
+      single background refresh runs.
+    - With no usable data, callers wait for a refresh; concurrent callers
+      share the same one (single-flight).
+    """
+
+    def __init__(self, fetch, ttl: float = 10.0, max_stale: float = 300.0):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._models = None
+        self._fetched_at = 0.0
+        self._refresh_task = None
+        self._poll_task = None
+        self.refreshes = 0
+
+    async def get(self) -> list:
+        if self._models is not None:
+            age = time.monotonic() - self._fetched_at
+            if age < self.ttl:
+                return self._models
+            if age < self.max_stale:
+                self._start_refresh()
+                return self._models
+        # shield() so a caller that goes away does not cancel the refresh
+        # the other waiters are sharing.
+        return await asyncio.shield(self._start_refresh())
+
+    async def refresh(self) -> list:
+        """Forces a refresh (or joins the one in progress)."""
+        return await asyncio.shield(self._start_refresh())
+
+    async def start_discovery(self, interval: float):
+        """
+        Runs an initial refresh, then keeps refreshing every 'interval'
+        seconds in the background so routing sees models as they are
+        loaded and unloaded.
+        """
+        try:
+            await self.refresh()
+        except Exception:
+            pass # Logged by the refresh task.
+        if interval > 0 and self._poll_task is None:
+            self._poll_task = asyncio.create_task(self._poll(interval))
+
+    async def _poll(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception:
+                pass # Logged by the refresh task.
+
+    def invalidate(self):
+        """Marks the cached data as stale; the next call refreshes it."""
+        self._fetched_at = 0.0
+
+    async def aclose(self):
+        """Stops discovery, cancels any refresh in progress and drops the cached data."""
+        if self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except BaseException:
+                pass
+        self._refresh_task = None
+        self._models = None
+        self._fetched_at = 0.0
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+            self._refresh_task.add_done_callback(self._log_refresh_failure)
+        return self._refresh_task
+
+    async def _refresh(self) -> list:
+        models = await self._fetch()
+        self._models = models
+        self._fetched_at = time.monotonic()
+        self.refreshes += 1
+        logger.debug(f"Model catalog refreshed with {len(models)} model(s).")
+        return models
+
+    @staticmethod
+    def _log_refresh_failure(task: asyncio.Task):
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            logger.warning(f"Model catalog refresh failed: {error}")
+
+
+model_catalog = ModelCatalog(
+    fetch_lm_studio_models,
+    ttl=settings.MODEL_CATALOG_TTL,
+    max_stale=settings.MODEL_CATALOG_MAX_STALE,
+)
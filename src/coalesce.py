@@ -0,0 +1,211 @@
+# src/coalesce.py
+
+# Single-flight deduplication of identical in-flight generations.
+#
+# When an agent fleet retries, or several dashboards fire the same prompt at
+# once, only the first request is forwarded to LM Studio. Identical requests
+# arriving while it is still running attach to it: streaming callers read the
+# same NDJSON lines through a fan-out buffer, non-streaming callers await the
+# same response. Followers take the leader's backend and admission queue wait
+# into their own request stats, so their metrics and X-Queue-Wait-Ms header
+# report the generation they were served from.
+#
+# The first request's upstream call keeps running for the others after it
+# leaves (disconnect, deadline), so it must not depend on anything that
+# request releases on its way out. The routes therefore do not coalesce:
+#   - requests whose large strings were spilled to a spool, which the first
+#     request's route closes when it returns;
+#   - streams with an X-Request-Timeout header. A shared stream is cut off
+#     at the first request's deadline (its StreamWatchdog), which would end
+#     a follower's stream early, or a caller's own short deadline late.
+# With only the REQUEST_DEADLINE default, a follower's stream may end early
+# by no more than the time between the two arrivals. Non-streaming callers
+# each wait under their own deadline and may be coalesced regardless.
+
+import asyncio
+
+from .cache import payload_cache_key
+from .config import logger
+from .flush import FlushPolicy
+
+
+# Request stats a follower copies from the request that leads its flight.
+SHARED_STATS = ("backend", "queue_wait")
+
+
+def _share_stats(leader: dict | None, follower: dict | None):
+    if leader is None or follower is None or leader is follower:
+        return
+    for name in SHARED_STATS:
+        if name in leader:
+            follower[name] = leader[name]
+
+
+class _StreamFlight:
+    """Fan-out buffer for one upstream stream shared by several subscribers."""
+
+    def __init__(self, stats: dict | None = None):
+        self.lines = []
+        self.finished = False
+        self.subscribers = 0
+        # Callers still waiting for the stream to open.
+        self.openers = 0
+        self.opened = asyncio.get_running_loop().create_future()
+        self.task = None
+        # The leading request's stats, filled in while it opens the stream.
+        self.stats = stats
+        self._wakeup = asyncio.Event()
+
+    def append(self, line: str):
+        self.lines.append(line)
+        self._notify()
+
+    def finish(self):
+        self.finished = True
+        self._notify()
+
+    def _notify(self):
+        wakeup, self._wakeup = self._wakeup, asyncio.Event()
+        wakeup.set()
+
+    async def subscribe(self):
+        """Yields every line of the stream, from the first one on."""
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.lines):
+                    yield self.lines[index]
+                    index += 1
+                if self.finished:
+                    return
+                await self._wakeup.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.task.done():
+                # Everybody went away; stop generating for nobody.
+                logger.info("All subscribers left a coalesced stream. Cancelling upstream request.")
+                self.task.cancel()
+
+
+class _CallFlight:
+    def __init__(self, task: asyncio.Task, stats: dict | None = None):
+        self.task = task
+        self.waiters = 0
+        self.stats = stats
+
+
+class RequestCoalescer:
+    """
+    Registry of in-flight upstream requests, keyed on the canonical translated
+    payload, the Ollama response format and, for streams, the flush policy
+    (the fan-out shares the batched writes, not the raw tokens).
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._streams = {}
+        self._calls = {}
+        self.coalesced = 0
+
+    def key_for(self, openai_payload: dict, response_format: str, flush_policy: FlushPolicy | None = None) -> str | None:
+        """Returns the flight key for a payload, or None if coalescing is off."""
+        if not self.enabled:
+            return None
+        key = f"{response_format}:{payload_cache_key(openai_payload)}"
+        if flush_policy is not None:
+            key += f":{flush_policy!r}"
+        return key
+
+    def in_flight(self) -> int:
+        return len(self._streams) + len(self._calls)
+
+    async def stream(self, key: str | None, open_stream, request_stats: dict | None = None):
+        """
+        Returns an async iterator of Ollama NDJSON lines.
+
+        'open_stream' is a coroutine function that opens the upstream request
+        and returns the translated line generator. It is called only by the
+        first request for a key; errors raised while opening it (e.g. an
+        HTTP error status) are re-raised to every request waiting on it.
+        'request_stats' is the caller's; a follower's gets the leader's
+        SHARED_STATS once the stream has opened (or failed to).
+        """
+        if key is None:
+            return await open_stream()
+
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight(request_stats)
+            self._streams[key] = flight
+            flight.task = asyncio.create_task(self._drive_stream(key, flight, open_stream))
+        else:
+            self.coalesced += 1
+            logger.info("Attaching request to an identical in-flight stream.")
+
+        flight.openers += 1
+        try:
+            await asyncio.shield(flight.opened)
+        except asyncio.CancelledError:
+            if flight.openers == 1 and flight.subscribers == 0 and not flight.task.done():
+                # The only caller left before the stream opened.
+                flight.task.cancel()
+            raise
+        finally:
+            flight.openers -= 1
+            _share_stats(flight.stats, request_stats)
+        return flight.subscribe()
+
+    async def call(self, key: str | None, request_fn, request_stats: dict | None = None):
+        """
+        Runs 'request_fn' (a coroutine function) once per key and returns its
+        result to every caller that asked for the same key meanwhile, copying
+        the leader's SHARED_STATS into each follower's 'request_stats'.
+        """
+        if key is None:
+            return await request_fn()
+
+        flight = self._calls.get(key)
+        if flight is None:
+            flight = _CallFlight(asyncio.create_task(request_fn()), request_stats)
+            self._calls[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(self._calls, key, flight))
+        else:
+            self.coalesced += 1
+            logger.info("Attaching request to an identical in-flight request.")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            _share_stats(flight.stats, request_stats)
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    async def _drive_stream(self, key: str, flight: _StreamFlight, open_stream):
+        lines = None
+        try:
+            try:
+                lines = await open_stream()
+            except asyncio.CancelledError:
+                flight.opened.cancel()
+                raise
+            except Exception as e:
+                flight.opened.set_exception(e)
+                return
+            flight.opened.set_result(None)
+
+            async for line in lines:
+                flight.append(line)
+        finally:
+            self._forget(self._streams, key, flight)
+            flight.finish()
+            if lines is not None:
+                # Closes the upstream response if we were cancelled mid-stream.
+                await lines.aclose()
+
+    @staticmethod
+    def _forget(registry: dict, key: str, flight):
+        if registry.get(key) is flight:
+            del registry[key]
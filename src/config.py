@@ -6,8 +6,11 @@ load_dotenv()
 
 from pydantic_settings import BaseSettings
 from pydantic import Field, AliasChoices
+import atexit
 import logging
 
+from .logs import LogPipeline
+
 class Settings(BaseSettings):
     """
     Configuration settings for the Ollama Shim service.
@@ -19,19 +22,202 @@ class Settings(BaseSettings):
     # The base URL for the LM Studio instance.
     LM_STUDIO_BASE_URL: str = Field(default="http://localhost:1234", validation_alias=AliasChoices("lm_studio_url", "lm_studio_base_url"))
     AUTH_TOKEN: str | None = None
+    # Ask for token usage at the end of streams (stream_options.include_usage);
+    # turn off for backends that reject the option.
+    STREAM_INCLUDE_USAGE: bool = True
+
+    # --- Backend Pool ---
+    # Comma-separated LM Studio base URLs, each optionally weighted with
+    # '|<weight>', e.g. "http://gpu1:1234|2,http://gpu2:1234". When empty,
+    # LM_STUDIO_BASE_URL is the only backend.
+    LM_STUDIO_BACKENDS: str = ""
+    # "least_outstanding" or "p2c" (power of two choices).
+    BACKEND_SELECTION: str = "least_outstanding"
+    # Circuit breaker: a backend's circuit opens after this many consecutive
+    # failures (connection errors, timeouts, 5xx), or when BACKEND_ERROR_RATE
+    # of its last BACKEND_ERROR_WINDOW requests failed. Requests to it are
+    # then refused with 503 for BACKEND_COOLDOWN seconds, after which one
+    # trial request decides whether it closes again.
+    BACKEND_FAILURE_THRESHOLD: int = 3
+    BACKEND_COOLDOWN: float = 30.0
+    BACKEND_ERROR_RATE: float = 0.5
+    BACKEND_ERROR_WINDOW: int = 20
+
+    # --- Health Checks ---
+    # Seconds between background probes of every backend's /v1/models
+    # (0 disables probing), and how long a probe may take.
+    HEALTH_CHECK_INTERVAL: float = 5.0
+    HEALTH_CHECK_TIMEOUT: float = 2.0
+
+    # --- Admission Control ---
+    # Concurrent generations per backend (0 = unlimited). Requests beyond it
+    # wait in a bounded priority queue; a full queue is rejected with 429,
+    # and waiting longer than the timeout (seconds) with 503.
+    BACKEND_MAX_CONCURRENCY: int = 0
+    ADMISSION_QUEUE_SIZE: int = 32
+    ADMISSION_QUEUE_TIMEOUT: float = 30.0
+    # Requests with num_predict at or above this (or unlimited) get low
+    # priority unless an X-Priority header says otherwise.
+    ADMISSION_LARGE_REQUEST_TOKENS: int = 2048
+
+    # --- Model-Aware Routing ---
+    # Seconds between polls of every backend's /v1/models (0 disables polling).
+    MODEL_DISCOVERY_INTERVAL: float = 30.0
+    # For a model no backend has loaded: "any" backend, or "reject" with 404.
+    MODEL_ROUTING_FALLBACK: str = "any"
 
     # --- Timeouts ---
+    # Upstream timeouts, in seconds: API_TIMEOUT bounds sending a request,
+    # RESPONSE_TIMEOUT the wait for each piece of the response, and the
+    # UPSTREAM_* ones opening a connection and waiting for a free one.
     API_TIMEOUT: float = 30.0
     RESPONSE_TIMEOUT: float = 300.0
+    UPSTREAM_CONNECT_TIMEOUT: float = 5.0
+    UPSTREAM_POOL_TIMEOUT: float = 10.0
+    # Limits on /api/chat and /api/generate on top of those (0 disables one).
+    # REQUEST_DEADLINE bounds a whole request; clients can set a shorter one
+    # with an 'X-Request-Timeout: <seconds>' header (any, when it is 0).
+    # Streams are also cut off without output FIRST_TOKEN_TIMEOUT seconds
+    # after the request was sent, or STREAM_IDLE_TIMEOUT seconds after the
+    # last upstream event, ending with an error line.
+    REQUEST_DEADLINE: float = 0.0
+    FIRST_TOKEN_TIMEOUT: float = 120.0
+    STREAM_IDLE_TIMEOUT: float = 30.0
+
+    # --- Retries and Hedging ---
+    # Connect errors and 5xx answers are retried up to UPSTREAM_RETRIES times
+    # (streams only before their first byte), preferably on another backend,
+    # after a random delay of up to RETRY_BACKOFF_BASE doubling per retry and
+    # capped at RETRY_BACKOFF_MAX seconds. Retries and hedges are limited to
+    # RETRY_BUDGET_RATIO per request plus RETRY_BUDGET_MIN_PER_SEC.
+    UPSTREAM_RETRIES: int = 2
+    RETRY_BACKOFF_BASE: float = 0.1
+    RETRY_BACKOFF_MAX: float = 2.0
+    RETRY_BUDGET_RATIO: float = 0.2
+    RETRY_BUDGET_MIN_PER_SEC: float = 1.0
+    # Non-streaming requests still unanswered after the model's observed p95
+    # latency (at least HEDGE_MIN_DELAY seconds, once HEDGE_MIN_SAMPLES
+    # answers were seen) get a duplicate on another backend; the first
+    # answer wins. 'X-Hedge: on|off' overrides this per request.
+    HEDGING_ENABLED: bool = False
+    HEDGE_MIN_DELAY: float = 0.05
+    HEDGE_MIN_SAMPLES: int = 20
+
+    # --- Upstream Connection Pool ---
+    # Connections to all backends together (0 = unlimited), idle ones kept
+    # open and for how long, and how many to open per backend at startup.
+    UPSTREAM_MAX_CONNECTIONS: int = 100
+    UPSTREAM_MAX_KEEPALIVE: int = 20
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 30.0
+    UPSTREAM_PREWARM_CONNECTIONS: int = 0
+    # HTTP/2 needs the 'h2' package (pip install httpx[http2]) and a TLS backend.
+    UPSTREAM_HTTP2: bool = False
+
+    # --- Response Cache ---
+    # Opt-in cache for deterministic requests (temperature 0 or a fixed seed).
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_MAX_ENTRIES: int = 256
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_TTL: float = 600.0
+
+    # --- Generate Context ---
+    # /api/generate conversations kept server-side so a returned 'context'
+    # can be continued; bounded by count and approximate text size, and
+    # dropped after CONTINUATION_TTL seconds without use.
+    CONTINUATION_ENABLED: bool = True
+    CONTINUATION_MAX_ENTRIES: int = 1024
+    CONTINUATION_MAX_BYTES: int = 64 * 1024 * 1024
+    CONTINUATION_TTL: float = 3600.0
+
+    # --- Embeddings ---
+    # Embedding inputs for the same model are gathered for up to
+    # EMBED_BATCH_WINDOW_MS (or until EMBED_BATCH_MAX_INPUTS) into one
+    # upstream call; 0 ms sends each request on its own. Vectors are cached by
+    # content hash (EMBED_CACHE_MAX_ENTRIES = 0 disables the cache).
+    EMBED_BATCH_WINDOW_MS: float = 5.0
+    EMBED_BATCH_MAX_INPUTS: int = 64
+    EMBED_CACHE_MAX_ENTRIES: int = 10000
+    EMBED_CACHE_MAX_BYTES: int = 128 * 1024 * 1024
+
+    # --- Request Coalescing ---
+    # Identical in-flight requests share a single upstream generation.
+    REQUEST_COALESCING_ENABLED: bool = False
+
+    # --- Stream Flushing ---
+    # Default write grouping per route: "token" (one write per token) or
+    # "tokens=N,bytes=M,ms=T". Requests override it with X-Stream-Flush or
+    # the 'stream_flush' option.
+    STREAM_FLUSH_CHAT: str = "token"
+    STREAM_FLUSH_GENERATE: str = "token"
+
+    # --- Large Payload Ingestion ---
+    # Bodies at least this large (or without a Content-Length) are scanned
+    # incrementally; JSON strings longer than SPILL_STRING_BYTES (images) are
+    # moved to a temporary spool that stays in memory up to SPOOL_MEMORY_BYTES.
+    LARGE_PAYLOAD_BYTES: int = 1024 * 1024
+    SPILL_STRING_BYTES: int = 64 * 1024
+    SPOOL_MEMORY_BYTES: int = 4 * 1024 * 1024
+
+    # --- Image Preprocessing ---
+    # Re-label images with their real MIME type and, with Pillow installed,
+    # downsample ones beyond IMAGE_MAX_EDGE pixels on a side or IMAGE_MAX_PIXELS
+    # in total (0 = no limit). IMAGE_WORKERS = 0 uses one process per CPU.
+    IMAGE_PREPROCESSING_ENABLED: bool = False
+    IMAGE_MAX_EDGE: int = 1568
+    IMAGE_MAX_PIXELS: int = 0
+    IMAGE_JPEG_QUALITY: int = 85
+    IMAGE_WORKERS: int = 0
+    IMAGE_CACHE_ENTRIES: int = 128
+
+    # --- Model Catalog (/api/tags) ---
+    # Seconds the model list is served without asking LM Studio again.
+    MODEL_CATALOG_TTL: float = 10.0
+    # Seconds stale data may still be served while a refresh runs.
+    MODEL_CATALOG_MAX_STALE: float = 300.0
 
     # --- Server Settings ---
     SHIM_PORT: int
+    SHIM_HOST: str = "0.0.0.0"
+    # "development" (one process, auto-reload) or "production" (see server.py).
+    SHIM_MODE: str = "development"
+    # Production mode: worker processes (0 = one per CPU), idle keep-alive
+    # seconds, listen backlog, access logging, and how long in-flight
+    # requests may keep running after SIGTERM before they are cancelled.
+    SHIM_WORKERS: int = 1
+    SHIM_KEEPALIVE_TIMEOUT: int = 5
+    SHIM_BACKLOG: int = 2048
+    SHIM_ACCESS_LOG: bool = True
+    SHIM_DRAIN_TIMEOUT: int = 30
+
+    # --- Metrics ---
+    # The 'model' label comes from clients. Models the backends report always
+    # get their own label; this many other names do, first come first served,
+    # and any beyond share model="other".
+    METRICS_MAX_MODEL_LABELS: int = 50
+
+    # --- Debug Endpoints ---
+    # /debug/profile (sampling CPU profiler) and /debug/memory (tracemalloc
+    # and live requests per route). Off by default: they reveal code paths
+    # and cost some CPU while running, so enable them on trusted networks
+    # only. Profiles sample PROFILE_SAMPLE_HZ times a second and both run
+    # for at most DEBUG_MAX_SECONDS.
+    DEBUG_ENDPOINTS_ENABLED: bool = False
+    PROFILE_SAMPLE_HZ: int = 100
+    DEBUG_MAX_SECONDS: float = 60.0
 
     # --- Logging ---
     # To see the full request and response payloads, set this to DEBUG.
     # Valid levels: DEBUG, INFO, WARNING, ERROR, CRITICAL
     LOG_LEVEL: str = "INFO"
     FILE_LOG_LEVEL: str = "INFO" # Adding this to handle the user's .env
+    # Log records are written by a background thread from a queue of at most
+    # LOG_QUEUE_SIZE records (beyond that they are dropped, not waited for).
+    # LOG_SAMPLE_RATE is the fraction of requests whose INFO/DEBUG lines are
+    # kept; warnings and errors always are. Strings in logged payloads are
+    # cut at LOG_MAX_STRING_CHARS, and images are replaced by their size.
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_SAMPLE_RATE: float = 1.0
+    LOG_MAX_STRING_CHARS: int = 256
 
     class Config:
         # The name of the .env file to load.
@@ -63,3 +249,9 @@ logger = logging.getLogger("uvicorn.error")
 # Set the logger's level based on the settings.
 # The level name is converted to upper case to be safe.
 logger.setLevel(settings.LOG_LEVEL.upper())
+
+# Handlers are written to by a background thread (see logs.py); the lifespan
+# puts uvicorn's handlers behind it too. Whatever is queued at exit is
+# still written out.
+log_pipeline = LogPipeline(settings.LOG_QUEUE_SIZE)
+atexit.register(log_pipeline.stop)
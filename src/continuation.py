@@ -0,0 +1,157 @@
+# src/continuation.py
+
+# Server-side conversation state for /api/generate's 'context'.
+#
+# Ollama returns the tokenized conversation as 'context' and clients chain
+# generate calls by sending it back. LM Studio's OpenAI API has no such
+# thing, so the shim keeps the conversation itself: every completed
+# generate call stores its message list (system, prompts, responses) under
+# a random handle, and the handle is what goes out as 'context'. A
+# follow-up that sends the handle back gets the stored messages prepended
+# server-side, so the client does not resend history. Messages are stored
+# exactly as they were sent upstream, so every follow-up starts with a
+# byte-identical prefix and the backend's prompt (KV) cache can reuse it.
+#
+# The store is a per-process LRU bounded by entry count and size; an
+# evicted or unknown handle simply starts a fresh conversation.
+
+import secrets
+import time
+from collections import OrderedDict
+
+from .ingest import is_spilled, unspill
+
+# First element of every shim context; real Ollama token arrays are not
+# mistaken for a handle unless they happen to match all of it.
+CONTEXT_MAGIC = 0x53484D43
+# A handle is 64 random bits, sent as four 16-bit words after the magic.
+_WORDS = 4
+
+
+def encode_handle(handle: int) -> list:
+    return [CONTEXT_MAGIC] + [(handle >> (16 * i)) & 0xFFFF for i in range(_WORDS)]
+
+
+def decode_handle(context) -> int | None:
+    """Returns the handle in a client's 'context', or None if it holds none."""
+    if not isinstance(context, list) or len(context) != _WORDS + 1 or context[0] != CONTEXT_MAGIC:
+        return None
+    words = context[1:]
+    if not all(isinstance(word, int) and 0 <= word <= 0xFFFF for word in words):
+        return None
+    return sum(word << (16 * i) for i, word in enumerate(words))
+
+
+def _message_size(message: dict) -> int:
+    content = message.get("content")
+    if isinstance(content, str):
+        return len(content)
+    return sum(len(part.get("text") or part.get("image_url", {}).get("url", "")) for part in content or ())
+
+
+class ContinuationStore:
+    """
+    LRU store of generate conversations, keyed by handle.
+
+    Each entry is an immutable tuple of OpenAI messages; a follow-up turn
+    builds a new tuple that shares the earlier message dicts, so a
+    conversation can be continued from any of its handles. Bounded by entry
+    count and by the approximate text size of the stored messages; entries
+    also expire after a TTL without use.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 3600.0, enabled: bool = True):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        # handle -> (expires_at, size, messages)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def messages_for(self, context) -> tuple:
+        """
+        The stored messages for a client's 'context', or () when there is no
+        handle in it or the conversation is no longer stored.
+        """
+        if not self.enabled:
+            return ()
+        handle = decode_handle(context)
+        if handle is None:
+            return ()
+        entry = self._entries.get(handle)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._remove(handle)
+            self.misses += 1
+            return ()
+        self._entries.move_to_end(handle)
+        self._entries[handle] = (time.monotonic() + self.ttl, entry[1], entry[2])
+        self.hits += 1
+        return entry[2]
+
+    def save(self, messages, response: str) -> list:
+        """
+        Stores 'messages' plus the assistant's 'response' under a new handle
+        and returns it encoded as a 'context' array ([] when disabled or when
+        the conversation is too large to keep).
+        """
+        if not self.enabled:
+            return []
+        messages = tuple(messages) + ({"role": "assistant", "content": response},)
+        size = sum(_message_size(message) for message in messages)
+        if size > self.max_bytes:
+            return []
+        handle = secrets.randbits(16 * _WORDS)
+        self._entries[handle] = (time.monotonic() + self.ttl, size, messages)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        return encode_handle(handle)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, handle: int):
+        _, size, _ = self._entries.pop(handle)
+        self._bytes -= size
+
+
+def history_message(message: dict, spool=None) -> dict:
+    """
+    The form of an outgoing message kept in the history. Spilled strings
+    (see ingest.py) are placeholders into this request's 'spool', which
+    does not outlive it: spilled text is stored as the real text, and
+    parts with spilled image data are dropped.
+    """
+    content = message.get("content")
+    if isinstance(content, str):
+        return message if not is_spilled(content) else {**message, "content": unspill(content, spool)}
+    kept = []
+    for part in content:
+        if "\x00spill:" in part.get("image_url", {}).get("url", ""):
+            continue
+        if is_spilled(part.get("text")):
+            part = {**part, "text": unspill(part["text"], spool)}
+        kept.append(part)
+    unchanged = len(kept) == len(content) and all(a is b for a, b in zip(kept, content))
+    return message if unchanged else {**message, "content": kept}
@@ -0,0 +1,181 @@
+# src/deadline.py
+
+# Request deadlines and stream timeouts.
+#
+# The upstream client's read timeout is long (a model may think for minutes),
+# so on its own a stalled backend holds a request slot for RESPONSE_TIMEOUT
+# seconds, and a client that gives up after 10 s gets nothing useful. Three
+# limits sit on top of it:
+#   - a deadline for the whole request, from the X-Request-Timeout header or
+#     REQUEST_DEADLINE. Everything before the response starts (admission
+#     queue, retries, connecting, a non-streaming generation) runs inside
+#     within_deadline(), which cancels it when the deadline passes;
+#   - FIRST_TOKEN_TIMEOUT, from sending the request to the first generated
+#     output (content or reasoning);
+#   - STREAM_IDLE_TIMEOUT between upstream events once output flows.
+# While a stream is relayed they are enforced by a StreamWatchdog: one timer
+# per stream, checked a few times per idle period, that cancels the read of
+# the upstream stream when a limit trips. Wrapping every read in
+# asyncio.wait_for() would cost a timer (and a task) per token; here a
+# token costs a counter increment. The stream translator then closes the
+# upstream request and ends the Ollama stream with an error line.
+
+import asyncio
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request deadline or stream timeout trips."""
+
+    MESSAGES = {
+        "deadline": "Request deadline exceeded",
+        "first_token_timeout": "No output from the backend within the first-token timeout",
+        "idle_timeout": "Backend stream stalled (idle timeout)",
+    }
+
+    def __init__(self, reason: str, seconds: float | None = None):
+        message = self.MESSAGES[reason]
+        if seconds is not None:
+            message += f" ({seconds:g} s)"
+        super().__init__(message)
+        self.reason = reason
+
+
+def request_deadline(headers, default: float) -> float | None:
+    """
+    The request's deadline on the event loop clock, or None for none.
+    'X-Request-Timeout: <seconds>' sets it, though never later than the
+    configured 'default' (0 = no default and no cap); a missing or invalid
+    header leaves the default.
+    """
+    timeout = default if default > 0 else None
+    header = headers.get("x-request-timeout")
+    if header:
+        try:
+            requested = float(header)
+        except ValueError:
+            requested = 0
+        if requested > 0:
+            timeout = requested if timeout is None else min(timeout, requested)
+    if timeout is None:
+        return None
+    return asyncio.get_running_loop().time() + timeout
+
+
+async def within_deadline(deadline: float | None, coro):
+    """Awaits 'coro', cancelling it and raising DeadlineExceeded at 'deadline'."""
+    if deadline is None:
+        return await coro
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(coro, max(0.0, deadline - loop.time()))
+    except asyncio.TimeoutError:
+        # Only the deadline's own timeout; one raised inside 'coro' before
+        # then is passed on.
+        if loop.time() >= deadline:
+            raise DeadlineExceeded("deadline") from None
+        raise
+
+
+class StreamWatchdog:
+    """
+    Enforces a deadline, a first-output timeout and an idle timeout (loop
+    clock, seconds; None or 0 for none) on the reads of one upstream stream.
+    The reader wraps its event iterator in watch(), and sets 'generating'
+    once real output has arrived. The first-output clock runs from
+    'started' (default: now).
+    """
+
+    # Checks per idle period; a stall trips within 1.25 idle timeouts.
+    CHECKS_PER_IDLE = 4
+
+    __slots__ = ("deadline", "first_token_due", "first_token_timeout", "idle_timeout", "generating",
+                 "events", "expired", "_waiting", "_task", "_timer", "_seen", "_last_progress")
+
+    def __init__(self, deadline: float | None = None, first_token_timeout: float | None = None,
+                 idle_timeout: float | None = None, started: float | None = None):
+        loop = asyncio.get_running_loop()
+        self.deadline = deadline
+        self.first_token_timeout = first_token_timeout or None
+        self.first_token_due = None
+        if self.first_token_timeout:
+            self.first_token_due = (loop.time() if started is None else started) + first_token_timeout
+        self.idle_timeout = idle_timeout or None
+        self.generating = False
+        # Upstream events read so far; the only per-token bookkeeping.
+        self.events = 0
+        self.expired = None
+        self._waiting = False
+        self._task = None
+        self._timer = None
+        self._seen = 0
+        self._last_progress = None
+
+    async def watch(self, events):
+        """Yields from 'events', raising DeadlineExceeded when a limit trips."""
+        iterator = events.__aiter__()
+        self._task = asyncio.current_task()
+        self._check()
+        try:
+            while True:
+                if self.expired is not None:
+                    raise DeadlineExceeded(self.expired, self._limit_seconds())
+                self._waiting = True
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                except asyncio.CancelledError:
+                    if self.expired is None:
+                        raise
+                    if hasattr(self._task, "uncancel"):  # Python 3.11+
+                        self._task.uncancel()
+                    raise DeadlineExceeded(self.expired, self._limit_seconds()) from None
+                finally:
+                    self._waiting = False
+                self.events += 1
+                yield item
+        finally:
+            if self._timer is not None:
+                self._timer.cancel()
+
+    def _limit_seconds(self) -> float | None:
+        if self.expired == "first_token_timeout":
+            return self.first_token_timeout
+        if self.expired == "idle_timeout":
+            return self.idle_timeout
+        return None
+
+    def _check(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if not self._waiting or self.events != self._seen:
+            # Progress, or the reader is busy elsewhere (e.g. writing to a
+            # slow client), which is not the backend's fault.
+            self._seen = self.events
+            self._last_progress = now
+
+        if self.deadline is not None and now >= self.deadline:
+            return self._trip("deadline")
+        if not self.generating:
+            if self.first_token_due is not None and now >= self.first_token_due:
+                return self._trip("first_token_timeout")
+            due = self.first_token_due
+        else:
+            if self.idle_timeout is not None and now - self._last_progress >= self.idle_timeout:
+                return self._trip("idle_timeout")
+            due = None
+        if self.idle_timeout is not None:
+            next_check = now + self.idle_timeout / self.CHECKS_PER_IDLE
+            due = next_check if due is None else min(due, next_check)
+        if self.deadline is not None:
+            due = self.deadline if due is None else min(due, self.deadline)
+        if due is not None:
+            self._timer = loop.call_at(due, self._check)
+
+    def _trip(self, reason: str):
+        self._timer = None
+        self.expired = reason
+        # Only a pending upstream read is interrupted; otherwise the reader
+        # notices before its next read.
+        if self._waiting:
+            self._task.cancel()
@@ -0,0 +1,103 @@
+# src/disconnect.py
+
+# Client-disconnect detection.
+#
+# When a user closes an Open WebUI tab the generation they started is
+# worthless, and every further token keeps a GPU busy for nobody. Starlette
+# only notices a gone client on the next failed write (and never while the
+# model is still prefilling), and it does not close the body iterator, so
+# the upstream request used to run to completion. Here the ASGI receive
+# channel is watched for 'http.disconnect' on both the streaming and the
+# non-streaming path, and the upstream request is cancelled as soon as the
+# client goes away.
+
+import asyncio
+
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+
+from .config import logger
+from .metrics import record_cancellation
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away before its answer was ready."""
+
+
+async def wait_for_disconnect(receive):
+    """Returns once the ASGI server reports that the client disconnected."""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def run_unless_disconnected(request, coro, request_stats: dict | None = None):
+    """
+    Awaits 'coro' (e.g. a non-streaming upstream call), cancelling it and
+    raising ClientDisconnected if the client disconnects first.
+    """
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(wait_for_disconnect(request.receive))
+    try:
+        await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if task.done():
+        return task.result()
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    logger.info("Client disconnected before the response was ready; upstream request cancelled.")
+    if request_stats is not None:
+        record_cancellation(request_stats, "response")
+    raise ClientDisconnected()
+
+
+class DisconnectAwareStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that stops relaying, and closes its body iterator
+    (and with it the upstream stream), the moment the client disconnects.
+    """
+
+    def __init__(self, content, request_stats: dict | None = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.request_stats = request_stats
+
+    async def __call__(self, scope, receive, send):
+        response_task = asyncio.current_task()
+        disconnected = False
+
+        async def watch():
+            nonlocal disconnected
+            await wait_for_disconnect(receive)
+            disconnected = True
+            # Interrupts the relay wherever it is waiting: on the upstream
+            # (mid-prefill or between tokens) or on a write.
+            response_task.cancel()
+
+        watcher = asyncio.create_task(watch())
+        try:
+            await super().__call__(scope, receive, send)
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+            if hasattr(response_task, "uncancel"):  # Python 3.11+
+                response_task.uncancel()
+        except (ClientDisconnect, OSError):
+            # A write failed before the watcher saw the disconnect message.
+            disconnected = True
+        finally:
+            watcher.cancel()
+            # The iterator is not running any more, so it can be closed right
+            # away instead of whenever it is garbage collected.
+            await self.body_iterator.aclose()
+
+        if disconnected:
+            logger.info("Client disconnected mid-stream; upstream request closed.")
+            if self.request_stats is not None:
+                record_cancellation(self.request_stats, "stream")
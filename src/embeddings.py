@@ -0,0 +1,196 @@
+# src/embeddings.py
+
+# Micro-batching and caching for /api/embed and /api/embeddings.
+#
+# RAG ingestion sends one embedding request per chunk, often many at once.
+# Each of those would be its own upstream call, although an embedding model
+# processes a batch of inputs in roughly the time of one. The batcher holds
+# inputs for the same model for a few milliseconds (or until enough have
+# arrived), sends them as one /v1/embeddings call and hands every caller
+# its own vectors back.
+#
+# Vectors are also cached by a hash of the model and the text, so
+# re-ingesting unchanged chunks costs nothing. They are kept as float32
+# arrays (what the models compute in) rather than lists of Python floats,
+# which take about six times the memory.
+
+import asyncio
+import hashlib
+from array import array
+from collections import OrderedDict
+
+from .config import logger
+
+
+def embedding_key(model: str, dimensions: int | None, text: str) -> bytes:
+    return hashlib.sha256(f"{model}\x00{dimensions or ''}\x00{text}".encode("utf-8")).digest()
+
+
+class VectorCache:
+    """LRU cache of embedding vectors, bounded by entry count and vector bytes."""
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 128 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> array('f')
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: bytes) -> array | None:
+        vector = self._entries.get(key)
+        if vector is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return vector
+
+    def put(self, key: bytes, vector: array):
+        if self.max_entries <= 0:
+            return
+        size = vector.itemsize * len(vector)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old.itemsize * len(old)
+        self._entries[key] = vector
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.itemsize * len(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class _Group:
+    """Inputs waiting to be sent for one (model, dimensions)."""
+
+    __slots__ = ("pending", "timer")
+
+    def __init__(self):
+        # key -> (text, future); identical texts share one slot.
+        self.pending = {}
+        self.timer = None
+
+
+class EmbeddingBatcher:
+    """
+    Gathers embedding inputs per model and sends them upstream in batches.
+
+    'send_batch' is a coroutine function (model, dimensions, texts) that
+    returns one vector (a list of floats) per text. A batch goes out once it
+    holds 'max_inputs' distinct texts or 'max_delay' seconds after its first
+    input arrived, whichever comes first; max_delay = 0 sends every request's
+    inputs right away, still as one call per request.
+    """
+
+    def __init__(self, send_batch, max_inputs: int = 64, max_delay: float = 0.005, cache: VectorCache | None = None):
+        self.send_batch = send_batch
+        self.max_inputs = max(1, max_inputs)
+        self.max_delay = max_delay
+        self.cache = cache if cache is not None else VectorCache(max_entries=0)
+        self._groups = {}
+        # Keys being fetched right now, so a repeat joins instead of re-sending.
+        self._in_flight = {}
+        # Running upstream calls (the event loop only keeps weak references).
+        self._tasks = set()
+        self.batches = 0
+        self.inputs = 0
+
+    async def embed(self, model: str, texts: list, dimensions: int | None = None) -> list:
+        """Returns a float32 array per text, in order."""
+        keys = [embedding_key(model, dimensions, text) for text in texts]
+        results = [self.cache.get(key) for key in keys]
+        waiting = []
+        for i, (key, text) in enumerate(zip(keys, texts)):
+            if results[i] is None:
+                waiting.append((i, self._future_for(model, dimensions, key, text)))
+        if waiting:
+            self._schedule(model, dimensions)
+            vectors = await asyncio.gather(*(asyncio.shield(future) for _, future in waiting))
+            for (i, _), vector in zip(waiting, vectors):
+                results[i] = vector
+        return results
+
+    def _future_for(self, model: str, dimensions: int | None, key: bytes, text: str) -> asyncio.Future:
+        future = self._in_flight.get(key)
+        if future is not None:
+            return future
+        group = self._groups.setdefault((model, dimensions), _Group())
+        future = asyncio.get_running_loop().create_future()
+        # Callers may have gone away by the time a batch fails; that is not
+        # an unretrieved exception.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        group.pending[key] = (text, future)
+        self._in_flight[key] = future
+        return future
+
+    def _schedule(self, model: str, dimensions: int | None):
+        group = self._groups.get((model, dimensions))
+        if group is None or not group.pending:
+            return
+        if len(group.pending) >= self.max_inputs or self.max_delay <= 0:
+            self._flush(model, dimensions)
+        elif group.timer is None:
+            group.timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush, model, dimensions)
+
+    def _flush(self, model: str, dimensions: int | None):
+        group = self._groups.pop((model, dimensions), None)
+        if group is None:
+            return
+        if group.timer is not None:
+            group.timer.cancel()
+        items = list(group.pending.items())
+        for start in range(0, len(items), self.max_inputs):
+            task = asyncio.ensure_future(self._send(model, dimensions, items[start:start + self.max_inputs]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, model: str, dimensions: int | None, items: list):
+        self.batches += 1
+        self.inputs += len(items)
+        logger.debug(f"Sending a batch of {len(items)} embedding input(s) for '{model}'.")
+        try:
+            vectors = await self.send_batch(model, dimensions, [text for _, (text, _) in items])
+            if len(vectors) != len(items):
+                raise ValueError(f"Backend returned {len(vectors)} embeddings for {len(items)} inputs.")
+        except BaseException as e:
+            for key, (_, future) in items:
+                self._in_flight.pop(key, None)
+                if future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return
+        for (key, (_, future)), values in zip(items, vectors):
+            vector = array("f", values)
+            self.cache.put(key, vector)
+            self._in_flight.pop(key, None)
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "inputs": self.inputs, "cache": self.cache.stats()}
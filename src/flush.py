@@ -0,0 +1,193 @@
+# src/flush.py
+
+# Flush policy for the streams sent to clients.
+#
+# By default every upstream delta becomes its own write, which is what chat
+# UIs want. Batch scripts and RAG pipelines only care about the finished
+# text, and for them a write (and an HTTP chunk header) per token is wasted
+# CPU. A FlushPolicy lets a request, or a route by default, group lines and
+# write them after N tokens, M bytes or T milliseconds, whichever comes
+# first. The first token is always written immediately to keep TTFT intact.
+#
+# Policies are written as "tokens=16,bytes=4096,ms=50" (any subset; the time
+# limit defaults to 200 ms), or "token" for the per-token default, in the X-Stream-Flush header, the
+# 'stream_flush' Ollama option, or the STREAM_FLUSH_<ROUTE> settings.
+
+import asyncio
+
+from .config import settings
+
+DEFAULT_DELAY = 0.2
+# Buffered bytes that force a write whatever the policy says.
+MAX_BUFFER_BYTES = 1024 * 1024
+
+
+class FlushPolicy:
+    __slots__ = ("max_tokens", "max_bytes", "max_delay")
+
+    def __init__(self, max_tokens: int = 1, max_bytes: int = 0, max_delay: float = 0.0):
+        self.max_tokens = max_tokens
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+
+    @property
+    def per_token(self) -> bool:
+        return self.max_tokens <= 1 and self.max_bytes <= 0 and self.max_delay <= 0
+
+    @classmethod
+    def parse(cls, spec: str) -> "FlushPolicy":
+        """Parses 'tokens=N,bytes=M,ms=T'. Raises ValueError on bad input."""
+        spec = (spec or "").strip().lower()
+        if spec in ("", "token", "tokens"):
+            return cls()
+        # Limits that are not given do not apply, except time: a batch must
+        # not sit behind a stalled upstream, so it defaults to DEFAULT_DELAY.
+        policy = cls(max_tokens=0, max_bytes=0, max_delay=DEFAULT_DELAY)
+        for part in spec.split(","):
+            key, sep, value = part.partition("=")
+            key = key.strip()
+            if not sep:
+                raise ValueError(f"Invalid flush policy entry: '{part}'")
+            if key == "tokens":
+                policy.max_tokens = int(value)
+            elif key == "bytes":
+                policy.max_bytes = int(value)
+            elif key == "ms":
+                policy.max_delay = float(value) / 1000
+            else:
+                raise ValueError(f"Unknown flush policy key: '{key}'")
+        return policy
+
+    def __repr__(self):
+        return f"FlushPolicy(tokens={self.max_tokens}, bytes={self.max_bytes}, ms={self.max_delay * 1000:g})"
+
+
+PER_TOKEN = FlushPolicy()
+
+
+def flush_policy_for(headers, ollama_data: dict, route: str) -> FlushPolicy:
+    """
+    Works out a request's flush policy: the X-Stream-Flush header, then the
+    'stream_flush' option, then the route default from the settings.
+    Invalid specs fall back to per-token writes.
+    """
+    spec = headers.get("x-stream-flush")
+    if spec is None:
+        spec = (ollama_data.get("options") or {}).get("stream_flush")
+    if spec is None:
+        spec = settings.STREAM_FLUSH_CHAT if route == "chat" else settings.STREAM_FLUSH_GENERATE
+    try:
+        policy = FlushPolicy.parse(str(spec))
+    except ValueError:
+        return PER_TOKEN
+    return PER_TOKEN if policy.per_token else policy
+
+
+class _Batch:
+    """State shared by the producer and consumer sides of batch_lines()."""
+
+    __slots__ = ("policy", "lines", "size", "deadline", "started", "finished", "error",
+                 "consumer_waiter", "producer_waiter", "writes")
+
+    def __init__(self, policy: FlushPolicy):
+        self.policy = policy
+        self.lines = []
+        self.size = 0
+        self.deadline = None
+        self.started = False
+        self.finished = False
+        self.error = None
+        self.consumer_waiter = None
+        self.producer_waiter = None
+        self.writes = 0
+
+    def full(self) -> bool:
+        """Whether the buffered lines must be written without waiting for the deadline."""
+        if not self.lines:
+            return False
+        policy = self.policy
+        return (not self.started
+                or 0 < policy.max_tokens <= len(self.lines)
+                or 0 < policy.max_bytes <= self.size
+                or self.size >= MAX_BUFFER_BYTES)
+
+    def wake_consumer(self):
+        if self.consumer_waiter is not None and not self.consumer_waiter.done():
+            self.consumer_waiter.set_result(None)
+
+    def take(self) -> bytes:
+        data = b"".join(self.lines)
+        self.lines.clear()
+        self.size = 0
+        self.deadline = None
+        self.started = True
+        self.writes += 1
+        if self.producer_waiter is not None and not self.producer_waiter.done():
+            self.producer_waiter.set_result(None)
+        return data
+
+
+async def _produce(lines, batch: _Batch):
+    loop = asyncio.get_running_loop()
+    try:
+        async for line in lines:
+            arm_timer = not batch.lines and batch.policy.max_delay > 0
+            if arm_timer:
+                batch.deadline = loop.time() + batch.policy.max_delay
+            batch.lines.append(line)
+            batch.size += len(line)
+            full = batch.full()
+            if full or arm_timer:
+                # Either the batch is ready, or the consumer has to start
+                # timing it.
+                batch.wake_consumer()
+            if full:
+                # Backpressure: read no further until the batch is taken.
+                while batch.full():
+                    batch.producer_waiter = loop.create_future()
+                    await batch.producer_waiter
+    except Exception as e:
+        batch.error = e
+    finally:
+        batch.finished = True
+        batch.wake_consumer()
+
+
+async def batch_lines(lines, policy: FlushPolicy):
+    """
+    Regroups an async iterator of stream lines into writes according to
+    'policy'. The first line is passed on as soon as it arrives.
+
+    The source is read by one producer task, so the per-token cost is a
+    list append; the event loop is only involved once per write.
+    """
+    loop = asyncio.get_running_loop()
+    batch = _Batch(policy)
+    producer = loop.create_task(_produce(lines, batch))
+    try:
+        while True:
+            if batch.full() or (batch.finished and batch.lines):
+                yield batch.take()
+                continue
+            if batch.finished:
+                break
+            if batch.deadline is not None and loop.time() >= batch.deadline:
+                yield batch.take()
+                continue
+
+            batch.consumer_waiter = loop.create_future()
+            timer = None
+            if batch.deadline is not None:
+                timer = loop.call_at(batch.deadline, batch.wake_consumer)
+            try:
+                await batch.consumer_waiter
+            finally:
+                if timer is not None:
+                    timer.cancel()
+        if batch.error is not None:
+            raise batch.error
+    finally:
+        if not producer.done():
+            producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+        await lines.aclose()
@@ -0,0 +1,76 @@
+# src/health.py
+
+# Active health checking of the LM Studio backends.
+#
+# Without it a backend's state is only learned from real requests, so after
+# an outage the first users pay the connect timeouts, and a backend that
+# came back stays refused until its cooldown is over. The prober asks every
+# backend's /v1/models on a fixed interval with a short timeout and feeds
+# the result into its circuit breaker (see backends.py): failures count
+# towards opening the circuit, and an answer from a backend whose circuit
+# is open lets it take a trial request right away.
+
+import asyncio
+
+from .config import settings, logger
+from .backends import backend_pool
+from .utils import get_client, is_backend_failure
+
+
+class HealthProber:
+    """Background task probing every backend of a pool."""
+
+    def __init__(self, pool, interval: float = 5.0, timeout: float = 2.0):
+        self.pool = pool
+        self.interval = interval
+        self.timeout = timeout
+        self._task = None
+        self.probes = 0
+
+    async def probe(self, backend) -> bool:
+        """Probes one backend and records the result. Returns whether it answered."""
+        self.probes += 1
+        try:
+            response = await get_client().get(backend.models_url, timeout=self.timeout)
+            response.raise_for_status()
+        except Exception as e:
+            if not is_backend_failure(e):
+                # E.g. 401/404: the server is up, just not happy with the probe.
+                self.pool.record_probe(backend, ok=True)
+                return True
+            logger.debug(f"Health probe of {backend.base_url} failed: {e!r}")
+            self.pool.record_probe(backend, ok=False)
+            return False
+        self.pool.record_probe(backend, ok=True)
+        return True
+
+    async def probe_all(self) -> list:
+        return await asyncio.gather(*(self.probe(b) for b in self.pool.backends))
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.warning(f"Health probing failed: {e}")
+
+
+health_prober = HealthProber(
+    backend_pool,
+    interval=settings.HEALTH_CHECK_INTERVAL,
+    timeout=settings.HEALTH_CHECK_TIMEOUT,
+)
@@ -0,0 +1,253 @@
+# src/images.py
+
+# Optional image preprocessing for vision requests.
+#
+# Ollama clients send images as bare base64, and the translators forward
+# them as-is labelled image/png, whatever they really are. A 12 MP phone
+# JPEG then costs upstream bandwidth and vision-encoder time in LM Studio
+# for detail the model cannot use. When enabled, this stage sniffs the real
+# MIME type from the magic bytes and (if Pillow is installed) downsamples
+# images beyond a maximum edge or pixel budget and recompresses them. The
+# decode/resize work runs in a process pool so it never blocks the event
+# loop, and results are cached by content digest.
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from .config import settings, logger
+from .ingest import is_spilled, spilled_index
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it images are only re-labelled.
+    Image = None
+
+# Magic-byte signatures, checked against the first decoded bytes.
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+# Formats LM Studio's vision models accept without conversion.
+_PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+def sniff_image_mime(data_b64) -> str | None:
+    """Returns the MIME type of a base64-encoded image from its magic bytes."""
+    head = data_b64[:24]
+    if isinstance(head, str):
+        head = head.encode("ascii", "ignore")
+    try:
+        raw = base64.b64decode(head[:len(head) - len(head) % 4])
+    except (binascii.Error, ValueError):
+        return None
+    for signature, mime in _SIGNATURES:
+        if raw.startswith(signature):
+            return mime
+    if raw[:4] == b"RIFF" and raw[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def image_data_url(image: str) -> str:
+    """
+    The data URL an image is forwarded as. Images the preprocessing stage
+    has handled already are data URLs; bare base64 is labelled image/png.
+    """
+    if image.startswith("data:"):
+        return image
+    return f"data:image/png;base64,{image}"
+
+
+def _target_size(width: int, height: int, max_edge: int, max_pixels: int) -> tuple:
+    scale = 1.0
+    if max_edge and max(width, height) > max_edge:
+        scale = max_edge / max(width, height)
+    if max_pixels and width * height * scale * scale > max_pixels:
+        scale = (max_pixels / (width * height)) ** 0.5
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def preprocess_image(data_b64: bytes, max_edge: int, max_pixels: int, quality: int):
+    """
+    Downsamples and recompresses one base64 image (runs in a worker process).
+
+    Returns (mime, base64 bytes) for the replacement, or None when the
+    original should be forwarded unchanged.
+    """
+    raw = base64.b64decode(data_b64)
+    with Image.open(io.BytesIO(raw)) as image:
+        width, height = image.size
+        target = _target_size(width, height, max_edge, max_pixels)
+        if target == (width, height) and image.format in _PASSTHROUGH_FORMATS:
+            return None
+
+        if image.format == "JPEG":
+            # Let the decoder do most of the downscaling (DCT scaling).
+            image.draft("RGB", target)
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        if image.size != target:
+            image = image.resize(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        out = io.BytesIO()
+        if has_alpha:
+            image.save(out, format="PNG", optimize=False)
+            mime = "image/png"
+        else:
+            image.save(out, format="JPEG", quality=quality, optimize=True)
+            mime = "image/jpeg"
+
+    if target == (width, height) and out.tell() >= len(raw):
+        # Only a format conversion, and not a smaller one.
+        return None
+    return mime, base64.b64encode(out.getvalue())
+
+
+class ImagePreprocessor:
+    """
+    Turns the images of an Ollama request into data URLs, sniffing their
+    MIME type and, with Pillow available, shrinking oversized ones.
+    """
+
+    def __init__(self, enabled: bool = False, max_edge: int = 1568, max_pixels: int = 0,
+                 quality: int = 85, workers: int = 0, cache_entries: int = 128):
+        self.enabled = enabled
+        self.max_edge = max_edge
+        self.max_pixels = max_pixels
+        self.quality = quality
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_entries = cache_entries
+        self._cache = OrderedDict()
+        self._pool = None
+        self.hits = 0
+        self.misses = 0
+        self.resized = 0
+        self.failures = 0
+        self.bytes_saved = 0
+        if enabled and Image is None:
+            logger.warning("IMAGE_PREPROCESSING_ENABLED is set but Pillow is not installed; "
+                           "images will only be re-labelled with their real MIME type.")
+
+    @classmethod
+    def from_settings(cls, config=settings) -> "ImagePreprocessor":
+        return cls(
+            enabled=config.IMAGE_PREPROCESSING_ENABLED,
+            max_edge=config.IMAGE_MAX_EDGE,
+            max_pixels=config.IMAGE_MAX_PIXELS,
+            quality=config.IMAGE_JPEG_QUALITY,
+            workers=config.IMAGE_WORKERS,
+            cache_entries=config.IMAGE_CACHE_ENTRIES,
+        )
+
+    async def prepare_images(self, images: list, spool=None) -> list:
+        """Returns the data URLs to forward for a request's 'images' list."""
+        if not self.enabled or not images:
+            return images
+        return list(await asyncio.gather(*(self._prepare(image, spool) for image in images)))
+
+    async def prepare_messages(self, messages: list, spool=None) -> list:
+        """prepare_images() applied to every chat message that carries images."""
+        if not self.enabled:
+            return messages
+        prepared = []
+        for msg in messages:
+            if msg.get("images"):
+                msg = {**msg, "images": await self.prepare_images(msg["images"], spool)}
+            prepared.append(msg)
+        return prepared
+
+    async def _prepare(self, image: str, spool) -> str:
+        if not isinstance(image, str) or image.startswith("data:"):
+            return image
+
+        spilled = spool is not None and is_spilled(image)
+        if Image is None:
+            # Only the MIME type is needed. Spilled images keep their
+            # placeholder; the bytes are spliced back in when the upstream
+            # body is sent.
+            head = next(spool.read(spilled_index(image), 64), b"") if spilled else image[:64]
+            if isinstance(head, bytes):
+                head = head.replace(b"\\/", b"/")
+            return f"data:{sniff_image_mime(head) or 'image/png'};base64,{image}"
+
+        if spilled:
+            # Spooled bytes are still JSON-escaped.
+            data = spool.read_all(spilled_index(image))
+            if b"\\" in data:
+                data = json.loads(b'"' + data + b'"').encode("ascii")
+        else:
+            data = image.encode("ascii", "ignore")
+        mime = sniff_image_mime(data) or "image/png"
+
+        digest = hashlib.sha256(data).hexdigest()
+        cached = self._cache.get(digest)
+        if cached is not None:
+            self._cache.move_to_end(digest)
+            self.hits += 1
+            return cached if cached != "" else f"data:{mime};base64,{image}"
+        self.misses += 1
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._executor(), preprocess_image, data, self.max_edge, self.max_pixels, self.quality
+            )
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Image preprocessing failed, forwarding the original: {e}")
+            result = None
+
+        if result is None:
+            # Cached as "" so the same image is not decoded again.
+            self._remember(digest, "")
+            return f"data:{mime};base64,{image}"
+
+        new_mime, new_data = result
+        self.resized += 1
+        self.bytes_saved += len(data) - len(new_data)
+        url = f"data:{new_mime};base64,{new_data.decode('ascii')}"
+        self._remember(digest, url)
+        return url
+
+    def _remember(self, digest: str, url: str):
+        if self.cache_entries <= 0:
+            return
+        self._cache[digest] = url
+        self._cache.move_to_end(digest)
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pillow": Image is not None,
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "resized": self.resized,
+            "failures": self.failures,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+image_preprocessor = ImagePreprocessor.from_settings()
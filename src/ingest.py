@@ -0,0 +1,286 @@
+# src/ingest.py
+
+# Memory-bounded ingestion of large (multimodal) request bodies.
+#
+# A vision request with a few multi-megabyte base64 images used to be copied
+# three or four times: request.json() materializes it, the translators build
+# new "data:image/...;base64,..." strings, and httpx serializes the whole
+# payload again. For large bodies the shim instead scans the request as it
+# arrives and moves every long JSON string (in practice: the images) into a
+# spooled temporary file, leaving a small placeholder in a "skeleton" that is
+# cheap to parse and translate. The outgoing OpenAI body is then streamed to
+# the backend, splicing the spooled bytes back in where the placeholders are.
+
+import hashlib
+import json
+import re
+import tempfile
+
+from .config import settings
+
+# Placeholder left in the skeleton for a spilled string. NUL characters
+# cannot appear unescaped in JSON, so they make the marker easy to find in
+# the serialized outgoing payload. The digest makes cache and coalescing
+# keys computed over the skeleton reflect the spilled content.
+_PLACEHOLDER = "\x00spill:{index}:{digest}\x00"
+_SERIALIZED_PLACEHOLDER = re.compile(rb"\\u0000spill:(\d+):[0-9a-f]+\\u0000")
+
+_READ_SIZE = 256 * 1024
+
+
+class SpooledStrings:
+    """
+    Raw bytes of the JSON strings spilled out of one request body.
+
+    The bytes are stored exactly as they appeared between the quotes in the
+    request (i.e. still JSON-escaped), so they can be written back into a
+    JSON string verbatim.
+    """
+
+    def __init__(self, max_memory: int):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        # index -> (offset, length)
+        self._spans = []
+
+    def __len__(self):
+        return len(self._spans)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(length for _, length in self._spans)
+
+    def begin(self) -> int:
+        """Starts a new spilled string and returns its index."""
+        self._spans.append((self._file.seek(0, 2), 0))
+        return len(self._spans) - 1
+
+    def write(self, index: int, data) -> None:
+        offset, length = self._spans[index]
+        self._file.write(data)
+        self._spans[index] = (offset, length + len(data))
+
+    def read(self, index: int, size: int = _READ_SIZE):
+        """Yields the bytes of a spilled string in chunks of at most 'size'."""
+        offset, length = self._spans[index]
+        end = offset + length
+        while offset < end:
+            self._file.seek(offset)
+            data = self._file.read(min(size, end - offset))
+            offset += len(data)
+            yield data
+
+    def read_all(self, index: int) -> bytes:
+        return b"".join(self.read(index))
+
+    def encode_body(self, openai_payload: dict) -> "SplicedBody":
+        return SplicedBody(self, json.dumps(openai_payload).encode("utf-8"))
+
+    def close(self):
+        self._file.close()
+
+
+class SplicedBody:
+    """
+    Re-iterable async byte stream of a serialized payload with spilled
+    strings spliced back in. Its exact length is known up front, so it is
+    sent with a Content-Length instead of chunked encoding.
+    """
+
+    def __init__(self, spool: SpooledStrings, skeleton: bytes):
+        self._spool = spool
+        self._segments = []
+        length = 0
+        position = 0
+        for match in _SERIALIZED_PLACEHOLDER.finditer(skeleton):
+            index = int(match.group(1))
+            if index >= len(spool):
+                continue
+            self._segments.append((skeleton[position:match.start()], index))
+            length += match.start() - position + spool._spans[index][1]
+            position = match.end()
+        self._tail = skeleton[position:]
+        self.content_length = length + len(self._tail)
+
+    @property
+    def headers(self) -> dict:
+        return {"Content-Type": "application/json", "Content-Length": str(self.content_length)}
+
+    async def __aiter__(self):
+        for prefix, index in self._segments:
+            if prefix:
+                yield prefix
+            for data in self._spool.read(index):
+                yield data
+        if self._tail:
+            yield self._tail
+
+
+class SpillingJSONReader:
+    """
+    Incremental scanner that splits a JSON document into a small skeleton
+    and spooled long strings.
+
+    It only tracks string boundaries (quotes and backslash escapes), so it
+    runs at memory-copy speed on base64 data; everything else is left for
+    json.loads() to parse from the skeleton.
+    """
+
+    def __init__(self, spill_threshold: int, max_memory: int):
+        self.spill_threshold = spill_threshold
+        self.spool = SpooledStrings(max_memory)
+        self._skeleton = bytearray()
+        self._in_string = False
+        # Content of the current string while it is still short.
+        self._pending = bytearray()
+        # Index in the spool once the current string has been spilled.
+        self._spilled = None
+        self._digest = None
+        # Whether the data seen so far in the current string ends in an
+        # unpaired backslash (so the next character is escaped).
+        self._escaped = False
+
+    def feed(self, chunk: bytes):
+        position = 0
+        size = len(chunk)
+        while position < size:
+            if not self._in_string:
+                quote = chunk.find(b'"', position)
+                if quote < 0:
+                    self._skeleton += chunk[position:]
+                    return
+                self._skeleton += chunk[position:quote + 1]
+                self._in_string = True
+                self._escaped = False
+                position = quote + 1
+                continue
+
+            end = self._find_closing_quote(chunk, position)
+            if end < 0:
+                self._string_data(chunk[position:])
+                self._escaped = self._ends_escaped(chunk, position, size, self._escaped)
+                return
+            self._string_data(chunk[position:end])
+            self._end_string()
+            position = end + 1
+
+    def finish(self):
+        """Returns the parsed skeleton and the spool (None if nothing was spilled)."""
+        data = json.loads(bytes(self._skeleton))
+        if not len(self.spool):
+            self.spool.close()
+            return data, None
+        return data, self.spool
+
+    def _find_closing_quote(self, chunk: bytes, position: int) -> int:
+        start = position
+        escaped = self._escaped
+        while True:
+            quote = chunk.find(b'"', position)
+            if quote < 0:
+                return -1
+            if not self._ends_escaped(chunk, start, quote, escaped):
+                return quote
+            position = quote + 1
+
+    @staticmethod
+    def _ends_escaped(chunk: bytes, start: int, end: int, escaped_before: bool) -> bool:
+        """Whether chunk[start:end] (continuing a string) leaves the next byte escaped."""
+        backslashes = 0
+        i = end - 1
+        while i >= start and chunk[i] == 0x5C:  # '\'
+            backslashes += 1
+            i -= 1
+        if i < start:
+            # The whole span is backslashes; carry over the previous state.
+            return escaped_before ^ (backslashes % 2 == 1)
+        return backslashes % 2 == 1
+
+    def _string_data(self, data: bytes):
+        if not data:
+            return
+        if self._spilled is not None:
+            self.spool.write(self._spilled, data)
+            self._digest.update(data)
+            return
+        self._pending += data
+        if len(self._pending) > self.spill_threshold:
+            self._spilled = self.spool.begin()
+            self._digest = hashlib.sha256()
+            self.spool.write(self._spilled, self._pending)
+            self._digest.update(self._pending)
+            self._pending = bytearray()
+
+    def _end_string(self):
+        if self._spilled is None:
+            self._skeleton += self._pending
+            self._skeleton += b'"'
+            self._pending.clear()
+        else:
+            placeholder = _PLACEHOLDER.format(index=self._spilled, digest=self._digest.hexdigest()[:32])
+            # json.dumps() of the marker, minus its opening quote (already in
+            # the skeleton).
+            self._skeleton += json.dumps(placeholder).encode("ascii")[1:]
+            self._spilled = None
+            self._digest = None
+        self._in_string = False
+
+
+async def read_request_json(request):
+    """
+    Reads a request's JSON body.
+
+    Bodies below LARGE_PAYLOAD_BYTES (by Content-Length) go through the
+    regular request.json(). Larger or unsized ones (no or a malformed
+    Content-Length) are scanned as they arrive, spilling long strings to a
+    spool. Returns (data, spool); spool is None unless something was
+    spilled, and must be closed by the caller.
+    """
+    try:
+        content_length = int(request.headers["content-length"])
+    except (KeyError, ValueError):
+        # A missing or malformed length: read it as an unsized body.
+        content_length = None
+    if content_length is not None and content_length < settings.LARGE_PAYLOAD_BYTES:
+        return await request.json(), None
+
+    reader = SpillingJSONReader(settings.SPILL_STRING_BYTES, settings.SPOOL_MEMORY_BYTES)
+    try:
+        async for chunk in request.stream():
+            reader.feed(chunk)
+        return reader.finish()
+    except BaseException:
+        reader.spool.close()
+        raise
+
+
+def upstream_body_kwargs(openai_payload: dict, spool: SpooledStrings | None) -> dict:
+    """httpx request arguments for sending 'openai_payload' upstream."""
+    if spool is None:
+        return {"json": openai_payload}
+    body = spool.encode_body(openai_payload)
+    return {"content": body, "headers": body.headers}
+
+
+def is_spilled(value) -> bool:
+    """Whether a string from a parsed skeleton is a spilled-string placeholder."""
+    return isinstance(value, str) and value.startswith("\x00spill:")
+
+
+def spilled_index(placeholder: str) -> int:
+    """The spool index referenced by a spilled-string placeholder."""
+    return int(placeholder.split(":", 2)[1])
+
+
+def unspill(value, spool: SpooledStrings | None):
+    """
+    The real string behind a spilled-string placeholder, read back from
+    'spool'; anything else (or a placeholder the spool does not hold) is
+    returned unchanged.
+    """
+    if spool is None or not is_spilled(value):
+        return value
+    index = spilled_index(value)
+    if index >= len(spool):
+        return value
+    # Spilled bytes are still JSON-escaped.
+    return json.loads(b'"' + spool.read_all(index) + b'"')
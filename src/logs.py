@@ -0,0 +1,229 @@
+# src/logs.py
+
+# Logging that stays off the event loop.
+#
+# Three things used to make logging expensive on the request path:
+#   - Payload dumps were built in f-strings, so megabytes of base64 images
+#     were serialized even with DEBUG off. Redacted() defers the dump to
+#     the moment a record is actually emitted, and replaces images, data
+#     URLs and other base64 blobs with a size summary (long strings are
+#     truncated).
+#   - Handlers wrote to stderr (and uvicorn's handlers to the terminal) on
+#     the event loop. LogPipeline puts a QueueHandler in front of them: the
+#     loop at most renders the message and enqueues the record, and a writer
+#     thread formats it and does the I/O. The queue is bounded; when the
+#     writer cannot keep up, records are dropped and counted rather than
+#     blocking requests.
+#   - Every request logged a few INFO lines. LOG_SAMPLE_RATE keeps the
+#     INFO/DEBUG lines of only that fraction of requests (decided once per
+#     request by LogSamplingMiddleware); warnings and errors always pass.
+
+import contextvars
+import json
+import logging
+import queue
+import random
+import re
+import threading
+
+# Whether the current request's INFO/DEBUG records are kept. Outside a
+# request (startup, background tasks) they always are.
+_request_sampled = contextvars.ContextVar("request_sampled", default=True)
+
+_BASE64 = re.compile(r"[A-Za-z0-9+/=\r\n]+")
+_DATA_URL = re.compile(r"data:([\w.+/-]*);base64,")
+# Strings at least this long are checked for being base64 data.
+_BLOB_CHARS = 1024
+
+
+def _human_size(count: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if count < 1024:
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} GB"
+
+
+def _blob_summary(kind: str, encoded_chars: int) -> str:
+    return f"<{kind}: {_human_size(encoded_chars * 3 // 4)}, {encoded_chars} base64 chars>"
+
+
+def redact(value, max_chars: int = 256, key: str | None = None):
+    """
+    Returns a copy of a JSON-like value that is safe and cheap to log:
+    images and base64 strings become size summaries, other strings longer
+    than 'max_chars' are truncated.
+    """
+    if isinstance(value, dict):
+        return {k: redact(v, max_chars, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v, max_chars, key) for v in value]
+    if not isinstance(value, str):
+        return value
+    if value.startswith("\x00spill:"):
+        return "<spilled string>"
+    match = _DATA_URL.match(value)
+    if match:
+        return _blob_summary(f"data URL {match.group(1) or 'base64'}", len(value) - match.end())
+    if key == "images":
+        return _blob_summary("image", len(value))
+    if len(value) >= _BLOB_CHARS and _BASE64.fullmatch(value, 0, _BLOB_CHARS):
+        return _blob_summary("base64", len(value))
+    if len(value) > max_chars:
+        return f"{value[:max_chars]}... (+{len(value) - max_chars} chars)"
+    return value
+
+
+class Redacted:
+    """
+    Log argument for a payload: logger.debug("Payload: %s", Redacted(data)).
+    The redacted JSON is only built if the record is emitted.
+    """
+
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value, max_chars: int = 256):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        return json.dumps(redact(self.value, self.max_chars), ensure_ascii=False, default=str)
+
+
+_IMMUTABLE = (str, int, float, bytes, type(None))
+
+
+def _immutable_args(args) -> bool:
+    return isinstance(args, tuple) and all(
+        isinstance(arg, _IMMUTABLE) or (isinstance(arg, tuple) and all(isinstance(a, _IMMUTABLE) for a in arg))
+        for arg in args
+    )
+
+
+class _QueueHandler(logging.Handler):
+    """Hands records to the pipeline's writer thread."""
+
+    def __init__(self, pipeline, targets: list):
+        super().__init__()
+        self.pipeline = pipeline
+        self.targets = targets
+
+    def filter(self, record) -> bool:
+        if record.levelno < logging.WARNING and not _request_sampled.get():
+            return False
+        return super().filter(record)
+
+    def emit(self, record):
+        try:
+            # Arguments that may still change (payload dicts in use by the
+            # request) are rendered now, on the calling thread. Immutable ones
+            # are left to the writer thread, which also runs the formatter
+            # (uvicorn's access formatter reads the arguments) and formats
+            # tracebacks.
+            if record.args and not _immutable_args(record.args):
+                record.msg = record.getMessage()
+                record.args = None
+            self.pipeline.enqueue(self.targets, record)
+        except Exception:
+            self.handleError(record)
+
+
+class LogPipeline:
+    """
+    A bounded queue and a writer thread behind the handlers of some loggers.
+
+    attach() moves a logger's handlers behind the queue, detach() puts them
+    back. The writer thread runs while anything is attached.
+    """
+
+    def __init__(self, max_queue: int = 10000):
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._attached = {}
+
+    def enqueue(self, targets: list, record):
+        try:
+            self._queue.put_nowait((targets, record))
+        except queue.Full:
+            self.dropped += 1
+
+    def attach(self, logger: logging.Logger, handlers: list | None = None):
+        """
+        Routes 'logger' through the queue: to its current handlers, or to
+        'handlers' (which are then owned by the pipeline).
+        """
+        if logger.name in self._attached:
+            return
+        if handlers is None:
+            handlers = list(logger.handlers)
+            if not handlers:
+                return
+            for handler in handlers:
+                logger.removeHandler(handler)
+            restore = handlers
+        else:
+            restore = []
+        queue_handler = _QueueHandler(self, handlers)
+        logger.addHandler(queue_handler)
+        self._attached[logger.name] = (logger, queue_handler, restore)
+        self._start()
+
+    def detach(self, logger: logging.Logger):
+        entry = self._attached.pop(logger.name, None)
+        if entry is None:
+            return
+        _, queue_handler, restore = entry
+        logger.removeHandler(queue_handler)
+        for handler in restore:
+            logger.addHandler(handler)
+        if not self._attached:
+            self.stop()
+
+    def stop(self):
+        """Writes out what is queued and stops the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        self._queue = queue.Queue(self.max_queue)
+        self._thread = threading.Thread(target=self._run, name="shim-log-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            targets, record = item
+            for handler in targets:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+class LogSamplingMiddleware:
+    """
+    ASGI middleware deciding once per request whether its INFO/DEBUG lines
+    are logged. 'rate' is a callable so the setting can change at runtime.
+    """
+
+    def __init__(self, app, rate):
+        self.app = app
+        self.rate = rate
+
+    async def __call__(self, scope, receive, send):
+        rate = self.rate()
+        if scope["type"] != "http" or rate >= 1.0:
+            await self.app(scope, receive, send)
+            return
+        token = _request_sampled.set(random.random() < rate)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_sampled.reset(token)
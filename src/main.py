@@ -1,28 +1,53 @@
 # src/main.py
 
-import uvicorn
+import argparse
 import logging
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 
 # --- THIS IS THE FIX ---
 # Use relative imports
-from .config import settings
+from .config import settings, log_pipeline
+from .logs import LogSamplingMiddleware
 from .utils import startup_client, shutdown_client
-from .routes import health, ollama_compat, chat, generate, unsupported
+from .catalog import model_catalog
+from .health import health_prober
+from .images import image_preprocessor
+from .server import MODES, run as run_server
+from .routes import health, ollama_compat, chat, generate, embeddings, openai, unsupported, backends, metrics, debug
 
 # --- Logging Configuration ---
-logging.basicConfig(level=settings.LOG_LEVEL.upper())
+# Like logging.basicConfig, but the root handler is written to by the log
+# pipeline's thread rather than the event loop (see logs.py).
+root_logger = logging.getLogger()
+if not root_logger.handlers:
+    root_handler = logging.StreamHandler()
+    root_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    log_pipeline.attach(root_logger, [root_handler])
+root_logger.setLevel(settings.LOG_LEVEL.upper())
 logger = logging.getLogger("uvicorn.error")
 logger.setLevel(settings.LOG_LEVEL.upper())
 
+# uvicorn configures its own handlers before the app starts; these are
+# moved behind the queue for as long as the app runs.
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.access")
+
 
 # --- App Lifespan ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    for name in UVICORN_LOGGERS:
+        log_pipeline.attach(logging.getLogger(name))
     await startup_client()
+    await model_catalog.start_discovery(settings.MODEL_DISCOVERY_INTERVAL)
+    health_prober.start()
     yield
+    await health_prober.aclose()
+    await model_catalog.aclose()
+    image_preprocessor.shutdown()
     await shutdown_client()
+    for name in UVICORN_LOGGERS:
+        log_pipeline.detach(logging.getLogger(name))
 
 # --- Create FastAPI App ---
 app = FastAPI(
@@ -32,33 +57,40 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Per-request log sampling (LOG_SAMPLE_RATE).
+app.add_middleware(LogSamplingMiddleware, rate=lambda: settings.LOG_SAMPLE_RATE)
+
 # --- Include Routers ---
 logger.info("Including routers...")
 app.include_router(health.router, tags=["Health"])
 app.include_router(ollama_compat.router, tags=["Ollama Compatibility"])
 app.include_router(chat.router, tags=["Ollama API"])
 app.include_router(generate.router, tags=["Ollama API"])
+app.include_router(embeddings.router, tags=["Ollama API"])
+app.include_router(openai.router, tags=["OpenAI API"])
 app.include_router(unsupported.router, tags=["Unsupported"])
+app.include_router(backends.router, tags=["Shim"])
+app.include_router(metrics.router, tags=["Shim"])
+app.include_router(debug.router, tags=["Shim"])
 
 
 # --- Run with Uvicorn ---
 def main():
     """
     This function is the entry point for the console script.
+    'ollama-shim --mode production' runs the production server (see
+    server.py); without --mode, SHIM_MODE decides.
     """
-    logger.info("Starting Uvicorn server...")
-    uvicorn.run(
-        "src.main:app",
-        host="0.0.0.0",
-        port=settings.SHIM_PORT,
-        log_level=settings.LOG_LEVEL.lower(),
-        reload=True,
-    )
+    parser = argparse.ArgumentParser(description="Ollama to LM Studio Shim")
+    parser.add_argument("--mode", choices=MODES, default=None,
+                        help="server mode (default: SHIM_MODE, normally 'development')")
+    args = parser.parse_args()
+    run_server(args.mode)
 
 
 if __name__ == "__main__":
     """
     This block allows you to run the app directly for testing:
-    python -m src.main
+    python -m src.main [--mode production]
     """
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,326 @@
+# src/metrics.py
+
+# Prometheus metrics for the shim.
+#
+# A deliberately small, dependency-free registry: counters, gauges and
+# histograms with label children, rendered in the Prometheus text format by
+# the /metrics route. Label children are looked up once per request; the
+# per-token work in stream_translator is a counter bump, and latency
+# histograms are observed once per stream.
+#
+# Every distinct label value adds series that live as long as the process,
+# so the client-supplied model name is bounded by ModelLabels before it
+# becomes a label.
+
+import itertools
+import time
+import weakref
+from bisect import bisect_left
+
+from .config import settings
+
+# Latency buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# Inter-token gaps are much shorter than request latencies.
+INTER_TOKEN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0)
+THROUGHPUT_BUCKETS = (1, 2.5, 5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200, 300)
+
+REQUEST_LABELS = ("route", "model", "backend")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One slot per bucket plus one for +Inf; not cumulative until rendered.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, values, child) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            bucket_labels = _format_labels(self.labelnames, values, 'le="' + le + '"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        # Callables returning extra exposition lines, evaluated at scrape time
+        # for state that lives elsewhere (caches, backend pool).
+        self._collectors = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+def render_samples(name: str, kind: str, documentation: str, samples) -> list:
+    """
+    Renders exposition lines for a metric computed at scrape time.
+    'samples' is an iterable of (labels dict, value) pairs.
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {value}")
+    return lines
+
+
+registry = Registry()
+
+REQUESTS = registry.register(Counter(
+    "ollama_shim_requests_total", "Requests handled, by route, model and backend.", REQUEST_LABELS))
+ERRORS = registry.register(Counter(
+    "ollama_shim_request_errors_total", "Requests that failed, by reason.", REQUEST_LABELS + ("reason",)))
+REQUEST_DURATION = registry.register(Histogram(
+    "ollama_shim_request_duration_seconds", "Time from request arrival to the last byte of the answer.",
+    REQUEST_LABELS))
+TIME_TO_FIRST_TOKEN = registry.register(Histogram(
+    "ollama_shim_time_to_first_token_seconds", "Time from request arrival to the first streamed token.",
+    REQUEST_LABELS))
+INTER_TOKEN_LATENCY = registry.register(Histogram(
+    "ollama_shim_inter_token_latency_seconds", "Mean gap between streamed tokens, one observation per stream.",
+    REQUEST_LABELS, buckets=INTER_TOKEN_BUCKETS))
+TOKENS_PER_SECOND = registry.register(Histogram(
+    "ollama_shim_tokens_per_second", "Generation throughput, one observation per request.",
+    REQUEST_LABELS, buckets=THROUGHPUT_BUCKETS))
+UPSTREAM_CONNECT = registry.register(Histogram(
+    "ollama_shim_upstream_connect_seconds", "Time from sending the upstream request to its response headers.",
+    REQUEST_LABELS))
+QUEUE_WAIT = registry.register(Histogram(
+    "ollama_shim_queue_wait_seconds", "Time spent waiting for a backend admission slot.", REQUEST_LABELS))
+CANCELLATIONS = registry.register(Counter(
+    "ollama_shim_client_cancellations_total",
+    "Requests whose upstream generation was aborted because the client disconnected, by phase (stream, response).",
+    REQUEST_LABELS + ("phase",)))
+ACTIVE_STREAMS = registry.register(Gauge(
+    "ollama_shim_active_streams", "Streams currently being relayed to clients.", REQUEST_LABELS))
+UPSTREAM_RETRIES = registry.register(Counter(
+    "ollama_shim_upstream_retries_total",
+    "Upstream failures retried, or not retried because the retry budget was exhausted, by outcome.",
+    ("outcome",)))
+HEDGED_REQUESTS = registry.register(Counter(
+    "ollama_shim_hedged_requests_total",
+    "Duplicate requests sent to another backend after the observed p95 latency (sent), and how many answered first (won).",
+    ("outcome",)))
+
+
+class ModelLabels:
+    """
+    Maps model names to 'model' label values. Names in 'known' (the models the
+    backends report) are kept; up to 'limit' other names are kept as they
+    first appear, and the rest are collapsed into OTHER.
+    """
+
+    OTHER = "other"
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.known = frozenset()
+        self._admitted = set()
+
+    def label(self, model: str) -> str:
+        if not model or model in self.known or model in self._admitted:
+            return model
+        if len(self._admitted) >= self.limit:
+            return self.OTHER
+        self._admitted.add(model)
+        return model
+
+
+model_labels = ModelLabels(settings.METRICS_MAX_MODEL_LABELS)
+
+
+# --- Recording helpers ---
+#
+# Routes keep per-request facts in a plain 'request_stats' dict ("route",
+# "model", "started", and, once known, "backend", "queue_wait", "sent",
+# "connect"). These helpers turn it into observations.
+
+class RequestStats(dict):
+    """A request_stats dict that can be weakly referenced."""
+    __slots__ = ("__weakref__",)
+
+
+# Stats of the requests still alive (being handled or streaming), for
+# /debug/memory. A stats dict lives as long as its request's stream, so a
+# count that keeps growing points at streams that are never closed.
+_live_requests = weakref.WeakValueDictionary()
+_request_ids = itertools.count()
+
+
+def new_request_stats(route: str, model: str) -> dict:
+    stats = RequestStats(route=route, model=model, started=time.perf_counter())
+    _live_requests[next(_request_ids)] = stats
+    return stats
+
+
+def live_requests_by_route() -> dict:
+    counts = {}
+    for stats in list(_live_requests.values()):
+        route = stats.get("route", "")
+        counts[route] = counts.get(route, 0) + 1
+    return counts
+
+
+def request_labels(stats: dict) -> tuple:
+    return (stats.get("route", ""), model_labels.label(stats.get("model", "")), stats.get("backend", "none"))
+
+
+def record_request(stats: dict):
+    """Counts an answered request and observes its admission and connect times."""
+    labels = request_labels(stats)
+    REQUESTS.labels(*labels).inc()
+    if "queue_wait" in stats:
+        QUEUE_WAIT.labels(*labels).observe(stats["queue_wait"])
+    if "connect" in stats:
+        UPSTREAM_CONNECT.labels(*labels).observe(stats["connect"])
+
+
+def record_error(stats: dict, reason: str, count_request: bool = True):
+    """
+    Counts a failed request. Pass count_request=False for failures after the
+    request was already counted (e.g. a stream breaking part-way).
+    """
+    labels = request_labels(stats)
+    if count_request:
+        REQUESTS.labels(*labels).inc()
+    ERRORS.labels(*labels, reason).inc()
+
+
+def record_completion(stats: dict, completion_tokens: int | None = None):
+    """Observes the duration (and throughput) of a non-streaming answer."""
+    labels = request_labels(stats)
+    duration = time.perf_counter() - stats["started"]
+    REQUEST_DURATION.labels(*labels).observe(duration)
+    if completion_tokens and duration > 0:
+        TOKENS_PER_SECOND.labels(*labels).observe(completion_tokens / duration)
+
+
+def record_stream(stats: dict, tokens: int, first_token_at: float | None, last_token_at: float):
+    """Observes the latency profile of a finished stream."""
+    labels = request_labels(stats)
+    started = stats["started"]
+    REQUEST_DURATION.labels(*labels).observe(last_token_at - started)
+    if first_token_at is None:
+        return
+    TIME_TO_FIRST_TOKEN.labels(*labels).observe(first_token_at - started)
+    generation_time = last_token_at - first_token_at
+    if tokens > 1 and generation_time > 0:
+        INTER_TOKEN_LATENCY.labels(*labels).observe(generation_time / (tokens - 1))
+        TOKENS_PER_SECOND.labels(*labels).observe((tokens - 1) / generation_time)
+
+
+def record_cancellation(stats: dict, phase: str):
+    """Counts an upstream generation aborted because the client disconnected."""
+    CANCELLATIONS.labels(*request_labels(stats), phase).inc()
+
@@ -0,0 +1,95 @@
+# src/ndjson.py
+
+# Fast path for the Ollama NDJSON stream.
+#
+# stream_translator emits one line per token, so per-token overhead is most
+# of the shim's CPU on busy servers. Every line of a stream shares the same
+# shape and only the content (and the timestamp) changes, so ChunkEncoder
+# renders the invariant parts once per stream and escapes only the token.
+# Timestamps come from a clock that is formatted at most once per tick, and
+# the upstream events are parsed with orjson when it is installed.
+
+import json
+import time
+from datetime import datetime, timezone
+from json.encoder import encode_basestring_ascii as _escape
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib json module is the fallback.
+    orjson = None
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+else:
+    loads = json.loads
+
+    def dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+
+class CoarseClock:
+    """
+    ISO 8601 UTC timestamps (the format of get_iso_timestamp) that are
+    re-rendered only when the clock has moved on by 'resolution' seconds.
+    """
+
+    __slots__ = ("resolution", "_tick", "_timestamp")
+
+    def __init__(self, resolution: float = 0.01):
+        self.resolution = resolution
+        self._tick = None
+        self._timestamp = ""
+
+    def now(self) -> str:
+        tick = int(time.time() / self.resolution)
+        if tick != self._tick:
+            self._tick = tick
+            self._timestamp = datetime.fromtimestamp(tick * self.resolution, timezone.utc) \
+                .isoformat(timespec="microseconds").replace("+00:00", "Z")
+        return self._timestamp
+
+
+# Shared by all streams, so a busy server formats one timestamp per tick.
+coarse_clock = CoarseClock()
+
+
+class ChunkEncoder:
+    """Renders the NDJSON lines of one Ollama stream as UTF-8 bytes."""
+
+    __slots__ = ("model_name", "_prefix", "_middle", "_suffix", "_content_key")
+
+    def __init__(self, response_format: str, model_name: str):
+        self.model_name = model_name
+        # Same keys and order as Ollama's own (compact) stream lines.
+        self._prefix = '{"model":' + _escape(model_name) + ',"created_at":"'
+        if response_format == "chat":
+            self._content_key = "message"
+            self._middle = '","message":{"role":"assistant","content":'
+            self._suffix = '},"done":false}\n'
+        else:  # "generate"
+            self._content_key = "response"
+            self._middle = '","response":'
+            self._suffix = ',"done":false}\n'
+
+    def token(self, content: str) -> bytes:
+        """The line for one streamed piece of content."""
+        return "".join((self._prefix, coarse_clock.now(), self._middle, _escape(content), self._suffix)).encode()
+
+    def final(self, content: str = "", **fields) -> bytes:
+        """The closing 'done' line, with any extra fields (durations, counts, context)."""
+        chunk = {"model": self.model_name, "created_at": coarse_clock.now()}
+        if self._content_key == "message":
+            chunk["message"] = {"role": "assistant", "content": content}
+        else:
+            chunk["response"] = content
+        chunk["done"] = True
+        chunk.update(fields)
+        return (dumps(chunk) + "\n").encode()
+
+    @staticmethod
+    def error(message: str) -> bytes:
+        return (dumps({"error": message, "done": True}) + "\n").encode()
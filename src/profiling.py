@@ -0,0 +1,165 @@
+# src/profiling.py
+
+# On-demand CPU and memory introspection for the /debug endpoints.
+#
+# SamplingProfiler answers "what is the event loop busy with right now":
+# while a profile runs, a background thread looks at the loop thread's
+# Python stack every few milliseconds (sys._current_frames) and counts the
+# stacks it sees. Nothing is hooked into the code being profiled, so the
+# cost is one stack walk per sample and nothing at all between profiles.
+# Time spent in C code (orjson, the json encoder, zlib) shows up under the
+# Python function that called it; image preprocessing in the worker
+# processes is not sampled. The result is in the "collapsed stack" format
+# ('frame;frame;frame count' per line) that flamegraph.pl, speedscope and
+# inferno read directly.
+#
+# memory_report() uses tracemalloc. Tracing slows every allocation down, so
+# unless it is already on (PYTHONTRACEMALLOC) it is switched on only for the
+# requested window, and the report shows what was allocated during that
+# window and is still alive. Live requests per route come from the request
+# stats registry in metrics.py.
+#
+# Only one profile and one memory report run at a time; a second request
+# is refused rather than doubling the overhead.
+
+import asyncio
+import gc
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+
+from .config import settings
+from .metrics import live_requests_by_route
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile (or memory report) is already running."""
+
+
+def _frame_label(code) -> str:
+    # The function's first line rather than the current one, so that samples
+    # anywhere in a function fold into one frame.
+    path = code.co_filename.replace(os.sep, "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack from a background thread."""
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._labels = {}
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def profile(self, seconds: float, thread_id: int | None = None) -> Counter:
+        """
+        Samples 'thread_id' (default: the calling thread, i.e. the event loop)
+        for 'seconds' and returns a Counter of collapsed stacks.
+        """
+        if self._running:
+            raise ProfilerBusy("A profile is already running.")
+        self._running = True
+        stacks = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident() if thread_id is None else thread_id, stacks, stop),
+            name="shim-profiler",
+            daemon=True,
+        )
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            self._running = False
+        return stacks
+
+    def _sample(self, thread_id: int, stacks: Counter, stop: threading.Event):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            stacks[self._collapse(frame)] += 1
+
+    def _collapse(self, frame) -> str:
+        labels = []
+        while frame is not None and len(labels) < self.max_depth:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = _frame_label(code)
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        return ";".join(labels)
+
+
+def collapsed_stacks(stacks: Counter) -> str:
+    """Renders stack counts as collapsed-stack lines, most frequent first."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+_memory_lock = asyncio.Lock()
+
+_IGNORED_FILES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def _top_types(limit: int) -> list:
+    counts = Counter(type(obj).__qualname__ for obj in gc.get_objects())
+    return [{"type": name, "count": count} for name, count in counts.most_common(limit)]
+
+
+async def memory_report(seconds: float, limit: int = 25, types: int = 0) -> dict:
+    """
+    Top allocation sites by live size, live requests per route and, with
+    'types', the most common object types among gc-tracked objects (this
+    walks every object, so it is opt-in).
+    """
+    if _memory_lock.locked():
+        raise ProfilerBusy("A memory report is already running.")
+    async with _memory_lock:
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            # One frame per trace: the allocation site is all that is reported.
+            tracemalloc.start(1)
+        try:
+            if started_here:
+                await asyncio.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+            traced_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+
+    statistics = snapshot.filter_traces(_IGNORED_FILES).statistics("lineno")
+    report = {
+        "window_seconds": seconds if started_here else None,
+        "traced_bytes": traced_bytes,
+        "peak_traced_bytes": peak_bytes,
+        "top_allocators": [
+            {"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+             "bytes": stat.size, "blocks": stat.count}
+            for stat in statistics[:limit]
+        ],
+        "live_requests": live_requests_by_route(),
+    }
+    if types:
+        report["object_types"] = _top_types(types)
+    return report
+
+
+profiler = SamplingProfiler(interval=1 / max(1, settings.PROFILE_SAMPLE_HZ))
@@ -0,0 +1,202 @@
+# src/retry.py
+
+# Retries and hedged requests for upstream chat completions.
+#
+# A connect error or a 5xx answer means LM Studio generated nothing, so the
+# request can safely be sent again, preferably to another backend. Retries
+# wait a jittered exponential backoff ("full jitter": a random delay up to
+# base * 2^attempt) so that clients failing together do not come back
+# together, and they draw on a retry budget: every request earns a fraction
+# of a retry, plus a small steady allowance, so that when a backend is
+# really down the shim does not multiply the load on whatever is left.
+#
+# Hedging is for tail latency on non-streaming requests: when no answer has
+# arrived after the observed p95 latency for the model, a duplicate is sent
+# to another backend, the first answer wins and the other request is
+# cancelled (which aborts its generation upstream). Hedges cost a whole
+# duplicate generation, so they are off by default and take from the same
+# budget as retries.
+#
+# Streams are only retried while opening, i.e. before the first byte has
+# been sent to the client; once a stream is relayed it is never restarted.
+
+import asyncio
+import random
+import time
+from collections import deque
+
+import httpx
+
+from .config import logger
+from .metrics import UPSTREAM_RETRIES, HEDGED_REQUESTS
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Failures where the upstream produced nothing: connect errors and 5xx answers."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+def hedging_requested(headers, default: bool) -> bool:
+    """An 'X-Hedge: on|off' header overrides the configured default."""
+    header = (headers.get("x-hedge") or "").strip().lower()
+    if header in ("1", "on", "true", "yes"):
+        return True
+    if header in ("0", "off", "false", "no"):
+        return False
+    return default
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries (and hedges) to a fraction of requests.
+
+    Every request deposits 'ratio' tokens and every retry takes a whole one;
+    'min_per_second' tokens are added over time regardless of traffic so a
+    quiet shim can still retry. The balance never exceeds 'capacity'.
+    """
+
+    __slots__ = ("ratio", "min_per_second", "capacity", "balance", "_refilled_at")
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, capacity: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.balance = capacity
+        self._refilled_at = time.monotonic()
+
+    def deposit(self):
+        self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        now = time.monotonic()
+        self.balance = min(self.capacity, self.balance + (now - self._refilled_at) * self.min_per_second)
+        self._refilled_at = now
+        if self.balance < 1.0:
+            return False
+        self.balance -= 1.0
+        return True
+
+
+class LatencyWindow:
+    """The last 'size' latencies of one model, for its hedging delay."""
+
+    __slots__ = ("samples", "_sorted")
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+        self._sorted = None
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self._sorted = None
+
+    def quantile(self, q: float) -> float:
+        if self._sorted is None:
+            self._sorted = sorted(self.samples)
+        return self._sorted[min(len(self._sorted) - 1, int(q * len(self._sorted)))]
+
+
+class RetryPolicy:
+    """
+    Runs upstream attempts with retries and, optionally, hedging.
+
+    An attempt is a coroutine function taking the set of backends already
+    tried; it should prefer a backend outside it and add the one it used.
+    """
+
+    def __init__(self, retries: int = 2, backoff_base: float = 0.1, backoff_max: float = 2.0,
+                 budget: RetryBudget | None = None, hedge_quantile: float = 0.95,
+                 hedge_min_delay: float = 0.05, hedge_min_samples: int = 20):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget = budget if budget is not None else RetryBudget()
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = {}
+
+    def backoff(self, retry: int) -> float:
+        """Full-jitter delay before retry number 'retry' (counting from 1)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (retry - 1)))
+
+    def observe(self, model: str, seconds: float):
+        window = self.latencies.get(model)
+        if window is None:
+            window = self.latencies[model] = LatencyWindow()
+        window.observe(seconds)
+
+    def hedge_delay(self, model: str) -> float | None:
+        """Seconds to wait before hedging, or None while too little is known about the model."""
+        window = self.latencies.get(model)
+        if window is None or len(window.samples) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, window.quantile(self.hedge_quantile))
+
+    async def call(self, attempt, model: str | None = None, hedge: bool = False, has_alternative=None):
+        """
+        Runs 'attempt' until it succeeds, fails with something not worth
+        retrying, or runs out of retries or budget. With a 'model', successful
+        latencies are recorded for it and, if 'hedge' is set and
+        'has_alternative(tried)' says another backend could take it, slow
+        attempts are hedged.
+        """
+        self.budget.deposit()
+        tried = set()
+        retry = 0
+        while True:
+            started = time.monotonic()
+            try:
+                delay = self.hedge_delay(model) if hedge and model is not None else None
+                if delay is None:
+                    result = await attempt(tried)
+                else:
+                    result = await self._hedged(attempt, tried, delay, has_alternative)
+            except Exception as e:
+                if not is_retryable(e) or retry >= self.retries:
+                    raise
+                if not self.budget.try_withdraw():
+                    UPSTREAM_RETRIES.labels("budget_exhausted").inc()
+                    logger.warning(f"Not retrying upstream failure, retry budget exhausted: {e!r}")
+                    raise
+                retry += 1
+                UPSTREAM_RETRIES.labels("retried").inc()
+                delay = self.backoff(retry)
+                logger.warning(f"Upstream attempt failed ({e!r}); retry {retry}/{self.retries} in {delay * 1000:.0f} ms.")
+                await asyncio.sleep(delay)
+                continue
+            if model is not None:
+                self.observe(model, time.monotonic() - started)
+            return result
+
+    async def _hedged(self, attempt, tried: set, delay: float, has_alternative):
+        primary = asyncio.ensure_future(attempt(tried))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or (has_alternative is not None and not has_alternative(tried)) or not self.budget.try_withdraw():
+                return await primary
+
+            HEDGED_REQUESTS.labels("sent").inc()
+            logger.info(f"No upstream answer after {delay * 1000:.0f} ms; hedging on another backend.")
+            hedge = asyncio.ensure_future(attempt(tried))
+            tasks.append(hedge)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            HEDGED_REQUESTS.labels("won").inc()
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            # The loser (or both, if the caller went away) is cancelled,
+            # which closes its upstream connection and frees its backend.
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
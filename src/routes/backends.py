@@ -0,0 +1,24 @@
+# src/routes/backends.py
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from ..utils import logger, upstream_pool_stats
+from ..backends import backend_pool
+
+router = APIRouter()
+
+@router.get("/shim/backends")
+async def handle_backends():
+    """
+    Shows the backend pool: each backend's load, health and loaded models,
+    plus the model -> backends index used for model-aware routing and the
+    upstream connection pool's utilization.
+    """
+    logger.debug("Received /shim/backends request.")
+    return JSONResponse(content={
+        "strategy": backend_pool.strategy,
+        "fallback": backend_pool.fallback,
+        "backends": backend_pool.stats(),
+        "models": backend_pool.index_snapshot(),
+        "connection_pool": upstream_pool_stats(),
+    })
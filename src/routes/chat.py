@@ -6,14 +6,26 @@
 # --- WARNING ---
 
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import httpx
-import json
 
 from ..utils import (
-    logger, client, translate_ollama_options_to_openai, 
-    stream_translator, get_iso_timestamp, get_chat_completions_url
+    logger, translate_ollama_options_to_openai, get_iso_timestamp,
+    response_cache, replay_cached_response,
+    request_coalescer, open_translated_stream, post_chat_completion,
+    queue_wait_headers, ollama_timings
 )
+from ..metrics import new_request_stats, record_request, record_completion, record_error
+from ..config import settings
+from ..logs import Redacted
+from ..backends import NoBackendAvailable, BackendUnavailable
+from ..admission import AdmissionRejected, request_priority
+from ..flush import flush_policy_for
+from ..retry import hedging_requested
+from ..deadline import DeadlineExceeded, request_deadline, within_deadline
+from ..ingest import read_request_json
+from ..images import image_preprocessor, image_data_url
+from ..disconnect import ClientDisconnected, DisconnectAwareStreamingResponse, run_unless_disconnected
 
 router = APIRouter()
 
@@ -48,7 +60,7 @@ def translate_ollama_messages_to_openai(messages: list) -> list:
         for img_b64 in msg["images"]:
             content_list.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{img_b64}"}
+                "image_url": {"url": image_data_url(img_b64)}
             })
             
         # 3. Create the new message object
@@ -62,52 +74,94 @@ def translate_ollama_messages_to_openai(messages: list) -> list:
 
 @router.post("/api/chat")
 async def handle_ollama_chat(request: Request):
+    # Per-request facts for metrics and admission reporting.
+    request_stats = new_request_stats("/api/chat", "")
+    # Counted from arrival; the upstream work up to the response runs inside it.
+    deadline = request_deadline(request.headers, settings.REQUEST_DEADLINE)
+    # Spilled image data of a large request; the upstream body has been sent
+    # by the time the route returns, so it is closed on the way out.
+    spool = None
     try:
-        ollama_data = await request.json()
+        ollama_data, spool = await read_request_json(request)
         
         logger.info("Received /api/chat request.")
-        logger.debug(f"Full /api/chat payload: {json.dumps(ollama_data)}")
+        logger.debug("Full /api/chat payload: %s", Redacted(ollama_data, settings.LOG_MAX_STRING_CHARS))
 
         openai_payload = translate_ollama_options_to_openai(ollama_data)
+        request_stats["model"] = openai_payload["model"]
         
         # --- THIS IS THE FIX ---
         # Translate the messages array to handle images
-        ollama_messages = ollama_data.get("messages", [])
+        ollama_messages = await image_preprocessor.prepare_messages(ollama_data.get("messages", []), spool)
         openai_payload["messages"] = translate_ollama_messages_to_openai(ollama_messages)
         # ---
 
         is_streaming_request = ollama_data.get("stream", False)
         openai_payload["stream"] = is_streaming_request
-        
-        chat_url = get_chat_completions_url()
+
+        # Deterministic requests may be answered from the response cache.
+        cache_key = response_cache.key_for(openai_payload)
+        cached_response = response_cache.get(cache_key) if cache_key else None
+        # Identical requests already in flight are joined rather than re-sent,
+        # except those src/coalesce.py explains (spooled, or streams with
+        # their own deadline). Streams are shared as written, so only those
+        # with the same write grouping can join each other.
+        flush_policy = flush_policy_for(request.headers, ollama_data, "chat") if is_streaming_request else None
+        flight_key = None
+        if spool is None and not (is_streaming_request and "x-request-timeout" in request.headers):
+            flight_key = request_coalescer.key_for(openai_payload, "chat", flush_policy)
+        priority = request_priority(request.headers, ollama_data, settings.ADMISSION_LARGE_REQUEST_TOKENS)
 
         # --- BRANCH 1: Streaming ---
         if is_streaming_request:
-            logger.debug(f"Forwarding as STREAMING request to {chat_url}...")
-            
-            lm_studio_stream_context = client.stream("POST", chat_url, json=openai_payload)
-            lm_studio_stream_response = await lm_studio_stream_context.__aenter__()
-            
-            lm_studio_stream_response.raise_for_status()
-            
-            return StreamingResponse(
-                stream_translator(
-                    lm_studio_stream_response, 
-                    response_format="chat",
-                    model_name=openai_payload["model"],
-                    context_to_close=lm_studio_stream_context
+            if cached_response:
+                logger.info("Serving /api/chat stream from the response cache.")
+                request_stats["backend"] = "cache"
+                record_request(request_stats)
+                return StreamingResponse(
+                    replay_cached_response(cached_response, response_format="chat", model_name=openai_payload["model"]),
+                    media_type="application/x-ndjson"
+                )
+
+            # A client that leaves while queued or connecting is not waited for.
+            translated_stream = await run_unless_disconnected(request, within_deadline(deadline, request_coalescer.stream(
+                flight_key,
+                lambda: open_translated_stream(
+                    openai_payload, "chat", cache_key=cache_key,
+                    priority=priority, request_stats=request_stats, spool=spool,
+                    flush_policy=flush_policy,
+                    deadline=deadline
                 ),
-                media_type="application/x-ndjson"
+                request_stats=request_stats
+            )), request_stats)
+
+            record_request(request_stats)
+            return DisconnectAwareStreamingResponse(
+                translated_stream,
+                request_stats=request_stats,
+                media_type="application/x-ndjson",
+                headers=queue_wait_headers(request_stats)
             )
 
         # --- BRANCH 2: Non-Streaming ---
         else:
-            logger.debug(f"Forwarding as NON-STREAMING request to {chat_url}...")
-            response = await client.post(chat_url, json=openai_payload)
-            response.raise_for_status()
-            openai_json = response.json()
-            
-            logger.debug(f"Received non-streaming response from LM Studio: {openai_json}")
+            if cached_response:
+                logger.info("Serving /api/chat from the response cache.")
+                request_stats["backend"] = "cache"
+                openai_json = cached_response
+            else:
+                # The upstream call is cancelled if the client disconnects.
+                openai_json = await run_unless_disconnected(request, within_deadline(deadline, request_coalescer.call(
+                    flight_key,
+                    lambda: post_chat_completion(
+                        openai_payload, cache_key=cache_key,
+                        priority=priority, request_stats=request_stats, spool=spool,
+                        hedge=hedging_requested(request.headers, settings.HEDGING_ENABLED)
+                    ),
+                    request_stats=request_stats
+                )), request_stats)
+
+                logger.debug("Received non-streaming response from LM Studio: %s", Redacted(openai_json, settings.LOG_MAX_STRING_CHARS))
 
             ollama_response = {
                 "model": openai_json["model"],
@@ -115,20 +169,50 @@ async def handle_ollama_chat(request: Request):
                 "message": openai_json["choices"][0]["message"],
                 "done": True
             }
-            if "usage" in openai_json and openai_json["usage"]:
-                 ollama_response.update({
-                    "total_duration": openai_json["usage"].get("total_duration_sec", 0) * 1_000_000_000,
-                    "prompt_eval_count": openai_json["usage"]["prompt_tokens"],
-                    "eval_count": openai_json["usage"]["completion_tokens"],
-                 })
+            ollama_response.update(ollama_timings(request_stats, openai_json.get("usage")))
             
+            record_request(request_stats)
+            record_completion(request_stats, (openai_json.get("usage") or {}).get("completion_tokens"))
             logger.info("Returning non-streaming response to client.")
-            logger.debug(f"Full non-streaming response: {ollama_response}")
-            return JSONResponse(content=ollama_response)
+            logger.debug("Full non-streaming response: %s", Redacted(ollama_response, settings.LOG_MAX_STRING_CHARS))
+            return JSONResponse(content=ollama_response, headers=queue_wait_headers(request_stats))
 
+    except ClientDisconnected:
+        record_error(request_stats, "client_disconnect")
+        # Nobody is listening; 499 is the conventional "client closed request".
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        record_error(request_stats, e.reason)
+        logger.warning(f"Gave up on /api/chat request: {e}")
+        return JSONResponse(status_code=504, content={"error": str(e)})
+    except BackendUnavailable as e:
+        record_error(request_stats, "circuit_open")
+        logger.warning(f"Refused /api/chat request: {e}")
+        return JSONResponse(
+            status_code=503,
+            content={"error": str(e)},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except AdmissionRejected as e:
+        record_error(request_stats, "rejected")
+        logger.warning(f"Rejected /api/chat request ({e.status_code}): {e}")
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"error": str(e)},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except NoBackendAvailable as e:
+        record_error(request_stats, "no_backend")
+        logger.warning(f"No backend for /api/chat request: {e}")
+        return JSONResponse(status_code=404, content={"error": str(e)})
     except httpx.HTTPStatusError as e:
+        record_error(request_stats, f"http_{e.response.status_code}")
         logger.error(f"HTTP error occurred in /api/chat: {e.response.text}", exc_info=True)
         return JSONResponse(status_code=e.response.status_code, content={"error": e.response.text})
     except Exception as e:
+        record_error(request_stats, "internal")
         logger.error(f"An error occurred in /api/chat: {e}", exc_info=True)
         return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        if spool is not None:
+            spool.close()
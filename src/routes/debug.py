@@ -0,0 +1,53 @@
+# src/routes/debug.py
+
+# Opt-in introspection endpoints (DEBUG_ENDPOINTS_ENABLED); see profiling.py.
+# While disabled they answer 404 like any unknown path.
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from ..config import settings, logger
+from ..profiling import ProfilerBusy, profiler, collapsed_stacks, memory_report
+
+router = APIRouter()
+
+def _disabled() -> JSONResponse | None:
+    if settings.DEBUG_ENDPOINTS_ENABLED:
+        return None
+    return JSONResponse(status_code=404, content={"error": "Not Found"})
+
+def _clamp_seconds(seconds: float) -> float:
+    return min(max(seconds, 0.0), settings.DEBUG_MAX_SECONDS)
+
+@router.get("/debug/profile")
+async def handle_profile(seconds: float = 10.0):
+    """
+    Samples the event loop for 'seconds' and returns the collapsed stacks
+    ('frame;frame count' lines), ready for flamegraph.pl or speedscope.
+    """
+    if (response := _disabled()) is not None:
+        return response
+    seconds = _clamp_seconds(seconds)
+    logger.info(f"Profiling the event loop for {seconds:g} s.")
+    try:
+        stacks = await profiler.profile(seconds)
+    except ProfilerBusy as e:
+        return JSONResponse(status_code=409, content={"error": str(e)})
+    return PlainTextResponse(collapsed_stacks(stacks), headers={"X-Profile-Samples": str(sum(stacks.values()))})
+
+@router.get("/debug/memory")
+async def handle_memory(seconds: float = 10.0, limit: int = 25, types: int = 0):
+    """
+    Top allocation sites (traced for 'seconds' unless tracemalloc is already
+    on), live requests per route and, with 'types=N', the N most common
+    object types.
+    """
+    if (response := _disabled()) is not None:
+        return response
+    seconds = _clamp_seconds(seconds)
+    logger.info(f"Tracing allocations for {seconds:g} s.")
+    try:
+        report = await memory_report(seconds, limit=min(max(limit, 1), 500), types=min(max(types, 0), 500))
+    except ProfilerBusy as e:
+        return JSONResponse(status_code=409, content={"error": str(e)})
+    return JSONResponse(content=report)
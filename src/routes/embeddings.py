@@ -0,0 +1,108 @@
+# src/routes/embeddings.py
+
+# Ollama embedding endpoints, translated to the OpenAI /v1/embeddings API.
+# /api/embed takes one or more inputs, /api/embeddings (the older endpoint)
+# a single prompt. Both go through the shared micro-batcher and vector cache
+# (see embeddings.py).
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response
+import httpx
+import time
+
+from ..utils import logger, embedding_batcher
+from ..metrics import new_request_stats, record_request, record_completion, record_error
+from ..backends import NoBackendAvailable, BackendUnavailable
+from ..admission import AdmissionRejected
+from ..disconnect import ClientDisconnected, run_unless_disconnected
+
+router = APIRouter()
+
+async def _embed(request: Request, route: str, inputs_key: str):
+    """
+    Shared body of both endpoints. Returns (model, vectors, duration) or a
+    ready error response.
+    """
+    request_stats = new_request_stats(route, "")
+    try:
+        ollama_data = await request.json()
+        logger.info(f"Received {route} request.")
+
+        model = ollama_data.get("model", "default-model")
+        request_stats["model"] = model
+        inputs = ollama_data.get(inputs_key)
+        if inputs is None or inputs == "":
+            inputs = []
+        elif isinstance(inputs, str):
+            inputs = [inputs]
+        if not isinstance(inputs, list) or not all(isinstance(text, str) for text in inputs):
+            return JSONResponse(status_code=400, content={"error": f"'{inputs_key}' must be a string or a list of strings"})
+
+        started = time.perf_counter()
+        vectors = []
+        if inputs:
+            # Vectors for unchanged texts come from the cache; the rest are
+            # batched with whatever other requests arrive meanwhile.
+            vectors = await run_unless_disconnected(
+                request, embedding_batcher.embed(model, inputs, ollama_data.get("dimensions")), request_stats
+            )
+        record_request(request_stats)
+        record_completion(request_stats)
+        return model, vectors, time.perf_counter() - started
+
+    except ClientDisconnected:
+        record_error(request_stats, "client_disconnect")
+        return Response(status_code=499)
+    except BackendUnavailable as e:
+        record_error(request_stats, "circuit_open")
+        logger.warning(f"Refused {route} request: {e}")
+        return JSONResponse(
+            status_code=503,
+            content={"error": str(e)},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except AdmissionRejected as e:
+        record_error(request_stats, "rejected")
+        logger.warning(f"Rejected {route} request ({e.status_code}): {e}")
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"error": str(e)},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except NoBackendAvailable as e:
+        record_error(request_stats, "no_backend")
+        logger.warning(f"No backend for {route} request: {e}")
+        return JSONResponse(status_code=404, content={"error": str(e)})
+    except httpx.HTTPStatusError as e:
+        record_error(request_stats, f"http_{e.response.status_code}")
+        logger.error(f"HTTP error occurred in {route}: {e.response.text}", exc_info=True)
+        return JSONResponse(status_code=e.response.status_code, content={"error": str(e.response.text)})
+    except httpx.ConnectError as e:
+        record_error(request_stats, "connect")
+        logger.error(f"Failed to connect to LM Studio at {e.request.url}: {e}", exc_info=True)
+        return JSONResponse(status_code=502, content={"detail": {"error": {"message": "Backend service unavailable", "code": 502, "details": str(e)}}})
+    except Exception as e:
+        record_error(request_stats, "internal")
+        logger.error(f"An error occurred in {route}: {e}", exc_info=True)
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@router.post("/api/embed")
+async def handle_ollama_embed(request: Request):
+    result = await _embed(request, "/api/embed", "input")
+    if isinstance(result, Response):
+        return result
+    model, vectors, duration = result
+    return JSONResponse(content={
+        "model": model,
+        "embeddings": [vector.tolist() for vector in vectors],
+        "total_duration": int(duration * 1_000_000_000),
+        "load_duration": 0,
+    })
+
+@router.post("/api/embeddings")
+async def handle_ollama_embeddings(request: Request):
+    result = await _embed(request, "/api/embeddings", "prompt")
+    if isinstance(result, Response):
+        return result
+    _, vectors, _ = result
+    return JSONResponse(content={"embedding": vectors[0].tolist() if vectors else []})
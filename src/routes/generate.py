@@ -6,74 +6,149 @@
 # --- WARNING ---
 
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import httpx
-import json
 
 # Use relative imports to get the *shared* helper functions
 from ..utils import (
-    logger, client, translate_ollama_options_to_openai, 
-    stream_translator, get_iso_timestamp, get_chat_completions_url
+    logger, translate_ollama_options_to_openai, get_iso_timestamp,
+    response_cache, replay_cached_response,
+    request_coalescer, open_translated_stream, post_chat_completion,
+    queue_wait_headers, continuation_store, ollama_timings
 )
+from ..metrics import new_request_stats, record_request, record_completion, record_error
+from ..config import settings
+from ..logs import Redacted
+from ..backends import NoBackendAvailable, BackendUnavailable
+from ..admission import AdmissionRejected, request_priority
+from ..flush import flush_policy_for
+from ..retry import hedging_requested
+from ..deadline import DeadlineExceeded, request_deadline, within_deadline
+from ..ingest import read_request_json
+from ..images import image_preprocessor, image_data_url
+from ..continuation import history_message
+from ..disconnect import ClientDisconnected, DisconnectAwareStreamingResponse, run_unless_disconnected
 
 router = APIRouter()
 
 @router.post("/api/generate")
 async def handle_ollama_generate(request: Request):
+    # Per-request facts for metrics and admission reporting.
+    request_stats = new_request_stats("/api/generate", "")
+    # Counted from arrival; the upstream work up to the response runs inside it.
+    deadline = request_deadline(request.headers, settings.REQUEST_DEADLINE)
+    # Spilled image data of a large request; the upstream body has been sent
+    # by the time the route returns, so it is closed on the way out.
+    spool = None
     try:
-        ollama_data = await request.json()
+        ollama_data, spool = await read_request_json(request)
 
         logger.info("Received /api/generate request.")
-        logger.debug(f"Full /api/generate payload: {json.dumps(ollama_data)}")
+        logger.debug("Full /api/generate payload: %s", Redacted(ollama_data, settings.LOG_MAX_STRING_CHARS))
 
         openai_payload = translate_ollama_options_to_openai(ollama_data)
+        request_stats["model"] = openai_payload["model"]
         
         user_content = []
         if ollama_data.get("prompt"):
             user_content.append({"type": "text", "text": ollama_data["prompt"]})
         if ollama_data.get("images"):
             logger.debug(f"Translating {len(ollama_data['images'])} image(s) for LM Studio.")
-            for img_b64 in ollama_data["images"]:
+            images = await image_preprocessor.prepare_images(ollama_data["images"], spool)
+            for img_b64 in images:
                 user_content.append({
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{img_b64}"}
+                    "image_url": {"url": image_data_url(img_b64)}
                 })
         
-        messages = [{"role": "user", "content": user_content}]
+        # A 'context' returned by an earlier call continues that conversation.
+        # The stored messages go out unchanged, so the backend sees the same
+        # prefix as last time and can reuse its prompt cache.
+        messages = list(continuation_store.messages_for(ollama_data.get("context")))
+        if ollama_data.get("context") and not messages:
+            logger.debug("Request 'context' is unknown or expired; starting a new conversation.")
         if ollama_data.get("system"):
-            messages.insert(0, {"role": "system", "content": ollama_data["system"]})
+            system_message = {"role": "system", "content": ollama_data["system"]}
+            if messages and messages[0]["role"] == "system":
+                if messages[0]["content"] != ollama_data["system"]:
+                    messages[0] = system_message
+            else:
+                messages.insert(0, system_message)
+        user_message = {"role": "user", "content": user_content}
+        messages.append(user_message)
         openai_payload["messages"] = messages
+
+        # What the returned 'context' will continue from.
+        # Built now, while the spool holds any spilled prompt or system text.
+        history = [history_message(message, spool) for message in messages]
+        def context_for(response_text: str) -> list:
+            return continuation_store.save(history, response_text)
         
         is_streaming_request = ollama_data.get("stream", False)
         openai_payload["stream"] = is_streaming_request
 
-        chat_url = get_chat_completions_url()
+        # Deterministic requests may be answered from the response cache.
+        cache_key = response_cache.key_for(openai_payload)
+        cached_response = response_cache.get(cache_key) if cache_key else None
+        # Identical requests already in flight are joined rather than re-sent,
+        # except those src/coalesce.py explains (spooled, or streams with
+        # their own deadline). Streams are shared as written, so only those
+        # with the same write grouping can join each other.
+        flush_policy = flush_policy_for(request.headers, ollama_data, "generate") if is_streaming_request else None
+        flight_key = None
+        if spool is None and not (is_streaming_request and "x-request-timeout" in request.headers):
+            flight_key = request_coalescer.key_for(openai_payload, "generate", flush_policy)
+        priority = request_priority(request.headers, ollama_data, settings.ADMISSION_LARGE_REQUEST_TOKENS)
 
         if is_streaming_request:
-            logger.debug(f"Forwarding as STREAMING request to {chat_url}...")
-            
-            lm_studio_stream_context = client.stream("POST", chat_url, json=openai_payload)
-            lm_studio_stream_response = await lm_studio_stream_context.__aenter__()
-            
-            lm_studio_stream_response.raise_for_status()
-            
-            return StreamingResponse(
-                stream_translator(
-                    lm_studio_stream_response, 
-                    response_format="generate",
-                    model_name=openai_payload["model"],
-                    context_to_close=lm_studio_stream_context
+            if cached_response:
+                logger.info("Serving /api/generate stream from the response cache.")
+                request_stats["backend"] = "cache"
+                record_request(request_stats)
+                return StreamingResponse(
+                    replay_cached_response(cached_response, response_format="generate", model_name=openai_payload["model"],
+                                           context_fn=context_for),
+                    media_type="application/x-ndjson"
+                )
+
+            # A client that leaves while queued or connecting is not waited for.
+            translated_stream = await run_unless_disconnected(request, within_deadline(deadline, request_coalescer.stream(
+                flight_key,
+                lambda: open_translated_stream(
+                    openai_payload, "generate", cache_key=cache_key,
+                    priority=priority, request_stats=request_stats, spool=spool,
+                    flush_policy=flush_policy,
+                    context_fn=context_for, deadline=deadline
                 ),
-                media_type="application/x-ndjson"
+                request_stats=request_stats
+            )), request_stats)
+
+            record_request(request_stats)
+            return DisconnectAwareStreamingResponse(
+                translated_stream,
+                request_stats=request_stats,
+                media_type="application/x-ndjson",
+                headers=queue_wait_headers(request_stats)
             )
 
         else:
-            logger.debug(f"Forwarding as NON-STREAMING request to {chat_url}...")
-            response = await client.post(chat_url, json=openai_payload)
-            response.raise_for_status()
-            openai_json = response.json()
-            
-            logger.debug(f"Received non-streaming response from LM Studio: {openai_json}")
+            if cached_response:
+                logger.info("Serving /api/generate from the response cache.")
+                request_stats["backend"] = "cache"
+                openai_json = cached_response
+            else:
+                # The upstream call is cancelled if the client disconnects.
+                openai_json = await run_unless_disconnected(request, within_deadline(deadline, request_coalescer.call(
+                    flight_key,
+                    lambda: post_chat_completion(
+                        openai_payload, cache_key=cache_key,
+                        priority=priority, request_stats=request_stats, spool=spool,
+                        hedge=hedging_requested(request.headers, settings.HEDGING_ENABLED)
+                    ),
+                    request_stats=request_stats
+                )), request_stats)
+
+                logger.debug("Received non-streaming response from LM Studio: %s", Redacted(openai_json, settings.LOG_MAX_STRING_CHARS))
 
             final_content = openai_json["choices"][0]["message"]["content"]
             
@@ -82,28 +157,59 @@ async def handle_ollama_generate(request: Request):
                 "created_at": get_iso_timestamp(),
                 "response": final_content,
                 "done": True,
-                "context": [],
+                "context": context_for(final_content),
             }
-            if "usage" in openai_json and openai_json["usage"]:
-                 ollama_response.update({
-                    "total_duration": openai_json["usage"].get("total_duration_sec", 0) * 1_000_000_000,
-                    "prompt_eval_count": openai_json["usage"]["prompt_tokens"],
-                    "eval_count": openai_json["usage"]["completion_tokens"],
-                 })
+            ollama_response.update(ollama_timings(request_stats, openai_json.get("usage")))
 
+            record_request(request_stats)
+            record_completion(request_stats, (openai_json.get("usage") or {}).get("completion_tokens"))
             logger.info("Returning non-streaming response to client.")
-            logger.debug(f"Full non-streaming response: {ollama_response}")
-            return JSONResponse(content=ollama_response)
+            logger.debug("Full non-streaming response: %s", Redacted(ollama_response, settings.LOG_MAX_STRING_CHARS))
+            return JSONResponse(content=ollama_response, headers=queue_wait_headers(request_stats))
 
+    except ClientDisconnected:
+        record_error(request_stats, "client_disconnect")
+        # Nobody is listening; 499 is the conventional "client closed request".
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        record_error(request_stats, e.reason)
+        logger.warning(f"Gave up on /api/generate request: {e}")
+        return JSONResponse(status_code=504, content={"error": str(e)})
+    except BackendUnavailable as e:
+        record_error(request_stats, "circuit_open")
+        logger.warning(f"Refused /api/generate request: {e}")
+        return JSONResponse(
+            status_code=503,
+            content={"error": str(e)},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except AdmissionRejected as e:
+        record_error(request_stats, "rejected")
+        logger.warning(f"Rejected /api/generate request ({e.status_code}): {e}")
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"error": str(e)},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except NoBackendAvailable as e:
+        record_error(request_stats, "no_backend")
+        logger.warning(f"No backend for /api/generate request: {e}")
+        return JSONResponse(status_code=404, content={"error": str(e)})
     except httpx.HTTPStatusError as e:
+        record_error(request_stats, f"http_{e.response.status_code}")
         logger.error(f"HTTP error occurred in /api/generate: {e.response.text}", exc_info=True)
         return JSONResponse(status_code=e.response.status_code, content={"error": str(e.response.text)})
     
     except httpx.ConnectError as e:
-        error_message = f"Failed to connect to LM Studio at {chat_url}: {e}"
+        record_error(request_stats, "connect")
+        error_message = f"Failed to connect to LM Studio at {e.request.url}: {e}"
         logger.error(error_message, exc_info=True)
         return JSONResponse(status_code=502, content={"detail": {"error": {"message": "Backend service unavailable", "code": 502, "details": str(e)}}})
     
     except Exception as e:
+        record_error(request_stats, "internal")
         logger.error(f"An error occurred in /api/generate: {e}", exc_info=True)
-        return JSONResponse(status_code=500, content={"error": str(e)})
\ No newline at end of file
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        if spool is not None:
+            spool.close()
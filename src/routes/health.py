@@ -1,6 +1,8 @@
 # ollama_shim/routes/health.py
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from ..utils import logger
+from ..backends import backend_pool
 
 router = APIRouter()
 
@@ -13,3 +15,16 @@ async def handle_root_health_check():
     """
     logger.info("Received root health check. Responding OK.")
     return "Ollama is running"
+
+@router.get("/ready")
+async def handle_readiness_check():
+    """
+    Readiness check: 200 while at least one backend's circuit is not open
+    (see backends.py), 503 when every backend is currently refused. Unlike
+    '/', which only says the shim process is up, this is meant for load
+    balancers and orchestrators deciding whether to send traffic here.
+    """
+    backends = {b.base_url: b.circuit_state() for b in backend_pool.backends}
+    if backend_pool.is_ready():
+        return {"status": "ready", "backends": backends}
+    return JSONResponse(status_code=503, content={"status": "unavailable", "backends": backends})
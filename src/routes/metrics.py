@@ -0,0 +1,88 @@
+# src/routes/metrics.py
+import os
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..utils import response_cache, request_coalescer, continuation_store, embedding_batcher, upstream_pool_stats
+from ..backends import backend_pool, CIRCUIT_STATES
+from ..images import image_preprocessor
+from ..config import log_pipeline
+from ..metrics import registry, render_samples
+
+router = APIRouter()
+
+
+def _collect_shim_state() -> list:
+    """
+    Exposes counters kept by the caches, the coalescer, the embedding batcher,
+    the log pipeline, the image stage, the backend pool and the upstream client.
+    """
+    cache = response_cache.stats()
+    lines = []
+    for key, kind in [("hits", "counter"), ("misses", "counter"), ("evictions", "counter"),
+                      ("expirations", "counter"), ("entries", "gauge"), ("bytes", "gauge")]:
+        suffix = "_total" if kind == "counter" else ""
+        lines += render_samples(f"ollama_shim_response_cache_{key}{suffix}", kind,
+                                f"Response cache {key}.", [({}, cache[key])])
+    continuations = continuation_store.stats()
+    for key, kind in [("hits", "counter"), ("misses", "counter"), ("evictions", "counter"),
+                      ("entries", "gauge"), ("bytes", "gauge")]:
+        suffix = "_total" if kind == "counter" else ""
+        lines += render_samples(f"ollama_shim_generate_context_{key}{suffix}", kind,
+                                f"Generate context store {key}.", [({}, continuations[key])])
+    lines += render_samples("ollama_shim_coalesced_requests_total", "counter",
+                            "Requests that joined an identical in-flight request.",
+                            [({}, request_coalescer.coalesced)])
+    embeddings = embedding_batcher.stats()
+    lines += render_samples("ollama_shim_embedding_batches_total", "counter",
+                            "Upstream embedding calls made by the batcher.", [({}, embeddings["batches"])])
+    lines += render_samples("ollama_shim_embedding_inputs_total", "counter",
+                            "Embedding inputs sent upstream.", [({}, embeddings["inputs"])])
+    for key, kind in [("hits", "counter"), ("misses", "counter"), ("evictions", "counter"),
+                      ("entries", "gauge"), ("bytes", "gauge")]:
+        suffix = "_total" if kind == "counter" else ""
+        lines += render_samples(f"ollama_shim_embedding_cache_{key}{suffix}", kind,
+                                f"Embedding vector cache {key}.", [({}, embeddings["cache"][key])])
+    lines += render_samples("ollama_shim_log_records_dropped_total", "counter",
+                            "Log records dropped because the log writer fell behind.", [({}, log_pipeline.dropped)])
+    images = image_preprocessor.stats()
+    for key in ("resized", "failures", "bytes_saved"):
+        lines += render_samples(f"ollama_shim_image_{key}_total", "counter",
+                                f"Image preprocessing {key.replace('_', ' ')}.", [({}, images[key])])
+
+    backends = backend_pool.backends
+    lines += render_samples("ollama_shim_backend_in_flight", "gauge", "Requests outstanding per backend.",
+                            [({"backend": b.base_url}, b.in_flight) for b in backends])
+    lines += render_samples("ollama_shim_backend_healthy", "gauge", "1 if the backend is in rotation.",
+                            [({"backend": b.base_url}, int(b.is_healthy())) for b in backends])
+    lines += render_samples("ollama_shim_backend_circuit_state", "gauge",
+                            "Circuit breaker state per backend: 0 closed, 1 half-open, 2 open.",
+                            [({"backend": b.base_url}, CIRCUIT_STATES.index(b.circuit_state())) for b in backends])
+    lines += render_samples("ollama_shim_backend_queue_waiting", "gauge", "Requests waiting for admission per backend.",
+                            [({"backend": b.base_url}, b.admission.waiting) for b in backends])
+    lines += render_samples("ollama_shim_backend_rejected_total", "counter",
+                            "Requests rejected by admission control per backend.",
+                            [({"backend": b.base_url}, b.admission.rejected + b.admission.timed_out) for b in backends])
+
+    # With several workers each scrape reaches one of them (see server.py).
+    lines += render_samples("ollama_shim_worker_info", "gauge", "The worker process that answered this scrape.",
+                            [({"pid": str(os.getpid())}, 1)])
+
+    pool = upstream_pool_stats()
+    for state in ("active", "idle"):
+        lines += render_samples(f"ollama_shim_upstream_connections_{state}", "gauge",
+                                f"{state.capitalize()} upstream connections per origin.",
+                                [({"origin": origin}, entry[state]) for origin, entry in pool["origins"].items()])
+    lines += render_samples("ollama_shim_upstream_pool_waiting", "gauge",
+                            "Requests waiting for a free upstream connection.", [({}, pool["waiting"])])
+    return lines
+
+
+registry.add_collector(_collect_shim_state)
+
+
+@router.get("/metrics")
+async def handle_metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -5,17 +5,17 @@
 # with the LLM to be printed to the console. This may include sensitive data.
 # --- WARNING ---
 
-import time
 import asyncio
 import json
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse, StreamingResponse
 import httpx
-from datetime import datetime, timezone
 
 # --- THIS IS THE FIX ---
 # Use relative imports to go up to the 'src' directory
-from ..utils import logger, client, get_models_url
+from ..utils import logger, get_models_url
+from ..catalog import model_catalog
+from ..logs import Redacted
 
 router = APIRouter()
 
@@ -39,43 +39,15 @@ async def handle_pull(request: Request):
 
 @router.get("/api/tags")
 async def handle_tags():
-    logger.info("Received /api/tags request. Forwarding to LM Studio...")
+    logger.info("Received /api/tags request. Serving from the model catalog...")
     models_url = get_models_url()
-    logger.debug(f"Calling LM Studio for models at: {models_url}")
     
     try:
-        lm_studio_response = await client.get(models_url)
-        lm_studio_response.raise_for_status() 
-        lm_studio_models_data = lm_studio_response.json()
-
-        ollama_models = []
-        for model in lm_studio_models_data.get("data", []):
-            model_id = model.get("id")
-            if model_id:
-                modified_time = datetime.fromtimestamp(
-                    model.get("created", time.time()), tz=timezone.utc
-                ).isoformat().replace('+00:00', 'Z')
-                
-                family = model_id.split('-')[0] if '-' in model_id else "unknown"
-
-                ollama_models.append({
-                    "name": model_id,
-                    "model": model_id,
-                    "modified_at": modified_time,
-                    "size": model.get("size", 0),
-                    "digest": model.get("id"),
-                    "details": {
-                        "format": "gguf",
-                        "family": family,
-                        "families": [family] if family != "unknown" else None,
-                        "parameter_size": "N/A",
-                        "quantization_level": "N/A"
-                    }
-                })
+        ollama_models = await model_catalog.get()
 
         response_data = {"models": ollama_models}
         logger.info(f"Responding to /api/tags with {len(ollama_models)} model(s).")
-        logger.debug(f"Full /api/tags response: {response_data}")
+        logger.debug("Full /api/tags response: %s", Redacted(response_data))
         return JSONResponse(content=response_data)
 
     except httpx.HTTPStatusError as e:
@@ -0,0 +1,86 @@
+# src/routes/openai.py
+
+# OpenAI-compatible /v1/chat/completions for clients that already speak
+# OpenAI. Nothing needs translating, so the shim acts as a thin proxy: the
+# request body is forwarded as received and the backend's answer (SSE or
+# JSON) is relayed byte for byte, without parsing or re-serializing either.
+# Requests still go through the backend pool, admission control, retries,
+# the shared upstream client (with its timeouts) and the metrics.
+
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response
+import httpx
+
+from ..utils import logger, open_passthrough, sniff_model, queue_wait_headers, PASSTHROUGH_HEADERS
+from ..metrics import new_request_stats, record_request, record_error
+from ..config import settings
+from ..backends import NoBackendAvailable, BackendUnavailable
+from ..admission import AdmissionRejected, request_priority
+from ..disconnect import ClientDisconnected, DisconnectAwareStreamingResponse, run_unless_disconnected
+
+router = APIRouter()
+
+def _openai_error(status_code: int, message: str, code: str, headers: dict | None = None) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": "shim_error", "code": code}},
+        headers=headers
+    )
+
+@router.post("/v1/chat/completions")
+async def handle_openai_chat_completions(request: Request):
+    body = await request.body()
+    request_stats = new_request_stats("/v1/chat/completions", sniff_model(body) or "")
+    try:
+        logger.info("Received /v1/chat/completions request.")
+        # Only the header can raise or lower the priority; the body is not read.
+        priority = request_priority(request.headers, {}, settings.ADMISSION_LARGE_REQUEST_TOKENS)
+
+        relay = await run_unless_disconnected(request, open_passthrough(
+            body, request.headers, request_stats["model"] or None,
+            priority=priority, request_stats=request_stats
+        ), request_stats)
+
+        record_request(request_stats)
+        upstream_headers = relay.response.headers
+        headers = {name: upstream_headers[name] for name in PASSTHROUGH_HEADERS if name in upstream_headers}
+        headers.update(queue_wait_headers(request_stats))
+        return DisconnectAwareStreamingResponse(
+            relay,
+            request_stats=request_stats,
+            status_code=relay.response.status_code,
+            headers=headers
+        )
+
+    except ClientDisconnected:
+        record_error(request_stats, "client_disconnect")
+        return Response(status_code=499)
+    except BackendUnavailable as e:
+        record_error(request_stats, "circuit_open")
+        logger.warning(f"Refused /v1/chat/completions request: {e}")
+        return _openai_error(503, str(e), "backend_unavailable", {"Retry-After": str(e.retry_after)})
+    except AdmissionRejected as e:
+        record_error(request_stats, "rejected")
+        logger.warning(f"Rejected /v1/chat/completions request ({e.status_code}): {e}")
+        return _openai_error(e.status_code, str(e), "rejected", {"Retry-After": str(e.retry_after)})
+    except NoBackendAvailable as e:
+        record_error(request_stats, "no_backend")
+        logger.warning(f"No backend for /v1/chat/completions request: {e}")
+        return _openai_error(404, str(e), "model_not_found")
+    except httpx.HTTPStatusError as e:
+        # A 5xx that outlasted the retries; its body is passed on as it is.
+        record_error(request_stats, f"http_{e.response.status_code}")
+        logger.error(f"Upstream error in /v1/chat/completions: {e.response.status_code}")
+        return Response(
+            content=e.response.content,
+            status_code=e.response.status_code,
+            media_type=e.response.headers.get("content-type")
+        )
+    except httpx.ConnectError as e:
+        record_error(request_stats, "connect")
+        logger.error(f"Failed to connect to LM Studio at {e.request.url}: {e}", exc_info=True)
+        return _openai_error(502, f"Backend service unavailable: {e}", "backend_unreachable")
+    except Exception as e:
+        record_error(request_stats, "internal")
+        logger.error(f"An error occurred in /v1/chat/completions: {e}", exc_info=True)
+        return _openai_error(500, str(e), "internal_error")
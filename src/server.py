@@ -0,0 +1,94 @@
+# src/server.py
+
+# How the shim's uvicorn server is started.
+#
+# Development mode is a single process with auto-reload. Production mode
+# drops the file watcher, can run several worker processes (the shim does
+# CPU work per token: SSE parsing, JSON encoding, image handling), uses
+# uvloop and httptools when they are installed, and sets keep-alive and
+# backlog explicitly. On SIGTERM uvicorn stops accepting connections, lets
+# in-flight requests (including streams) finish for up to
+# SHIM_DRAIN_TIMEOUT seconds and then cancels what is left, which closes
+# the corresponding upstream requests.
+#
+# Cross-worker state: every worker is a separate process with its own copy
+# of everything kept in memory, and nothing is shared between them.
+#   - Response cache, embedding vector cache, model catalog, image digest
+#     cache: per worker. Always correct, but hit rates drop as workers are
+#     added, since a repeated request may land on a different worker.
+#   - Request coalescing and embedding micro-batching only combine requests
+#     that reach the same worker.
+#   - /api/generate 'context' handles are per worker; a follow-up that lands
+#     on another worker starts a new conversation. Keep SHIM_WORKERS=1 for
+#     clients that rely on chained generate calls.
+#   - Admission limits (BACKEND_MAX_CONCURRENCY, ADMISSION_QUEUE_SIZE) and
+#     backend health apply per worker, so the backend sees up to
+#     SHIM_WORKERS times the configured concurrency; divide accordingly.
+#   - /metrics describes only the worker that answered the scrape (its pid
+#     is in 'ollama_shim_worker_info'), so successive scrapes can hit
+#     different workers. For exact metrics run SHIM_WORKERS=1, or one
+#     single-worker shim per port behind a load balancer, each scraped as
+#     its own target.
+
+import os
+
+import uvicorn
+
+from .config import settings, logger
+
+try:
+    import uvloop  # noqa: F401
+except ImportError:
+    uvloop = None
+
+try:
+    import httptools  # noqa: F401
+except ImportError:
+    httptools = None
+
+MODES = ("development", "production")
+
+
+def worker_count(config=settings) -> int:
+    """SHIM_WORKERS, with 0 meaning one worker per CPU."""
+    return config.SHIM_WORKERS if config.SHIM_WORKERS > 0 else (os.cpu_count() or 1)
+
+
+def server_options(mode: str, config=settings) -> dict:
+    """Keyword arguments for uvicorn.run() in the given mode."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown server mode '{mode}'; expected one of {', '.join(MODES)}.")
+
+    options = {
+        "host": config.SHIM_HOST,
+        "port": config.SHIM_PORT,
+        "log_level": config.LOG_LEVEL.lower(),
+    }
+    if mode == "development":
+        options["reload"] = True
+        return options
+
+    options.update({
+        "workers": worker_count(config),
+        "loop": "uvloop" if uvloop is not None else "asyncio",
+        "http": "httptools" if httptools is not None else "h11",
+        "timeout_keep_alive": config.SHIM_KEEPALIVE_TIMEOUT,
+        "backlog": config.SHIM_BACKLOG,
+        "timeout_graceful_shutdown": config.SHIM_DRAIN_TIMEOUT,
+        "access_log": config.SHIM_ACCESS_LOG,
+    })
+    return options
+
+
+def run(mode: str | None = None):
+    """Runs the shim until it is stopped."""
+    mode = mode or settings.SHIM_MODE
+    options = server_options(mode, settings)
+    if mode == "production":
+        logger.info(
+            f"Starting production server: {options['workers']} worker(s), loop={options['loop']}, "
+            f"http={options['http']}, drain timeout {options['timeout_graceful_shutdown']}s."
+        )
+    else:
+        logger.info("Starting development server with auto-reload...")
+    uvicorn.run("src.main:app", **options)
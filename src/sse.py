@@ -0,0 +1,98 @@
+# src/sse.py
+
+# Incremental Server-Sent Events framing for the upstream (LM Studio) stream.
+#
+# httpx hands us whatever the TCP reads happened to contain, so an SSE event,
+# a single line, or even a multi-byte UTF-8 codepoint can be split across two
+# chunks. The parser keeps a rolling byte buffer and only decodes complete
+# events, so nothing gets dropped at a chunk boundary.
+
+
+class SSEParser:
+    """
+    Incremental parser for a text/event-stream body.
+
+    Feed it raw bytes as they arrive; it returns the 'data' payload of every
+    event completed by that chunk. Multi-line 'data:' fields are joined with
+    a newline, as the SSE spec requires. Other fields ('event', 'id',
+    'retry') and comment lines are ignored.
+    """
+
+    __slots__ = ("_tail", "_data", "_skip_lf")
+
+    def __init__(self):
+        # Bytes of the current, not yet newline-terminated line.
+        self._tail = bytearray()
+        self._data = []
+        # Set when a chunk ended on '\r', so a '\n' opening the next chunk
+        # is treated as the second half of a '\r\n' line ending.
+        self._skip_lf = False
+
+    def feed(self, chunk: bytes) -> list:
+        """Consumes a chunk of bytes and returns the completed event payloads."""
+        if self._skip_lf:
+            self._skip_lf = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+        if b"\r" in chunk:
+            self._skip_lf = chunk.endswith(b"\r")
+            chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        if b"\n" not in chunk:
+            # No line completed; the bytearray grows in amortized O(1).
+            self._tail += chunk
+            return []
+
+        if self._tail:
+            self._tail += chunk
+            chunk = bytes(self._tail)
+        lines = chunk.split(b"\n")
+        self._tail = bytearray(lines.pop())
+
+        events = []
+        data = self._data
+        for line in lines:
+            # Fast path: virtually every line LM Studio sends is "data: {...}".
+            if line[:6] == b"data: ":
+                data.append(line[6:])
+            elif line:
+                self._process_field(line)
+            elif data:
+                # A blank line dispatches the event being built.
+                payload = data[0] if len(data) == 1 else b"\n".join(data)
+                events.append(payload.decode("utf-8", errors="replace"))
+                data.clear()
+        return events
+
+    def close(self) -> list:
+        """
+        Flushes any event left pending when the stream ended without the
+        terminating blank line.
+        """
+        self._skip_lf = False
+        events = self.feed(b"\n\n") if self._tail else self.feed(b"\n")
+        self._tail.clear()
+        return events
+
+    def _process_field(self, line: bytes):
+        if line.startswith(b"data:"):
+            self._data.append(line[5:])
+        # Comments (":keep-alive") and the 'event', 'id' and 'retry' fields
+        # are not used by the shim.
+
+
+async def aiter_sse_data(byte_iterator):
+    """
+    Yields the 'data' payload of each event in an async iterator of bytes,
+    stopping at the OpenAI '[DONE]' sentinel.
+    """
+    parser = SSEParser()
+    async for chunk in byte_iterator:
+        for data in parser.feed(chunk):
+            if data == "[DONE]":
+                return
+            yield data
+    for data in parser.close():
+        if data == "[DONE]":
+            return
+        yield data
@@ -0,0 +1,109 @@
+# src/upstream.py
+
+# Construction and introspection of the shared upstream HTTP client.
+#
+# Every request to LM Studio goes through one httpx.AsyncClient, so its pool
+# limits and timeouts decide how the shim behaves under load: too few
+# keep-alive connections and requests pay TCP setup again, too small a pool
+# and they queue for a connection (head-of-line blocking). Everything here
+# is driven by Settings.
+
+import asyncio
+
+import httpx
+
+from .config import settings, logger
+
+try:
+    import h2  # noqa: F401  (needed by httpx for HTTP/2)
+except ImportError:
+    h2 = None
+
+
+def client_timeout(config=settings) -> httpx.Timeout:
+    """
+    Connect and pool-wait timeouts are short so a dead backend or an
+    exhausted pool fails fast; reads allow RESPONSE_TIMEOUT between bytes,
+    since a model can think for a long time before its first token.
+    """
+    return httpx.Timeout(
+        connect=config.UPSTREAM_CONNECT_TIMEOUT,
+        read=config.RESPONSE_TIMEOUT,
+        write=config.API_TIMEOUT,
+        pool=config.UPSTREAM_POOL_TIMEOUT,
+    )
+
+
+def client_limits(config=settings) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config.UPSTREAM_MAX_CONNECTIONS or None,
+        max_keepalive_connections=config.UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=config.UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+
+
+def build_client(config=settings) -> httpx.AsyncClient:
+    """Creates the upstream client from the settings."""
+    http2 = config.UPSTREAM_HTTP2
+    if http2 and h2 is None:
+        logger.warning("UPSTREAM_HTTP2 is set but the 'h2' package is not installed; using HTTP/1.1.")
+        http2 = False
+
+    headers = {}
+    if config.AUTH_TOKEN:
+        headers["Authorization"] = f"Bearer {config.AUTH_TOKEN}"
+
+    # Note: for plain http:// backends httpx only speaks HTTP/2 when it can
+    # negotiate it, i.e. over TLS; cleartext LM Studio stays on HTTP/1.1.
+    return httpx.AsyncClient(
+        timeout=client_timeout(config),
+        limits=client_limits(config),
+        http2=http2,
+        headers=headers,
+    )
+
+
+async def prewarm(client: httpx.AsyncClient, url: str, connections: int) -> int:
+    """
+    Opens up to 'connections' keep-alive connections to the host of 'url'
+    by sending that many concurrent GETs. Returns how many succeeded.
+    """
+    if connections <= 0:
+        return 0
+
+    async def probe():
+        response = await client.get(url)
+        await response.aclose()
+
+    results = await asyncio.gather(*(probe() for _ in range(connections)), return_exceptions=True)
+    return sum(1 for result in results if not isinstance(result, BaseException))
+
+
+def pool_stats(client: httpx.AsyncClient | None) -> dict:
+    """
+    Connection pool utilization, per origin. Reads httpcore internals, so
+    anything unexpected yields empty stats rather than an error.
+    """
+    stats = {"origins": {}, "waiting": 0}
+    if client is None or client.is_closed:
+        return stats
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    if pool is None:
+        return stats
+    try:
+        for connection in list(pool.connections):
+            origin = connection._origin
+            key = f"{origin.scheme.decode()}://{origin.host.decode()}:{origin.port}"
+            entry = stats["origins"].setdefault(key, {"connections": 0, "idle": 0, "active": 0, "http2": 0})
+            entry["connections"] += 1
+            if connection.is_idle():
+                entry["idle"] += 1
+            else:
+                entry["active"] += 1
+            if connection.info().startswith("HTTP/2"):
+                entry["http2"] += 1
+        # Requests queued for a connection (httpcore >= 1.0).
+        stats["waiting"] = sum(1 for request in getattr(pool, "_requests", []) if request.is_queued())
+    except Exception as e:
+        logger.debug(f"Could not read upstream pool stats: {e}")
+    return stats
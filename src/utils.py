@@ -1,37 +1,101 @@
 # src/utils.py
 
+import asyncio
 import httpx
 import json
+import logging
+import re
+import time
 from datetime import datetime, timezone
 
 # Use relative import for config and logger
 from .config import settings, logger
+from .sse import aiter_sse_data
+from .cache import ResponseCache
+from .continuation import ContinuationStore
+from .embeddings import EmbeddingBatcher, VectorCache
+from .coalesce import RequestCoalescer
+from .backends import backend_pool
+from .admission import PRIORITIES
+from .metrics import ACTIVE_STREAMS, request_labels, record_stream, record_error, record_completion
+from .ingest import upstream_body_kwargs
+from .ndjson import ChunkEncoder
+from .flush import PER_TOKEN, batch_lines
+from .upstream import build_client, prewarm, pool_stats
+from .retry import RetryPolicy, RetryBudget
+from .deadline import DeadlineExceeded, StreamWatchdog
+from . import ndjson
 
 # --- URL Helper Functions ---
-# (These now correctly use the settings object)
+# These point at the primary (first configured) backend. Requests are spread
+# over the whole pool through backend_pool.
 def get_chat_completions_url() -> str:
     """Builds the chat completions URL from the base URL."""
-    return f"{settings.LM_STUDIO_BASE_URL.rstrip('/')}/v1/chat/completions"
+    return backend_pool.primary.chat_completions_url
 
 def get_models_url() -> str:
     """Builds the models URL from the base URL."""
-    return f"{settings.LM_STUDIO_BASE_URL.rstrip('/')}/v1/models"
+    return backend_pool.primary.models_url
+
+def is_backend_failure(error: Exception) -> bool:
+    """Connection problems and 5xx responses count against a backend's health."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+def backend_outcome(error: BaseException) -> bool | None:
+    """
+    What a failed upstream call says about the backend's health: False for
+    a backend failure, True for an answer it gave (a 4xx), and None when it
+    says nothing, e.g. the call was cancelled or the client's deadline hit.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code < 500
+    if isinstance(error, httpx.TransportError):
+        return False
+    return None
 
 # --- HTTP Client Lifecycle ---
-client = httpx.AsyncClient(timeout=300.0)
+client = None
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the shared upstream client, creating it if needed.
+
+    The client is closed on shutdown, so it is looked up on every use rather
+    than bound at import time; this lets the app go through its lifespan
+    more than once (e.g. one TestClient per test). Its pool, timeouts and
+    auth header come from the settings (see upstream.py).
+    """
+    global client
+    if client is None or client.is_closed:
+        client = build_client()
+    return client
+
+def upstream_pool_stats() -> dict:
+    """Connection pool utilization of the shared upstream client."""
+    return pool_stats(client)
 
 async def startup_client():
     logger.info(f"Ollama-to-OpenAI Shim starting up...")
-    logger.info(f"Forwarding to LM Studio Base URL: {settings.LM_STUDIO_BASE_URL}")
-    try:
-        # Test connection on startup
-        await client.get(get_models_url())
-        logger.info("Successfully connected to LM Studio models endpoint.")
-    except Exception as e:
-        logger.error(f"STARTUP FAILED: Could not connect to LM Studio at {get_models_url()}: {e}")
+    for backend in backend_pool.backends:
+        logger.info(f"Forwarding to LM Studio Base URL: {backend.base_url} (weight {backend.weight})")
+        try:
+            # Test connection on startup
+            await get_client().get(backend.models_url)
+            logger.info(f"Successfully connected to LM Studio models endpoint at {backend.base_url}.")
+        except Exception as e:
+            logger.error(f"STARTUP FAILED: Could not connect to LM Studio at {backend.models_url}: {e}")
+            continue
+
+        # Open keep-alive connections ahead of the first requests.
+        warmed = await prewarm(get_client(), backend.models_url, settings.UPSTREAM_PREWARM_CONNECTIONS)
+        if warmed:
+            logger.info(f"Pre-warmed {warmed} connection(s) to {backend.base_url}.")
 
 async def shutdown_client():
-    await client.aclose()
+    if client is not None:
+        await client.aclose()
     logger.info("Ollama-to-OpenAI Shim shut down.")
 
 # --- Translation Logic ---
@@ -59,103 +123,630 @@ def translate_ollama_options_to_openai(ollama_data: dict) -> dict:
 
     return openai_payload
 
+# --- Response Cache ---
+# Shared by /api/chat and /api/generate; keyed on the translated OpenAI payload.
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    ttl=settings.RESPONSE_CACHE_TTL,
+    enabled=settings.RESPONSE_CACHE_ENABLED,
+)
+
+# --- Generate Context ---
+# Conversations behind the 'context' handles returned by /api/generate.
+continuation_store = ContinuationStore(
+    max_entries=settings.CONTINUATION_MAX_ENTRIES,
+    max_bytes=settings.CONTINUATION_MAX_BYTES,
+    ttl=settings.CONTINUATION_TTL,
+    enabled=settings.CONTINUATION_ENABLED,
+)
+
+# --- Request Coalescing ---
+# Identical in-flight /api/chat and /api/generate requests share one upstream call.
+request_coalescer = RequestCoalescer(enabled=settings.REQUEST_COALESCING_ENABLED)
+
+# --- Retries and Hedging ---
+# Shared by /api/chat and /api/generate; see retry.py.
+retry_policy = RetryPolicy(
+    retries=settings.UPSTREAM_RETRIES,
+    backoff_base=settings.RETRY_BACKOFF_BASE,
+    backoff_max=settings.RETRY_BACKOFF_MAX,
+    budget=RetryBudget(ratio=settings.RETRY_BUDGET_RATIO, min_per_second=settings.RETRY_BUDGET_MIN_PER_SEC),
+    hedge_min_delay=settings.HEDGE_MIN_DELAY,
+    hedge_min_samples=settings.HEDGE_MIN_SAMPLES,
+)
+
+# --- Upstream Requests ---
+
+def _untried(candidates: list, tried) -> list:
+    """The healthy candidates not in 'tried' (backends earlier attempts went to)."""
+    if not tried:
+        return []
+    return [b for b in candidates if b not in tried and b.is_healthy()]
+
+def has_alternative(openai_payload: dict, tried) -> bool:
+    """Whether a healthy backend other than those in 'tried' could serve the payload."""
+    return bool(_untried(backend_pool.candidates_for(openai_payload.get("model")), tried))
+
+async def _acquire_backend(openai_payload: dict, priority: int, request_stats: dict | None, tried=None):
+    """
+    Picks a backend for the payload's model and waits for admission to it.
+    Returns the backend and the time its slot was granted. A retry or hedge
+    passes the backends already 'tried'; another one is preferred and the
+    chosen one is added.
+    """
+    candidates = backend_pool.candidates_for(openai_payload.get("model"))
+    backend = backend_pool.acquire(_untried(candidates, tried) or candidates)
+    if tried is not None:
+        tried.add(backend)
+    try:
+        queue_wait = await backend.admission.acquire(priority)
+    except BaseException:
+        # Never sent, so no verdict on the backend.
+        backend_pool.release(backend, ok=None)
+        raise
+
+    if queue_wait:
+        logger.info(f"Request waited {queue_wait * 1000:.0f} ms for a slot on {backend.base_url}.")
+    if request_stats is not None:
+        request_stats["backend"] = backend.base_url
+        request_stats["queue_wait"] = queue_wait
+    return backend, time.monotonic()
+
+def queue_wait_headers(request_stats: dict) -> dict:
+    """Response headers reporting how long the request waited for admission."""
+    if "queue_wait" not in request_stats:
+        return {}
+    return {"X-Queue-Wait-Ms": f"{request_stats['queue_wait'] * 1000:.0f}"}
+
+def _release_backend(backend, admitted_at: float, ok: bool | None = True):
+    backend.admission.release(time.monotonic() - admitted_at)
+    backend_pool.release(backend, ok=ok)
+
+class _LeasedStreamContext:
+    """
+    Wraps an httpx stream context so that closing it also releases the
+    backend (and its admission slot) the stream is counted against. The
+    backend's success was recorded when the stream opened; an exception
+    passed to __aexit__ may still count as a failure (see backend_outcome).
+    """
+
+    def __init__(self, stream_context, backend, admitted_at: float):
+        self._stream_context = stream_context
+        self._backend = backend
+        self._admitted_at = admitted_at
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self._stream_context.__aexit__(None, None, None)
+        finally:
+            _release_backend(self._backend, self._admitted_at, ok=None if exc is None else backend_outcome(exc))
+
+async def open_translated_stream(openai_payload: dict, response_format: str, cache_key: str | None = None,
+                                 priority: int = PRIORITIES["normal"], request_stats: dict | None = None,
+                                 spool=None, flush_policy=PER_TOKEN, context_fn=None, deadline: float | None = None):
+    """
+    Opens a streaming chat completion against a pooled LM Studio backend and
+    returns the stream_translator generator for it.
+
+    The status is checked before returning, so an upstream error surfaces as
+    an httpx.HTTPStatusError (with its body read) rather than mid-stream.
+    Connect errors and 5xx answers are retried here, before anything has
+    been sent to the client; a stream is never restarted once returned.
+    The backend stays counted as busy until the stream is closed. If given,
+    'request_stats' is filled in with the chosen backend and the queue wait.
+    'spool' holds the spilled strings of a large request (see ingest.py),
+    and 'flush_policy' says how lines are grouped into writes (see flush.py).
+    For generate, 'context_fn' maps the full response text to the final
+    chunk's 'context'. The stream is cut off at the request's 'deadline'
+    (loop clock) and by the first-token and idle timeouts (see deadline.py).
+    """
+    if settings.STREAM_INCLUDE_USAGE:
+        # The token counts arrive in a last chunk of their own.
+        openai_payload = {**openai_payload, "stream_options": {"include_usage": True}}
+    backend, admitted_at, lm_studio_stream_context, lm_studio_stream_response = await retry_policy.call(
+        lambda tried: _open_stream(openai_payload, priority, request_stats, spool, tried)
+    )
+    return stream_translator(
+        lm_studio_stream_response,
+        response_format=response_format,
+        model_name=openai_payload["model"],
+        context_to_close=_LeasedStreamContext(lm_studio_stream_context, backend, admitted_at),
+        cache_key=cache_key,
+        request_stats=request_stats,
+        flush_policy=flush_policy,
+        context_fn=context_fn,
+        deadline=deadline,
+        first_token_timeout=settings.FIRST_TOKEN_TIMEOUT,
+        idle_timeout=settings.STREAM_IDLE_TIMEOUT
+    )
+
+async def _open_stream(openai_payload: dict, priority: int, request_stats: dict | None, spool, tried: set):
+    """One attempt at opening an upstream stream with a successful status."""
+    backend, admitted_at = await _acquire_backend(openai_payload, priority, request_stats, tried)
+    logger.debug(f"Forwarding as STREAMING request to {backend.chat_completions_url}...")
+
+    try:
+        lm_studio_stream_context = get_client().stream(
+            "POST", backend.chat_completions_url, **upstream_body_kwargs(openai_payload, spool)
+        )
+        sent_at = time.perf_counter()
+        # The response headers count against the first-token timeout too.
+        try:
+            lm_studio_stream_response = await asyncio.wait_for(
+                lm_studio_stream_context.__aenter__(), settings.FIRST_TOKEN_TIMEOUT or None
+            )
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("first_token_timeout", settings.FIRST_TOKEN_TIMEOUT) from None
+        if request_stats is not None:
+            request_stats["sent"] = sent_at
+            request_stats["connect"] = time.perf_counter() - sent_at
+    except BaseException as e:
+        _release_backend(backend, admitted_at, ok=backend_outcome(e))
+        raise
+
+    try:
+        lm_studio_stream_response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        try:
+            await lm_studio_stream_response.aread()
+            await lm_studio_stream_context.__aexit__(None, None, None)
+        finally:
+            _release_backend(backend, admitted_at, ok=backend_outcome(e))
+        raise
+
+    # The backend answered. Recorded now rather than when the stream ends,
+    # so that a half-open circuit's trial does not hold off every other
+    # request for a whole generation.
+    backend_pool.record_success(backend)
+
+    return backend, admitted_at, lm_studio_stream_context, lm_studio_stream_response
+
+async def post_chat_completion(openai_payload: dict, cache_key: str | None = None,
+                               priority: int = PRIORITIES["normal"], request_stats: dict | None = None,
+                               spool=None, hedge: bool = False) -> dict:
+    """
+    Sends a non-streaming chat completion to a pooled LM Studio backend and
+    returns its JSON. Connect errors and 5xx answers are retried; with
+    'hedge', a slow request is duplicated to another backend (see retry.py).
+    """
+    async def attempt(tried):
+        # Hedged attempts run side by side; only the one that counts for the
+        # request (the winner, or the last failure) is reported in its stats.
+        attempt_stats = {}
+        try:
+            result = await _send_chat_completion(openai_payload, priority, attempt_stats, spool, tried)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if request_stats is not None:
+                request_stats.update(attempt_stats)
+            raise
+        if request_stats is not None:
+            request_stats.update(attempt_stats)
+        return result
+
+    openai_json = await retry_policy.call(
+        attempt, model=openai_payload.get("model"), hedge=hedge,
+        has_alternative=lambda tried: has_alternative(openai_payload, tried)
+    )
+    if cache_key:
+        response_cache.put(cache_key, openai_json)
+    return openai_json
+
+async def _send_chat_completion(openai_payload: dict, priority: int, request_stats: dict, spool, tried: set) -> dict:
+    """One attempt at a non-streaming chat completion."""
+    backend, admitted_at = await _acquire_backend(openai_payload, priority, request_stats, tried)
+    logger.debug(f"Forwarding as NON-STREAMING request to {backend.chat_completions_url}...")
+
+    ok = True
+    try:
+        client = get_client()
+        upstream_request = client.build_request(
+            "POST", backend.chat_completions_url, **upstream_body_kwargs(openai_payload, spool)
+        )
+        sent_at = time.perf_counter()
+        # Sent in streaming mode only to time the response headers separately
+        # from the body.
+        response = await client.send(upstream_request, stream=True)
+        request_stats["sent"] = sent_at
+        request_stats["connect"] = time.perf_counter() - sent_at
+        try:
+            await response.aread()
+        finally:
+            await response.aclose()
+        response.raise_for_status()
+    except BaseException as e:
+        ok = backend_outcome(e)
+        raise
+    finally:
+        _release_backend(backend, admitted_at, ok=ok)
+
+    return response.json()
+
+# --- OpenAI Passthrough ---
+# /v1/chat/completions is relayed byte for byte; only the model name is
+# looked up in the body, for routing.
+
+_MODEL_FIELD = re.compile(rb'"model"\s*:\s*"([^"\\]*)"')
+# Clients put 'model' first; the search stops short of any image data.
+_MODEL_SEARCH_BYTES = 4096
+# Response headers relayed to the client as they are.
+PASSTHROUGH_HEADERS = ("content-type", "content-length", "content-encoding", "cache-control")
+
+def sniff_model(body: bytes) -> str | None:
+    """The 'model' of a raw OpenAI request body, found without parsing it."""
+    match = _MODEL_FIELD.search(body, 0, _MODEL_SEARCH_BYTES)
+    return match.group(1).decode("utf-8", "replace") if match else None
+
+async def open_passthrough(body: bytes, headers, model: str | None,
+                           priority: int = PRIORITIES["normal"], request_stats: dict | None = None):
+    """
+    Sends a raw OpenAI chat completion body to a pooled LM Studio backend
+    and returns a PassthroughRelay over its response. Connect errors and
+    5xx answers are retried, as nothing has been sent to the client yet;
+    a 5xx that stays raises httpx.HTTPStatusError with its body read.
+    Other statuses are returned for the client to see as they are.
+    """
+    upstream_headers = {
+        "Content-Type": headers.get("content-type", "application/json"),
+        # The body is relayed undecoded, so the client decides the encoding.
+        "Accept-Encoding": headers.get("accept-encoding", "identity"),
+    }
+    return await retry_policy.call(
+        lambda tried: _open_passthrough(body, upstream_headers, model, priority, request_stats, tried)
+    )
+
+async def _open_passthrough(body: bytes, upstream_headers: dict, model: str | None, priority: int,
+                            request_stats: dict | None, tried: set):
+    backend, admitted_at = await _acquire_backend({"model": model}, priority, request_stats, tried)
+    logger.debug(f"Passing /v1/chat/completions through to {backend.chat_completions_url}...")
+
+    try:
+        client = get_client()
+        upstream_request = client.build_request(
+            "POST", backend.chat_completions_url, content=body, headers=upstream_headers
+        )
+        sent_at = time.perf_counter()
+        response = await client.send(upstream_request, stream=True)
+        if request_stats is not None:
+            request_stats["sent"] = sent_at
+            request_stats["connect"] = time.perf_counter() - sent_at
+    except BaseException as e:
+        _release_backend(backend, admitted_at, ok=backend_outcome(e))
+        raise
+
+    if response.status_code >= 500:
+        try:
+            await response.aread()
+            await response.aclose()
+        finally:
+            _release_backend(backend, admitted_at, ok=False)
+        response.raise_for_status()
+
+    # As for translated streams, the answer is what counts for the circuit.
+    backend_pool.record_success(backend)
+    return PassthroughRelay(response, backend, admitted_at, request_stats)
+
+class PassthroughRelay:
+    """
+    Async iterator over the upstream body, unmodified, as it arrives.
+    aclose() (called when the stream ends, fails or the client goes away,
+    even before the first chunk) closes the upstream response, aborting the
+    generation, and frees the backend. SSE streams are recorded like
+    translated ones, with the first chunk standing in for the first token.
+    """
+
+    def __init__(self, response, backend, admitted_at: float, request_stats: dict | None):
+        self.response = response
+        self._backend = backend
+        self._admitted_at = admitted_at
+        self._request_stats = request_stats
+        self._chunks = response.aiter_raw()
+        self._streaming = response.headers.get("content-type", "").startswith("text/event-stream")
+        self._active_streams = None
+        if request_stats and self._streaming:
+            self._active_streams = ACTIVE_STREAMS.labels(*request_labels(request_stats))
+            self._active_streams.inc()
+        self._first_chunk_at = None
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        try:
+            chunk = await self._chunks.__anext__()
+        except StopAsyncIteration:
+            if self._request_stats:
+                if self._streaming:
+                    record_stream(self._request_stats, 0, self._first_chunk_at, time.perf_counter())
+                else:
+                    record_completion(self._request_stats)
+            await self.aclose()
+            raise
+        except Exception as e:
+            # Nothing well-formed can be added to a relayed body; the
+            # connection is closed and the client sees a truncated response.
+            logger.error(f"Passthrough relay failed: {e!r}")
+            if self._request_stats:
+                record_error(self._request_stats, "stream", count_request=False)
+            await self.aclose(ok=backend_outcome(e))
+            raise
+        if self._first_chunk_at is None:
+            self._first_chunk_at = time.perf_counter()
+        return chunk
+
+    async def aclose(self, ok: bool | None = None):
+        if self._closed:
+            return
+        self._closed = True
+        if self._active_streams:
+            self._active_streams.dec()
+        try:
+            await self.response.aclose()
+        finally:
+            _release_backend(self._backend, self._admitted_at, ok=ok)
+
+async def post_embeddings(model: str, dimensions: int | None, texts: list) -> list:
+    """
+    Embeds a batch of texts with a pooled LM Studio backend (/v1/embeddings)
+    and returns the vectors in input order.
+    """
+    payload = {"model": model, "input": texts}
+    if dimensions:
+        payload["dimensions"] = dimensions
+    backend, admitted_at = await _acquire_backend(payload, PRIORITIES["normal"], None)
+    logger.debug(f"Forwarding {len(texts)} embedding input(s) to {backend.embeddings_url}...")
+
+    ok = True
+    try:
+        response = await get_client().post(backend.embeddings_url, json=payload)
+        response.raise_for_status()
+    except BaseException as e:
+        ok = backend_outcome(e)
+        raise
+    finally:
+        _release_backend(backend, admitted_at, ok=ok)
+
+    data = sorted(response.json()["data"], key=lambda item: item.get("index", 0))
+    return [item["embedding"] for item in data]
+
+# --- Embeddings ---
+# Shared by /api/embed and /api/embeddings; see embeddings.py.
+embedding_batcher = EmbeddingBatcher(
+    post_embeddings,
+    max_inputs=settings.EMBED_BATCH_MAX_INPUTS,
+    max_delay=settings.EMBED_BATCH_WINDOW_MS / 1000,
+    cache=VectorCache(max_entries=settings.EMBED_CACHE_MAX_ENTRIES, max_bytes=settings.EMBED_CACHE_MAX_BYTES),
+)
+
+async def replay_cached_response(openai_json: dict, response_format: str, model_name: str, context_fn=None):
+    """
+    Async generator that replays a cached OpenAI response as an Ollama-style
+    stream: one content chunk followed by the final 'done' chunk.
+    """
+    content = openai_json["choices"][0]["message"].get("content") or ""
+    timestamp = get_iso_timestamp()
+
+    if response_format == "chat":
+        if content:
+            yield json.dumps({
+                "model": model_name,
+                "created_at": timestamp,
+                "message": {"role": "assistant", "content": content},
+                "done": False
+            }) + "\n"
+        final_chunk = {
+            "model": model_name,
+            "created_at": timestamp,
+            "message": {"role": "assistant", "content": ""},
+            "done": True
+        }
+    else: # "generate"
+        if content:
+            yield json.dumps({
+                "model": model_name,
+                "created_at": timestamp,
+                "response": content,
+                "done": False
+            }) + "\n"
+        final_chunk = {
+            "model": model_name,
+            "created_at": timestamp,
+            "response": content,
+            "done": True,
+            "context": context_fn(content) if context_fn else []
+        }
+
+    usage_data = openai_json.get("usage")
+    if usage_data:
+        final_chunk["prompt_eval_count"] = usage_data.get("prompt_tokens")
+        final_chunk["eval_count"] = usage_data.get("completion_tokens")
+
+    logger.info("Replayed cached response as stream.")
+    yield json.dumps(final_chunk) + "\n"
+
+# --- Ollama Timings ---
+
+def _ns(seconds: float) -> int:
+    return max(0, int(seconds * 1_000_000_000))
+
+def ollama_timings(request_stats: dict, usage: dict | None, first_token_at: float | None = None,
+                   finished_at: float | None = None, token_count: int | None = None) -> dict:
+    """
+    Ollama's duration (nanoseconds) and token count fields for a finished
+    answer, measured by the shim on the perf_counter clock of request_stats.
+
+    total_duration runs from the request's arrival, load_duration until the
+    upstream request was sent (backend choice, admission queue, retries),
+    prompt_eval_duration from then to the first token and eval_duration from
+    the first token to the last. A non-streaming answer has no first token
+    to time, so its whole upstream generation counts as eval_duration.
+    Counts come from the upstream 'usage', or for eval_count the number of
+    streamed chunks if the backend sent none.
+    """
+    finished_at = time.perf_counter() if finished_at is None else finished_at
+    started = request_stats["started"]
+    sent = request_stats.get("sent", started)
+    if first_token_at is None:
+        first_token_at = sent
+    fields = {
+        "total_duration": _ns(finished_at - started),
+        "load_duration": _ns(sent - started),
+        "prompt_eval_duration": _ns(first_token_at - sent),
+        "eval_duration": _ns(finished_at - first_token_at),
+    }
+    if usage:
+        fields["prompt_eval_count"] = usage.get("prompt_tokens") or 0
+        fields["eval_count"] = usage.get("completion_tokens") or 0
+    elif token_count is not None:
+        fields["eval_count"] = token_count
+    return fields
+
 # --- Stream Translator (with lifecycle fix) ---
-async def stream_translator(lm_studio_stream, response_format: str, model_name: str, context_to_close=None):
+def stream_translator(lm_studio_stream, response_format: str, model_name: str, context_to_close=None,
+                      cache_key: str | None = None, request_stats: dict | None = None,
+                      flush_policy=PER_TOKEN, context_fn=None, deadline: float | None = None,
+                      first_token_timeout: float | None = None, idle_timeout: float | None = None):
     """
-    Async generator that translates an OpenAI-style stream into an
-    Ollama-style stream (line-delimited JSON).
+    Returns an async generator that translates an OpenAI-style stream into
+    an Ollama-style stream (line-delimited JSON, yielded as bytes).
     
     It now accepts a 'context_to_close' to manually close the stream.
+    If a 'cache_key' is given, the completed answer is stored in the
+    response cache. If 'request_stats' is given, the stream's latency
+    profile is recorded in the metrics. A 'flush_policy' other than
+    per-token groups lines into fewer, larger writes (see flush.py).
+    For generate, 'context_fn(response_text)' supplies the final chunk's
+    'context' (see continuation.py). When the 'deadline' (loop clock), the
+    'first_token_timeout' or the 'idle_timeout' between events (seconds)
+    trips, the upstream stream is closed and the stream ends with an error
+    line (see deadline.py).
     """
-    full_response_content = ""
+    lines = _translate_stream(lm_studio_stream, response_format, model_name, context_to_close,
+                              cache_key, request_stats, context_fn,
+                              (deadline, first_token_timeout, idle_timeout))
+    if flush_policy.per_token:
+        return lines
+    return batch_lines(lines, flush_policy)
+
+def _stream_watchdog(limits: tuple, request_stats: dict | None) -> StreamWatchdog | None:
+    deadline, first_token_timeout, idle_timeout = limits
+    if not (deadline or first_token_timeout or idle_timeout):
+        return None
+    started = None
+    if request_stats and "sent" in request_stats:
+        # The first-token clock started when the request was sent.
+        started = asyncio.get_running_loop().time() - (time.perf_counter() - request_stats["sent"])
+    return StreamWatchdog(deadline, first_token_timeout, idle_timeout, started)
+
+async def _translate_stream(lm_studio_stream, response_format: str, model_name: str, context_to_close,
+                            cache_key: str | None, request_stats: dict | None, context_fn=None,
+                            limits=(None, None, None)):
+    # Generated text is collected as a list of parts and joined once at the
+    # end; repeated string concatenation is quadratic on long outputs.
+    response_parts = [] if response_format == "generate" or cache_key else None
     usage_data = None
-    
+    # Per token, metrics only need the count; the clock is read for the
+    # first token and once at the end.
+    token_count = 0
+    first_token_at = None
+    if request_stats is None:
+        # Timings are still reported, counted from the start of the stream.
+        timing_stats = {"started": time.perf_counter()}
+    else:
+        timing_stats = request_stats
+    active_streams = ACTIVE_STREAMS.labels(*request_labels(request_stats)) if request_stats else None
+    if active_streams:
+        active_streams.inc()
+    encoder = ChunkEncoder(response_format, model_name)
+    # Checked once per stream rather than formatting a message per token.
+    debug = logger.isEnabledFor(logging.DEBUG)
+    events = aiter_sse_data(lm_studio_stream.aiter_bytes())
+    # Why the stream broke off, if it did; passed on when it is closed.
+    failure = None
+    watchdog = _stream_watchdog(limits, request_stats)
+    if watchdog:
+        events = watchdog.watch(events)
+
     try:
-        async for chunk in lm_studio_stream.aiter_bytes():
-            chunk_str = chunk.decode('utf-8')
-            for line in chunk_str.splitlines():
-                if line.startswith("data: "):
-                    line = line[6:]
-                if line.strip() == "[DONE]":
-                    break
-                if not line.strip():
-                    continue 
-
-                try:
-                    openai_chunk = json.loads(line)
-                    
-                    if openai_chunk.get("usage"):
-                        usage_data = openai_chunk["usage"]
-                        continue
-                        
-                    delta = openai_chunk["choices"][0].get("delta", {})
-                    content = delta.get("content")
-
-                    if content:
-                        full_response_content += content
-                        timestamp = get_iso_timestamp()
-                        
-                        if response_format == "chat":
-                            ollama_chunk = {
-                                "model": model_name,
-                                "created_at": timestamp,
-                                "message": {"role": "assistant", "content": content},
-                                "done": False
-                            }
-                        else: # "generate"
-                            ollama_chunk = {
-                                "model": model_name,
-                                "created_at": timestamp,
-                                "response": content,
-                                "done": False
-                            }
-                        
-                        logger.debug(f"Streaming chunk: {ollama_chunk}")
-                        yield json.dumps(ollama_chunk) + "\n"
-
-                except json.JSONDecodeError:
-                    logger.warning(f"Failed to parse stream chunk: {line}")
-                    continue
-        
-        timestamp = get_iso_timestamp()
-        
-        if response_format == "chat":
-            final_chunk = {
-                "model": model_name,
-                "created_at": timestamp,
-                "message": {"role": "assistant", "content": ""},
-                "done": True
-            }
-        else: # "generate"
-            final_chunk = {
+        async for event_data in events:
+            try:
+                openai_chunk = ndjson.loads(event_data)
+            except json.JSONDecodeError:
+                logger.warning(f"Failed to parse stream chunk: {event_data}")
+                continue
+
+            # With include_usage the counts come in a last chunk without
+            # choices; some backends put them on the final content chunk.
+            if openai_chunk.get("usage"):
+                usage_data = openai_chunk["usage"]
+
+            choices = openai_chunk.get("choices")
+            if not choices:
+                continue
+            delta = choices[0].get("delta", {})
+            content = delta.get("content")
+            if watchdog and not watchdog.generating:
+                # Reasoning counts as output too; a bare role delta does not.
+                watchdog.generating = any(value for key, value in delta.items() if key != "role")
+
+            if content:
+                token_count += 1
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                if response_parts is not None:
+                    response_parts.append(content)
+                line = encoder.token(content)
+                if debug:
+                    logger.debug(f"Streaming chunk: {line!r}")
+                yield line
+
+        finished_at = time.perf_counter()
+        if request_stats:
+            record_stream(request_stats, token_count, first_token_at, finished_at)
+
+        final_fields = {}
+        if response_format == "generate":
+            final_content = "".join(response_parts)
+            final_fields["context"] = context_fn(final_content) if context_fn else []
+        else:
+            final_content = ""
+        final_fields.update(ollama_timings(timing_stats, usage_data, first_token_at, finished_at, token_count))
+
+        if cache_key:
+            response_cache.put(cache_key, {
                 "model": model_name,
-                "created_at": timestamp,
-                "response": full_response_content,
-                "done": True,
-                "context": []
-            }
-        
-        if usage_data:
-            final_chunk["total_duration"] = usage_data.get("total_duration_sec", 0) * 1_000_000_000
-            final_chunk["prompt_eval_count"] = usage_data.get("prompt_tokens")
-            final_chunk["eval_count"] = usage_data.get("completion_tokens")
-        
+                "choices": [{"message": {"role": "assistant", "content": "".join(response_parts)}}],
+                "usage": usage_data,
+            })
+
+        final_chunk = encoder.final(final_content, **final_fields)
         logger.info("Stream completed. Sending final 'done' chunk.")
-        logger.debug(f"Final chunk: {final_chunk}")
-        yield json.dumps(final_chunk) + "\n"
+        if debug:
+            logger.debug(f"Final chunk: {final_chunk!r}")
+        yield final_chunk
 
+    except DeadlineExceeded as e:
+        failure = e
+        logger.warning(f"Stream cut off: {e}")
+        if request_stats:
+            record_error(request_stats, e.reason, count_request=False)
+        yield encoder.error(str(e))
     except Exception as e:
+        failure = e
         logger.error(f"Stream translation failed: {e}", exc_info=True)
-        error_chunk = {
-            "error": f"Stream translation failed: {e}",
-            "done": True
-        }
-        yield json.dumps(error_chunk) + "\n"
+        if request_stats:
+            record_error(request_stats, "stream", count_request=False)
+        yield encoder.error(f"Stream translation failed: {e}")
     finally:
+        if active_streams:
+            active_streams.dec()
         # Manually close the stream context that was passed in.
         if context_to_close:
             logger.debug("Manually closing stream context.")
-            await context_to_close.__aexit__(None, None, None)
+            await context_to_close.__aexit__(type(failure) if failure else None, failure, None)
         else:
             logger.debug("Aclosing stream object directly.")
             await lm_studio_stream.aclose()
\ No newline at end of file
@@ -1,16 +1,26 @@
 # tests/conftest.py
+import os
+
+# SHIM_PORT has no default in Settings; provide one so the suite runs
+# without a .env file.
+os.environ.setdefault("SHIM_PORT", "11434")
+
 import pytest
 from fastapi.testclient import TestClient
 
 # Import your main FastAPI app
 from src.main import app
 from src.utils import get_models_url, get_chat_completions_url
+from src.backends import backend_pool
 
 @pytest.fixture(scope="function")
 def test_client():
     """Provides a synchronous TestClient for the shim app."""
     # TestClient automatically handles the app lifespan (startup/shutdown)
     with TestClient(app) as client:
+        # Startup probes fail (no LM Studio here); start every test with
+        # closed circuits rather than whatever earlier tests left behind.
+        backend_pool.reset_health()
         yield client
 
 @pytest.fixture(scope="function")
@@ -26,7 +26,7 @@ def test_get_tags_success(test_client, mock_lm_studio_urls):
     models_url = mock_lm_studio_urls["models_url"]
     
     with respx.mock as mocker: # Activate mocking
-        mocker.get(models_url).return_value(Response(status_code=200, json=MOCK_LM_STUDIO_MODELS))
+        mocker.get(models_url).mock(return_value=Response(status_code=200, json=MOCK_LM_STUDIO_MODELS))
         
         # Make the call *within* the mock context
         response = test_client.get("/api/tags") 
@@ -60,8 +60,8 @@ def test_chat_non_streaming_image(test_client, mock_lm_studio_urls):
     chat_url = mock_lm_studio_urls["chat_url"]
     
     with respx.mock as mocker:
-        mock_route = mocker.post(chat_url).return_value(
-            Response(status_code=200, json=MOCK_LM_STUDIO_CHAT_RESPONSE)
+        mock_route = mocker.post(chat_url).mock(
+            return_value=Response(status_code=200, json=MOCK_LM_STUDIO_CHAT_RESPONSE)
         )
         
         ollama_payload = {
@@ -76,6 +76,8 @@ def test_chat_non_streaming_image(test_client, mock_lm_studio_urls):
     data = response.json()
     assert data["message"]["content"] == "There are two dogs in the image."
     assert data["done"] is True
+    assert (data["prompt_eval_count"], data["eval_count"]) == (10, 20)
+    assert data["total_duration"] >= data["load_duration"] + data["eval_duration"] > 0
 
     received_payload = json.loads(mock_route.calls[0].request.content)
     expected_content = [
@@ -91,8 +93,8 @@ def test_generate_streaming_with_image(test_client, mock_lm_studio_urls):
     chat_url = mock_lm_studio_urls["chat_url"]
 
     with respx.mock as mocker:
-        mocker.post(chat_url).return_value(
-            Response(status_code=200, content="".join(MOCK_LM_STUDIO_STREAM_CHUNKS))
+        mock_route = mocker.post(chat_url).mock(
+            return_value=Response(status_code=200, content="".join(MOCK_LM_STUDIO_STREAM_CHUNKS))
         )
 
         ollama_payload = {
@@ -113,4 +115,66 @@ def test_generate_streaming_with_image(test_client, mock_lm_studio_urls):
     assert response_chunks[0]["response"] == "There are"
     assert response_chunks[1]["response"] == " two dogs."
     assert response_chunks[2]["done"] is True
-    assert response_chunks[2]["response"] == "There are two dogs."
\ No newline at end of file
+    assert response_chunks[2]["response"] == "There are two dogs."
+    # Token usage is requested for every stream.
+    assert json.loads(mock_route.calls[0].request.content)["stream_options"] == {"include_usage": True}
+
+
+def test_chat_response_cache_replays_as_stream(test_client, mock_lm_studio_urls, monkeypatch):
+    """A deterministic /api/chat answer is cached and replayed without calling LM Studio again."""
+    from src.utils import response_cache
+    monkeypatch.setattr(response_cache, "enabled", True)
+    response_cache.clear()
+    chat_url = mock_lm_studio_urls["chat_url"]
+
+    with respx.mock as mocker:
+        mock_route = mocker.post(chat_url).mock(
+            return_value=Response(status_code=200, json=MOCK_LM_STUDIO_CHAT_RESPONSE)
+        )
+        ollama_payload = {
+            "model": "mistralai/magistral-small-2509",
+            "stream": False,
+            "options": {"temperature": 0},
+            "messages": [{"role": "user", "content": "How many dogs?"}]
+        }
+        first = test_client.post("/api/chat", json=ollama_payload)
+        second = test_client.post("/api/chat", json=ollama_payload)
+        with test_client.stream("POST", "/api/chat", json={**ollama_payload, "stream": True}) as response:
+            chunks = [json.loads(line) for line in response.iter_lines() if line]
+
+    response_cache.clear()
+    assert mock_route.call_count == 1
+    assert first.json()["message"] == second.json()["message"]
+    assert chunks[0]["message"]["content"] == "There are two dogs in the image."
+    assert chunks[-1]["done"] is True
+
+def test_chat_streaming_upstream_error_status(test_client, mock_lm_studio_urls):
+    """An upstream error on a streaming request is returned with its status, not mid-stream."""
+    chat_url = mock_lm_studio_urls["chat_url"]
+
+    with respx.mock as mocker:
+        mocker.post(chat_url).mock(return_value=Response(status_code=404, text="model not loaded"))
+        response = test_client.post("/api/chat", json={"model": "missing", "stream": True, "messages": []})
+
+    assert response.status_code == 404
+    assert response.json()["error"] == "model not loaded"
+
+def test_metrics_records_stream(test_client, mock_lm_studio_urls):
+    """A streamed /api/generate request shows up in the /metrics histograms."""
+    chat_url = mock_lm_studio_urls["chat_url"]
+
+    with respx.mock as mocker:
+        mocker.post(chat_url).mock(
+            return_value=Response(status_code=200, content="".join(MOCK_LM_STUDIO_STREAM_CHUNKS))
+        )
+        ollama_payload = {"model": "metrics-model", "stream": True, "prompt": "Hi"}
+        with test_client.stream("POST", "/api/generate", json=ollama_payload) as response:
+            list(response.iter_lines())
+
+    metrics = test_client.get("/metrics")
+    assert metrics.status_code == 200
+    labels = 'route="/api/generate",model="metrics-model",backend="http://localhost:1234"'
+    assert f"ollama_shim_requests_total{{{labels}}} 1.0" in metrics.text
+    assert f"ollama_shim_time_to_first_token_seconds_count{{{labels}}} 1" in metrics.text
+    assert f"ollama_shim_active_streams{{{labels}}} 0.0" in metrics.text
+    assert "ollama_shim_backend_in_flight" in metrics.text
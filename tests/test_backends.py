@@ -0,0 +1,297 @@
+import asyncio
+import time
+
+import pytest
+import respx
+from httpx import Response, ConnectError
+
+from src.backends import Backend, BackendPool, BackendUnavailable, NoBackendAvailable, backend_pool, parse_backends
+from src import metrics
+from src.metrics import ModelLabels
+from src.admission import AdmissionController, AdmissionRejected, PRIORITIES, request_priority
+
+# --- Unit Tests for src.backends ---
+
+def test_parse_backends_with_weights():
+    backends = parse_backends("http://a:1234|2, http://b:1234/")
+    assert [(b.base_url, b.weight) for b in backends] == [("http://a:1234", 2.0), ("http://b:1234", 1.0)]
+    assert backends[1].chat_completions_url == "http://b:1234/v1/chat/completions"
+
+def test_parse_backends_rejects_bad_weight():
+    with pytest.raises(ValueError):
+        parse_backends("http://a:1234|0")
+
+def test_least_outstanding_selection_respects_weights():
+    heavy, light = Backend("http://heavy", weight=3), Backend("http://light", weight=1)
+    pool = BackendPool([heavy, light])
+    picks = [pool.acquire() for _ in range(4)]
+    # Weight 3 vs 1: the heavy backend takes three of the first four requests.
+    assert picks.count(heavy) == 3
+    assert heavy.in_flight == 3 and light.in_flight == 1
+    for backend in picks:
+        pool.release(backend)
+    assert heavy.in_flight == light.in_flight == 0
+
+def test_p2c_prefers_less_loaded_backend():
+    busy, idle = Backend("http://busy"), Backend("http://idle")
+    busy.in_flight = 50
+    pool = BackendPool([busy, idle], strategy="p2c")
+    picks = [pool.select() for _ in range(200)]
+    assert picks.count(idle) > picks.count(busy)
+
+def test_p2c_compares_two_distinct_backends():
+    # However lopsided the weights, both backends are drawn and compared,
+    # so the less loaded one (relative to its weight) always wins.
+    heavy, light = Backend("http://heavy", weight=100), Backend("http://light", weight=1)
+    heavy.in_flight = 200
+    pool = BackendPool([heavy, light], strategy="p2c")
+    assert all(pool.select() is light for _ in range(200))
+
+def test_failing_backend_is_removed_from_rotation():
+    bad, good = Backend("http://bad"), Backend("http://good")
+    pool = BackendPool([bad, good], failure_threshold=2, cooldown=60)
+    for _ in range(2):
+        pool.release(pool.acquire([bad]), ok=False)
+    assert not bad.is_healthy()
+    assert bad.circuit_state() == "open"
+    assert all(pool.select() is good for _ in range(20))
+    # With every candidate's circuit open the request is refused at once.
+    with pytest.raises(BackendUnavailable) as excinfo:
+        pool.select([bad])
+    assert 1 <= excinfo.value.retry_after <= 60
+
+def test_circuit_opens_on_error_rate_and_recovers_through_half_open():
+    backend = Backend("http://flaky")
+    pool = BackendPool([backend], failure_threshold=100, cooldown=0.05, error_rate=0.5, error_window=10)
+    for ok in [True, False, True, False, True, False]:
+        pool.release(pool.acquire(), ok=ok)
+    assert backend.circuit_state() == "open"
+
+    time.sleep(0.06)
+    assert backend.circuit_state() == "half_open"
+    trial = pool.acquire()
+    # Only one trial request at a time.
+    with pytest.raises(BackendUnavailable):
+        pool.acquire()
+    pool.release(trial, ok=False)
+    assert backend.circuit_state() == "open"
+
+    time.sleep(0.06)
+    pool.release(pool.acquire(), ok=True)
+    assert backend.circuit_state() == "closed"
+    assert backend.error_rate() == 0.0
+
+def test_streaming_trial_closes_the_circuit_once_it_answers(monkeypatch):
+    import httpx
+    import src.utils
+    from src.config import settings
+    from src.utils import open_translated_stream
+
+    class BreaksMidStream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            yield b'data: {"choices": [{"delta": {"content": "Hi"}}]}\n\n'
+            raise httpx.ReadError("connection reset")
+
+    backend = Backend("http://gpu1:1234")
+    pool = BackendPool([backend], failure_threshold=1, cooldown=60)
+    monkeypatch.setattr(src.utils, "backend_pool", pool)
+    monkeypatch.setattr(settings, "UPSTREAM_RETRIES", 0)
+    payload = {"model": "m", "messages": [{"role": "user", "content": "Hi"}], "stream": True}
+
+    def half_open():
+        pool.record_failure(backend)
+        pool.record_probe(backend, True)
+        assert backend.circuit_state() == "half_open"
+
+    async def stalled(request):
+        await asyncio.sleep(30)
+
+    async def run():
+        half_open()
+        with respx.mock as mocker:
+            route = mocker.post(backend.chat_completions_url)
+            route.mock(return_value=Response(200, stream=BreaksMidStream(), headers={"Content-Type": "text/event-stream"}))
+            lines = await open_translated_stream(payload, "chat")
+            # The trial answered: other requests are let through while it streams.
+            assert backend.circuit_state() == "closed"
+            assert pool.select() is backend
+            chunks = [line async for line in lines]
+            assert b"error" in chunks[-1]
+            # A stream that breaks off still counts against the backend.
+            assert backend.circuit_state() == "open"
+
+            # A trial cancelled before it was answered decides nothing.
+            half_open()
+            route.mock(side_effect=stalled)
+            trial = asyncio.create_task(open_translated_stream(payload, "chat"))
+            await asyncio.sleep(0.05)
+            assert not backend.is_healthy()
+            trial.cancel()
+            await asyncio.gather(trial, return_exceptions=True)
+            assert backend.circuit_state() == "half_open"
+            assert backend.is_healthy()
+        assert backend.in_flight == 0
+
+    asyncio.run(run())
+
+def test_health_prober_opens_and_reopens_circuits():
+    from src.health import HealthProber
+    backend = Backend("http://gpu1:1234")
+    pool = BackendPool([backend], failure_threshold=2, cooldown=60)
+    prober = HealthProber(pool)
+
+    with respx.mock as mocker:
+        route = mocker.get("http://gpu1:1234/v1/models")
+        route.side_effect = ConnectError("down")
+        asyncio.run(prober.probe_all())
+        asyncio.run(prober.probe_all())
+        assert backend.circuit_state() == "open"
+        assert not pool.is_ready()
+
+        route.side_effect = None
+        route.return_value = Response(200, json={"data": []})
+        assert asyncio.run(prober.probe_all()) == [True]
+    # Reachable again: the next request is let through as the trial.
+    assert backend.circuit_state() == "half_open"
+    assert pool.is_ready()
+
+def test_ready_endpoint_reports_open_circuits(test_client):
+    assert test_client.get("/ready").status_code == 200
+    backend = backend_pool.primary
+    for _ in range(backend_pool.failure_threshold):
+        backend_pool.record_failure(backend)
+    try:
+        response = test_client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["backends"][backend.base_url] == "open"
+        chat = test_client.post("/api/chat", json={"model": "m", "messages": [{"role": "user", "content": "hi"}]})
+        assert chat.status_code == 503
+        assert "Retry-After" in chat.headers
+    finally:
+        backend_pool.reset_health()
+
+def test_tags_merges_backend_catalogs(monkeypatch):
+    from src import catalog
+    pool = BackendPool(parse_backends("http://gpu1:1234,http://gpu2:1234,http://gpu3:1234"))
+    monkeypatch.setattr(catalog, "backend_pool", pool)
+
+    with respx.mock as mocker:
+        mocker.get("http://gpu1:1234/v1/models").mock(return_value=Response(200, json={"data": [{"id": "a-7b"}, {"id": "b-13b"}]}))
+        mocker.get("http://gpu2:1234/v1/models").mock(return_value=Response(200, json={"data": [{"id": "b-13b"}, {"id": "c-70b"}]}))
+        mocker.get("http://gpu3:1234/v1/models").mock(side_effect=ConnectError("down"))
+        models = asyncio.run(catalog.fetch_lm_studio_models())
+
+    assert sorted(m["name"] for m in models) == ["a-7b", "b-13b", "c-70b"]
+    assert pool.backends[2].consecutive_failures == 1
+    assert pool.index_snapshot() == {
+        "a-7b": ["http://gpu1:1234"],
+        "b-13b": ["http://gpu1:1234", "http://gpu2:1234"],
+        "c-70b": ["http://gpu2:1234"],
+    }
+
+def test_model_aware_candidates_and_fallback():
+    gpu1, gpu2 = Backend("http://gpu1"), Backend("http://gpu2")
+    pool = BackendPool([gpu1, gpu2])
+    # Before discovery every backend is a candidate.
+    assert pool.candidates_for("llama-8b") == [gpu1, gpu2]
+
+    pool.update_models(gpu1, ["llama-8b"])
+    pool.update_models(gpu2, ["qwen-14b", "llama-8b"])
+    pool.update_models(gpu1, ["mistral-7b"])
+    assert pool.candidates_for("llama-8b") == [gpu2]
+    assert pool.candidates_for("mistral-7b") == [gpu1]
+    assert pool.candidates_for("unknown") == [gpu1, gpu2]
+
+    pool.fallback = "reject"
+    with pytest.raises(NoBackendAvailable):
+        pool.candidates_for("unknown")
+
+def test_model_label_keeps_reported_models_and_caps_the_rest(monkeypatch):
+    labels = ModelLabels(limit=2)
+    monkeypatch.setattr(metrics, "model_labels", labels)
+    monkeypatch.setattr("src.backends.model_labels", labels)
+    pool = BackendPool([Backend("http://gpu1")])
+    pool.update_models(pool.backends[0], ["llama-8b"])
+
+    assert [labels.label(m) for m in ("typo-1", "typo-2", "typo-3", "typo-1")] == ["typo-1", "typo-2", "other", "typo-1"]
+    # A reported model is never collapsed, however many names came first.
+    assert labels.label("llama-8b") == "llama-8b"
+    assert metrics.request_labels({"route": "/api/chat", "model": "typo-4"}) == ("/api/chat", "other", "none")
+
+def test_backends_endpoint_exposes_index(test_client):
+    response = test_client.get("/shim/backends")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["backends"][0]["url"] == "http://localhost:1234"
+    assert "models" in data
+
+# --- Unit Tests for src.admission ---
+
+def test_request_priority_from_header_and_size():
+    assert request_priority({"x-priority": "HIGH"}, {}, 2048) == PRIORITIES["high"]
+    assert request_priority({}, {"options": {"num_predict": 4096}}, 2048) == PRIORITIES["low"]
+    assert request_priority({}, {"options": {"num_predict": -1}}, 2048) == PRIORITIES["low"]
+    assert request_priority({}, {"options": {"num_predict": 100}}, 2048) == PRIORITIES["normal"]
+
+def test_admission_serves_waiters_by_priority():
+    controller = AdmissionController(max_concurrency=1, max_queue=10)
+    order = []
+
+    async def worker(name, priority):
+        await controller.acquire(priority)
+        order.append(name)
+        await asyncio.sleep(0.01)
+        controller.release()
+
+    async def run():
+        await controller.acquire()  # occupy the only slot
+        tasks = [asyncio.create_task(worker(name, p)) for name, p in
+                 [("low", 2), ("normal", 1), ("high", 0), ("high-2", 0)]]
+        await asyncio.sleep(0.01)
+        controller.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["high", "high-2", "normal", "low"]
+    assert controller.active == 0 and controller.waiting == 0
+
+def test_admission_rejects_when_queue_full():
+    controller = AdmissionController(max_concurrency=1, max_queue=1)
+
+    async def run():
+        await controller.acquire()
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire()
+        waiter.cancel()
+        return rejected.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert error.retry_after >= 1
+    assert controller.waiting == 0
+
+def test_admission_times_out_with_503():
+    controller = AdmissionController(max_concurrency=1, max_queue=5, queue_timeout=0.01)
+
+    async def run():
+        await controller.acquire()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire()
+        controller.release()
+        return rejected.value
+
+    assert asyncio.run(run()).status_code == 503
+    assert controller.active == 0 and controller.waiting == 0
+
+def test_chat_rejected_with_retry_after(test_client, monkeypatch):
+    from src.backends import backend_pool
+    admission = AdmissionController(max_concurrency=1, max_queue=0)
+    admission.active = 1  # the only slot is busy
+    monkeypatch.setattr(backend_pool.primary, "admission", admission)
+
+    response = test_client.post("/api/chat", json={"model": "m", "stream": False, "messages": []})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
@@ -0,0 +1,52 @@
+import pytest
+from src.cache import ResponseCache, payload_cache_key, is_deterministic
+
+# --- Unit Tests for src.cache ---
+
+RESPONSE = {"model": "m", "choices": [{"message": {"role": "assistant", "content": "hi"}}]}
+
+def test_cache_key_ignores_key_order_and_stream_flag():
+    a = {"model": "m", "seed": 1, "messages": [{"role": "user", "content": "x"}], "stream": True}
+    b = {"messages": [{"role": "user", "content": "x"}], "stream": False, "seed": 1, "model": "m"}
+    assert payload_cache_key(a) == payload_cache_key(b)
+    assert payload_cache_key(a) != payload_cache_key({**a, "seed": 2})
+
+def test_only_deterministic_payloads_are_cacheable():
+    assert is_deterministic({"temperature": 0})
+    assert is_deterministic({"seed": 7, "temperature": 0.8})
+    assert not is_deterministic({"temperature": 0.7})
+    assert ResponseCache(enabled=False).key_for({"temperature": 0}) is None
+    assert ResponseCache(enabled=True).key_for({"temperature": 0.7}) is None
+
+def test_cache_hit_miss_counters():
+    cache = ResponseCache(enabled=True)
+    assert cache.get("k") is None
+    cache.put("k", RESPONSE)
+    assert cache.get("k") == RESPONSE
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_cache_evicts_least_recently_used_by_count():
+    cache = ResponseCache(max_entries=2, enabled=True)
+    cache.put("a", RESPONSE)
+    cache.put("b", RESPONSE)
+    cache.get("a")
+    cache.put("c", RESPONSE)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.evictions == 1
+
+def test_cache_evicts_by_bytes():
+    cache = ResponseCache(max_bytes=100, enabled=True)
+    cache.put("a", RESPONSE)
+    cache.put("b", RESPONSE)
+    assert len(cache) == 1
+    assert cache.stats()["bytes"] <= 100
+
+def test_cache_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("src.cache.time.monotonic", lambda: now[0])
+    cache = ResponseCache(ttl=10, enabled=True)
+    cache.put("k", RESPONSE)
+    now[0] += 11
+    assert cache.get("k") is None
+    assert cache.expirations == 1
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+from src.catalog import ModelCatalog, parse_model_id, to_ollama_model
+
+# --- Unit Tests for src.catalog.parse_model_id ---
+
+def test_parse_model_id_size_and_quant():
+    details = parse_model_id("llama-3.1-8b-instruct-q4_k_m")
+    assert details["family"] == "llama"
+    assert details["parameter_size"] == "8B"
+    assert details["quantization_level"] == "Q4_K_M"
+
+def test_parse_model_id_unknown():
+    details = parse_model_id("mistralai/magistral-small-2509")
+    assert details["parameter_size"] == "N/A"
+    assert details["quantization_level"] == "N/A"
+
+def test_to_ollama_model_fills_details():
+    entry = to_ollama_model({"id": "qwen2.5-14b-q5_0", "created": 1720000000})
+    assert entry["name"] == "qwen2.5-14b-q5_0"
+    assert entry["details"]["parameter_size"] == "14B"
+    assert entry["details"]["quantization_level"] == "Q5_0"
+    assert entry["modified_at"] == "2024-07-03T09:46:40Z"
+
+# --- Unit Tests for src.catalog.ModelCatalog ---
+
+class CountingFetch:
+    def __init__(self, delay=0.01):
+        self.calls = 0
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return [{"name": f"model-{self.calls}"}]
+
+def test_catalog_collapses_concurrent_misses():
+    fetch = CountingFetch()
+    catalog = ModelCatalog(fetch, ttl=60)
+
+    async def run():
+        return await asyncio.gather(*(catalog.get() for _ in range(20)))
+
+    results = asyncio.run(run())
+    assert fetch.calls == 1
+    assert all(r == [{"name": "model-1"}] for r in results)
+
+def test_catalog_serves_stale_while_refreshing():
+    fetch = CountingFetch()
+    catalog = ModelCatalog(fetch, ttl=60, max_stale=300)
+
+    async def run():
+        first = await catalog.get()
+        catalog._fetched_at = time.monotonic() - 61
+        stale = await catalog.get()
+        await asyncio.sleep(0.05)
+        fresh = await catalog.get()
+        return first, stale, fresh
+
+    first, stale, fresh = asyncio.run(run())
+    assert stale == first == [{"name": "model-1"}]
+    assert fresh == [{"name": "model-2"}]
+    assert fetch.calls == 2
@@ -0,0 +1,221 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+
+import respx
+from httpx import Response
+
+from src.admission import AdmissionController
+from src.backends import backend_pool
+from src.coalesce import RequestCoalescer
+from src.config import settings
+from src.flush import PER_TOKEN, FlushPolicy
+from src.utils import request_coalescer
+
+# --- Unit Tests for src.coalesce.RequestCoalescer ---
+
+class FakeUpstream:
+    """Counts how often the upstream is opened and whether it was closed."""
+    def __init__(self, lines, delay=0.01):
+        self.lines = lines
+        self.delay = delay
+        self.opened = 0
+        self.closed = False
+
+    async def open(self):
+        self.opened += 1
+        return self._generate()
+
+    async def _generate(self):
+        try:
+            for line in self.lines:
+                await asyncio.sleep(self.delay)
+                yield line
+        finally:
+            self.closed = True
+
+async def drain(iterator):
+    return [line async for line in iterator]
+
+def test_identical_streams_share_one_upstream():
+    upstream = FakeUpstream(["a\n", "b\n", "c\n"])
+    coalescer = RequestCoalescer(enabled=True)
+    key = coalescer.key_for({"model": "m", "messages": []}, "chat")
+
+    async def run():
+        async def subscriber(delay):
+            await asyncio.sleep(delay)
+            return await drain(await coalescer.stream(key, upstream.open))
+        return await asyncio.gather(subscriber(0), subscriber(0.015), subscriber(0.025))
+
+    results = asyncio.run(run())
+    assert upstream.opened == 1
+    assert all(r == ["a\n", "b\n", "c\n"] for r in results)
+    assert coalescer.coalesced == 2
+    assert coalescer.in_flight() == 0
+
+def test_stream_cancelled_when_all_subscribers_leave():
+    upstream = FakeUpstream(["x\n"] * 100)
+    coalescer = RequestCoalescer(enabled=True)
+
+    async def run():
+        stream = await coalescer.stream("k", upstream.open)
+        async for _ in stream:
+            break
+        await stream.aclose()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert upstream.closed
+    assert coalescer.in_flight() == 0
+
+def test_open_errors_reach_every_waiter():
+    coalescer = RequestCoalescer(enabled=True)
+
+    async def failing_open():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream said no")
+
+    async def run():
+        return await asyncio.gather(
+            coalescer.stream("k", failing_open),
+            coalescer.stream("k", failing_open),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+def test_identical_calls_share_one_result():
+    coalescer = RequestCoalescer(enabled=True)
+    calls = []
+
+    async def request_fn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"answer": 42}
+
+    async def run():
+        return await asyncio.gather(*(coalescer.call("k", request_fn) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert results == [{"answer": 42}] * 5
+
+def test_followers_report_the_leaders_backend_and_queue_wait():
+    coalescer = RequestCoalescer(enabled=True)
+    upstream = FakeUpstream(["a\n"])
+
+    def leader(stats, open_fn):
+        async def request_fn():
+            # What admission records for the request that reaches a backend.
+            stats.update(backend="http://gpu-1:1234", queue_wait=0.25)
+            await asyncio.sleep(0.01)
+            return await open_fn()
+        return request_fn
+
+    async def answer():
+        return {}
+
+    async def streamer(stats, open_fn):
+        return await drain(await coalescer.stream("s", open_fn, request_stats=stats))
+
+    async def run():
+        stats = [{"model": "m"} for _ in range(4)]
+        await asyncio.gather(
+            coalescer.call("c", leader(stats[0], answer), request_stats=stats[0]),
+            coalescer.call("c", answer, request_stats=stats[1]),
+            streamer(stats[2], leader(stats[2], upstream.open)),
+            streamer(stats[3], upstream.open),
+        )
+        return stats
+
+    stats = asyncio.run(run())
+    assert upstream.opened == 1
+    assert all(s["backend"] == "http://gpu-1:1234" and s["queue_wait"] == 0.25 for s in stats)
+
+def test_streams_with_different_flush_policies_are_not_shared():
+    coalescer = RequestCoalescer(enabled=True)
+    payload = {"model": "m", "messages": []}
+    batched = coalescer.key_for(payload, "chat", FlushPolicy.parse("tokens=8"))
+
+    assert batched == coalescer.key_for(payload, "chat", FlushPolicy.parse("tokens=8"))
+    assert batched != coalescer.key_for(payload, "chat", PER_TOKEN)
+    assert batched != coalescer.key_for(payload, "chat")
+
+def test_disabled_coalescer_passes_through():
+    coalescer = RequestCoalescer(enabled=False)
+    assert coalescer.key_for({"model": "m"}, "chat") is None
+
+# --- Integration Tests (routes) ---
+
+def test_spooled_request_survives_its_leader_giving_up(test_client, mock_lm_studio_urls, monkeypatch):
+    # Both requests spill their image to a spool, which a route closes on its way out.
+    monkeypatch.setattr(settings, "LARGE_PAYLOAD_BYTES", 1024)
+    monkeypatch.setattr(settings, "SPILL_STRING_BYTES", 1024)
+    monkeypatch.setattr(request_coalescer, "enabled", True)
+    # The only slot is busy, so the leader is still queued when it gives up.
+    admission = AdmissionController(max_concurrency=1, max_queue=5)
+    admission.active = 1
+    monkeypatch.setattr(backend_pool.primary, "admission", admission)
+
+    image = base64.b64encode(bytes(range(256)) * 40).decode("ascii")
+    body = {"model": "m", "messages": [{"role": "user", "content": "what is this", "images": [image]}], "stream": False}
+    answer = {"model": "m", "choices": [{"message": {"role": "assistant", "content": "noise"}}]}
+    responses = {}
+
+    def post(name, headers):
+        responses[name] = test_client.post("/api/chat", json=body, headers=headers)
+
+    with respx.mock as mocker:
+        mocker.post(mock_lm_studio_urls["chat_url"]).mock(return_value=Response(200, json=answer))
+        leader = threading.Thread(target=post, args=("leader", {"X-Request-Timeout": "0.3"}))
+        follower = threading.Thread(target=post, args=("follower", {}))
+        leader.start()
+        while admission.waiting == 0:
+            time.sleep(0.01)
+        follower.start()
+        leader.join(5)
+        # The slot frees up only after the leader's route has closed its spool.
+        test_client.portal.call(admission.release)
+        follower.join(5)
+
+    assert responses["leader"].status_code == 504
+    assert responses["follower"].status_code == 200
+    assert responses["follower"].json()["message"]["content"] == "noise"
+
+def test_stream_with_its_own_deadline_does_not_cut_off_followers(test_client, mock_lm_studio_urls, monkeypatch):
+    monkeypatch.setattr(request_coalescer, "enabled", True)
+
+    async def slow_tokens():
+        for _ in range(10):
+            await asyncio.sleep(0.05)
+            yield b'data: {"choices": [{"delta": {"content": "tok "}}]}\n\n'
+        yield b"data: [DONE]\n\n"
+
+    def answer(request):
+        return Response(200, headers={"Content-Type": "text/event-stream"}, content=slow_tokens())
+
+    body = {"model": "m", "messages": [{"role": "user", "content": "Hi"}], "stream": True}
+    responses = {}
+
+    def post(name, headers):
+        responses[name] = test_client.post("/api/chat", json=body, headers=headers)
+
+    with respx.mock as mocker:
+        mocker.post(mock_lm_studio_urls["chat_url"]).mock(side_effect=answer)
+        leader = threading.Thread(target=post, args=("leader", {"X-Request-Timeout": "0.2"}))
+        follower = threading.Thread(target=post, args=("follower", {}))
+        leader.start()
+        time.sleep(0.1)
+        follower.start()
+        leader.join(5)
+        follower.join(5)
+
+    leader_lines = [json.loads(line) for line in responses["leader"].text.splitlines()]
+    follower_lines = [json.loads(line) for line in responses["follower"].text.splitlines()]
+    assert leader_lines[-1]["error"] == "Request deadline exceeded"
+    assert "error" not in follower_lines[-1]
+    assert "".join(line["message"]["content"] for line in follower_lines) == "tok " * 10
@@ -0,0 +1,106 @@
+import json
+
+import respx
+from httpx import Response
+
+from src.continuation import ContinuationStore, CONTEXT_MAGIC, decode_handle, encode_handle, history_message
+
+# --- Unit Tests for src.continuation ---
+
+def test_handle_round_trips_and_foreign_contexts_are_ignored():
+    assert decode_handle(encode_handle(0x0123456789ABCDEF)) == 0x0123456789ABCDEF
+    # Token arrays from a real Ollama server are not handles.
+    assert decode_handle([1, 2, 3, 4, 5]) is None
+    assert decode_handle([CONTEXT_MAGIC, 1, 2, 3]) is None
+    assert decode_handle([CONTEXT_MAGIC, 1, 2, 3, 70000]) is None
+    assert decode_handle(None) is None
+
+def test_store_continues_and_shares_the_prefix():
+    store = ContinuationStore()
+    first_turn = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}]
+    context = store.save(first_turn, "Hello!")
+    messages = store.messages_for(context)
+    assert [m["content"] for m in messages] == ["Be brief.", "Hi", "Hello!"]
+    # The stored messages are the ones sent, so the next prompt has the same prefix.
+    assert messages[0] is first_turn[0]
+    assert store.stats()["hits"] == 1
+
+def test_store_evicts_least_recently_used():
+    store = ContinuationStore(max_entries=2)
+    a = store.save([{"role": "user", "content": "a"}], "1")
+    b = store.save([{"role": "user", "content": "b"}], "2")
+    store.messages_for(a)
+    c = store.save([{"role": "user", "content": "c"}], "3")
+    assert store.messages_for(b) == ()
+    assert store.messages_for(a) and store.messages_for(c)
+    assert store.evictions == 1
+
+def test_store_bounds_bytes_and_can_be_disabled():
+    store = ContinuationStore(max_bytes=10)
+    assert store.save([{"role": "user", "content": "x" * 20}], "y") == []
+    assert ContinuationStore(enabled=False).save([{"role": "user", "content": "x"}], "y") == []
+
+def test_spilled_images_are_not_kept_in_history():
+    message = {"role": "user", "content": [
+        {"type": "text", "text": "look"},
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64,\x00spill:0:abc\x00"}},
+    ]}
+    assert history_message(message)["content"] == [{"type": "text", "text": "look"}]
+    assert len(message["content"]) == 2
+
+# --- /api/generate context chaining ---
+
+def completion(content: str) -> dict:
+    return {"model": "m", "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+
+def test_generate_context_continues_the_conversation(test_client, mock_lm_studio_urls):
+    with respx.mock as mocker:
+        route = mocker.post(mock_lm_studio_urls["chat_url"])
+        route.side_effect = [Response(200, json=completion("Paris.")), Response(200, json=completion("2.1M."))]
+        first = test_client.post("/api/generate", json={
+            "model": "m", "system": "Be brief.", "prompt": "Capital of France?", "stream": False})
+        second = test_client.post("/api/generate", json={
+            "model": "m", "prompt": "Population?", "context": first.json()["context"], "stream": False})
+
+    assert first.json()["context"][0] == CONTEXT_MAGIC
+    assert second.json()["context"] not in ([], first.json()["context"])
+    first_sent = json.loads(route.calls[0].request.content)["messages"]
+    second_sent = json.loads(route.calls[1].request.content)["messages"]
+    assert second_sent[:2] == first_sent
+    assert second_sent[2:] == [
+        {"role": "assistant", "content": "Paris."},
+        {"role": "user", "content": [{"type": "text", "text": "Population?"}]},
+    ]
+
+def test_generate_context_keeps_spilled_prompts_as_text(test_client, mock_lm_studio_urls, monkeypatch):
+    from src.config import settings
+    # Both requests are read through the spool, and their prompts spilled.
+    monkeypatch.setattr(settings, "LARGE_PAYLOAD_BYTES", 16)
+    monkeypatch.setattr(settings, "SPILL_STRING_BYTES", 16)
+    system, first_prompt, second_prompt = "S" * 40, "P" * 40 + " \u00e9", "Q" * 40
+    with respx.mock as mocker:
+        route = mocker.post(mock_lm_studio_urls["chat_url"])
+        route.side_effect = [Response(200, json=completion("one")), Response(200, json=completion("two"))]
+        first = test_client.post("/api/generate", json={
+            "model": "m", "system": system, "prompt": first_prompt, "stream": False})
+        test_client.post("/api/generate", json={
+            "model": "m", "prompt": second_prompt, "context": first.json()["context"], "stream": False})
+
+    second_sent = json.loads(route.calls[1].request.content)["messages"]
+    assert second_sent == [
+        {"role": "system", "content": system},
+        {"role": "user", "content": [{"type": "text", "text": first_prompt}]},
+        {"role": "assistant", "content": "one"},
+        {"role": "user", "content": [{"type": "text", "text": second_prompt}]},
+    ]
+
+def test_generate_stream_final_chunk_carries_context(test_client, mock_lm_studio_urls):
+    chunks = ['data: {"choices":[{"delta":{"content":"Hi"}}]}\n\n', "data: [DONE]\n\n"]
+    with respx.mock as mocker:
+        mocker.post(mock_lm_studio_urls["chat_url"]).mock(
+            return_value=Response(200, content="".join(chunks).encode(), headers={"Content-Type": "text/event-stream"}))
+        response = test_client.post("/api/generate", json={"model": "m", "prompt": "Hello", "stream": True})
+    final = json.loads(response.text.strip().splitlines()[-1])
+    assert final["done"] is True
+    assert decode_handle(final["context"]) is not None
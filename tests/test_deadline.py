@@ -0,0 +1,134 @@
+import asyncio
+import json
+import time
+
+import httpx
+import respx
+
+from src.config import settings
+from src.deadline import request_deadline
+from src.utils import stream_translator
+
+# --- Helpers ---
+
+def sse_event(delta: dict) -> bytes:
+    return b"data: " + json.dumps({"choices": [{"delta": delta}]}).encode() + b"\n\n"
+
+class StallingStream:
+    """An upstream stream that sends 'events' (every 'interval' s, forever if 'repeat') and then hangs."""
+    def __init__(self, events, interval: float = 0.0, repeat: bool = False):
+        self.events = events
+        self.interval = interval
+        self.repeat = repeat
+        self.closed = False
+
+    async def aiter_bytes(self):
+        while True:
+            for event in self.events:
+                yield event
+                await asyncio.sleep(self.interval)
+            if not self.repeat:
+                break
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        self.closed = True
+
+async def collect(agen):
+    return [line async for line in agen]
+
+def translate(stream, **limits):
+    async def run():
+        if "deadline" in limits:
+            limits["deadline"] += asyncio.get_running_loop().time()
+        started = time.monotonic()
+        lines = await asyncio.wait_for(collect(stream_translator(stream, "chat", "m", **limits)), 5)
+        return [json.loads(line) for line in lines], time.monotonic() - started
+    return asyncio.run(run())
+
+# --- Unit Tests for src.deadline ---
+
+def test_request_deadline_from_header_capped_by_default():
+    async def timeout_for(headers, default):
+        deadline = request_deadline(headers, default)
+        return None if deadline is None else round(deadline - asyncio.get_running_loop().time())
+
+    assert asyncio.run(timeout_for({}, 0)) is None
+    assert asyncio.run(timeout_for({}, 60)) == 60
+    assert asyncio.run(timeout_for({"x-request-timeout": "10"}, 0)) == 10
+    assert asyncio.run(timeout_for({"x-request-timeout": "10"}, 60)) == 10
+    # A client cannot extend the configured deadline, and nonsense is ignored.
+    assert asyncio.run(timeout_for({"x-request-timeout": "600"}, 60)) == 60
+    assert asyncio.run(timeout_for({"x-request-timeout": "soon"}, 60)) == 60
+
+# --- Unit Tests for the stream translator's timeouts ---
+
+def test_stalled_stream_ends_with_error_after_idle_timeout():
+    stream = StallingStream([sse_event({"content": "Hi"})])
+    chunks, elapsed = translate(stream, idle_timeout=0.1)
+
+    assert chunks[0]["message"]["content"] == "Hi"
+    assert chunks[-1]["done"] is True
+    assert "idle timeout" in chunks[-1]["error"]
+    assert stream.closed
+    assert 0.1 <= elapsed < 1.0
+
+def test_first_token_timeout_ignores_role_only_deltas():
+    # Reasoning counts as output, so this stream is not cut off early...
+    stream = StallingStream([sse_event({"role": "assistant"}), sse_event({"reasoning_content": "Hmm"})], 0.05)
+    chunks, _ = translate(stream, first_token_timeout=0.5, idle_timeout=0.1)
+    assert "idle timeout" in chunks[-1]["error"]
+
+    # ...while one that only announced its role is.
+    stream = StallingStream([sse_event({"role": "assistant"})])
+    chunks, elapsed = translate(stream, first_token_timeout=0.1, idle_timeout=10)
+    assert chunks == [chunks[-1]]
+    assert "first-token timeout" in chunks[-1]["error"]
+    assert elapsed < 1.0
+
+def test_deadline_cuts_off_a_stream_that_is_still_generating():
+    stream = StallingStream([sse_event({"content": "tok "})], 0.01, repeat=True)
+    chunks, elapsed = translate(stream, deadline=0.2, idle_timeout=10)
+
+    assert len(chunks) > 5
+    assert chunks[-1] == {"error": "Request deadline exceeded", "done": True}
+    assert stream.closed
+    assert elapsed < 1.0
+
+# --- Integration Tests (routes) ---
+
+def test_non_streaming_request_gets_504_at_its_deadline(test_client, mock_lm_studio_urls, monkeypatch):
+    monkeypatch.setattr(settings, "UPSTREAM_RETRIES", 0)
+
+    async def never_answers(request):
+        await asyncio.sleep(30)
+        return httpx.Response(200, json={})
+
+    with respx.mock as mocker:
+        mocker.post(mock_lm_studio_urls["chat_url"]).mock(side_effect=never_answers)
+        started = time.monotonic()
+        response = test_client.post(
+            "/api/chat",
+            json={"model": "m", "messages": [{"role": "user", "content": "Hi"}], "stream": False},
+            headers={"X-Request-Timeout": "0.2"}
+        )
+
+    assert response.status_code == 504
+    assert response.json() == {"error": "Request deadline exceeded"}
+    assert time.monotonic() - started < 5
+    assert 'reason="deadline"' in test_client.get("/metrics").text
+
+def test_stream_without_response_headers_hits_the_first_token_timeout(test_client, mock_lm_studio_urls, monkeypatch):
+    monkeypatch.setattr(settings, "FIRST_TOKEN_TIMEOUT", 0.2)
+
+    async def never_answers(request):
+        await asyncio.sleep(30)
+
+    with respx.mock as mocker:
+        mocker.post(mock_lm_studio_urls["chat_url"]).mock(side_effect=never_answers)
+        response = test_client.post(
+            "/api/chat", json={"model": "m", "messages": [{"role": "user", "content": "Hi"}], "stream": True}
+        )
+
+    assert response.status_code == 504
+    assert "first-token timeout" in response.json()["error"]
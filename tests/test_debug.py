@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+
+from src.config import settings
+from src.profiling import ProfilerBusy, SamplingProfiler, collapsed_stacks
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+# --- Unit Tests for src.profiling ---
+
+def test_sampling_profiler_collapses_stacks_of_target_thread():
+    profiler = SamplingProfiler(interval=0.002)
+    worker = threading.Thread(target=busy_wait, args=(0.3,))
+    worker.start()
+
+    async def run():
+        profile = asyncio.create_task(profiler.profile(0.15, thread_id=worker.ident))
+        await asyncio.sleep(0)
+        with_busy = None
+        try:
+            await profiler.profile(0.01)
+        except ProfilerBusy as e:
+            with_busy = e
+        return await profile, with_busy
+
+    stacks, busy = asyncio.run(run())
+    worker.join()
+    assert busy is not None
+    assert sum(stacks.values()) > 10
+    top_stack = stacks.most_common(1)[0][0]
+    assert top_stack.split(";")[-1].startswith("busy_wait (tests/test_debug.py:")
+    lines = collapsed_stacks(stacks).splitlines()
+    assert lines[0].rsplit(" ", 1) == [top_stack, str(stacks[top_stack])]
+
+# --- Integration Tests (routes) ---
+
+def test_debug_endpoints_are_opt_in(test_client, monkeypatch):
+    monkeypatch.setattr(settings, "DEBUG_ENDPOINTS_ENABLED", False)
+    assert test_client.get("/debug/profile?seconds=0").status_code == 404
+    assert test_client.get("/debug/memory?seconds=0").status_code == 404
+
+def test_debug_profile_and_memory(test_client, monkeypatch):
+    monkeypatch.setattr(settings, "DEBUG_ENDPOINTS_ENABLED", True)
+
+    profile = test_client.get("/debug/profile?seconds=0.1")
+    assert profile.status_code == 200
+    assert int(profile.headers["X-Profile-Samples"]) > 0
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in profile.text.splitlines())
+
+    memory = test_client.get("/debug/memory?seconds=0.05&limit=5&types=3")
+    assert memory.status_code == 200
+    report = memory.json()
+    assert report["window_seconds"] == 0.05
+    assert len(report["top_allocators"]) <= 5
+    assert len(report["object_types"]) == 3
+    assert isinstance(report["live_requests"], dict)
@@ -0,0 +1,110 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+import uvicorn
+
+import src.utils
+from src.backends import Backend, BackendPool
+from src.main import app
+from src.metrics import CANCELLATIONS
+
+# --- Client-disconnect tests against a real server and a fake backend ---
+
+# How long after the client leaves the backend must see its connection close.
+CLOSE_BOUND = 2.0
+
+class _FakeBackend(BaseHTTPRequestHandler):
+    """Generates forever: a token every 20 ms (streaming) or never answers (non-streaming)."""
+    protocol_version = "HTTP/1.1"
+    closed_at = None
+    requests = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).requests += 1
+        try:
+            if body.get("stream"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                while True:
+                    self.wfile.write(b'data: {"choices": [{"delta": {"content": "tok "}}]}\n\n')
+                    self.wfile.flush()
+                    time.sleep(0.02)
+            else:
+                # Still "thinking"; watch for the shim hanging up.
+                while self.connection.recv(1, socket.MSG_PEEK) != b"":
+                    pass
+                raise ConnectionResetError()
+        except (BrokenPipeError, ConnectionResetError):
+            type(self).closed_at = time.monotonic()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def shim_with_fake_backend(monkeypatch):
+    _FakeBackend.closed_at = None
+    _FakeBackend.requests = 0
+    backend_server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeBackend)
+    backend_server.daemon_threads = True
+    threading.Thread(target=backend_server.serve_forever, daemon=True).start()
+    backend_url = f"http://127.0.0.1:{backend_server.server_address[1]}"
+    monkeypatch.setattr(src.utils, "backend_pool", BackendPool([Backend(backend_url)]))
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    server.should_exit = True
+    thread.join(5)
+    backend_server.shutdown()
+    backend_server.server_close()
+
+def cancellations(phase: str) -> float:
+    return sum(child.value for labels, child in CANCELLATIONS._children.items() if labels[-1] == phase)
+
+def wait_for_close(left_at: float) -> float:
+    while _FakeBackend.closed_at is None and time.monotonic() - left_at < CLOSE_BOUND * 2:
+        time.sleep(0.01)
+    assert _FakeBackend.closed_at is not None, "backend connection was never closed"
+    return _FakeBackend.closed_at - left_at
+
+def test_stream_disconnect_closes_upstream(shim_with_fake_backend):
+    before = cancellations("stream")
+    with httpx.Client(base_url=shim_with_fake_backend) as client:
+        with client.stream("POST", "/api/chat", json={
+            "model": "m", "stream": True, "messages": [{"role": "user", "content": "hi"}]
+        }) as response:
+            lines = response.iter_lines()
+            assert "tok" in next(lines)
+    left_at = time.monotonic()
+
+    assert wait_for_close(left_at) < CLOSE_BOUND
+    deadline = time.monotonic() + CLOSE_BOUND
+    while cancellations("stream") == before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cancellations("stream") == before + 1
+
+def test_non_streaming_disconnect_cancels_upstream(shim_with_fake_backend):
+    before = cancellations("response")
+    with httpx.Client(base_url=shim_with_fake_backend, timeout=0.5) as client:
+        with pytest.raises(httpx.ReadTimeout):
+            client.post("/api/generate", json={"model": "m", "prompt": "hi", "stream": False})
+    left_at = time.monotonic()
+
+    assert _FakeBackend.requests == 1
+    assert wait_for_close(left_at) < CLOSE_BOUND
+    deadline = time.monotonic() + CLOSE_BOUND
+    while cancellations("response") == before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cancellations("response") == before + 1
@@ -0,0 +1,103 @@
+import asyncio
+import json
+from array import array
+
+import pytest
+import respx
+from httpx import Response
+
+import src.utils
+from src.embeddings import EmbeddingBatcher, VectorCache, embedding_key
+
+# --- Unit Tests for src.embeddings ---
+
+def fake_vector(text: str) -> list:
+    return [float(len(text)), 0.5]
+
+def make_batcher(**kwargs):
+    calls = []
+
+    async def send_batch(model, dimensions, texts):
+        calls.append(list(texts))
+        await asyncio.sleep(0)
+        return [fake_vector(text) for text in texts]
+
+    return EmbeddingBatcher(send_batch, **kwargs), calls
+
+def test_concurrent_requests_share_one_upstream_call():
+    batcher, calls = make_batcher(max_inputs=64, max_delay=0.01)
+
+    async def run():
+        return await asyncio.gather(*(batcher.embed("m", [text]) for text in ["a", "bb", "ccc"]))
+
+    results = asyncio.run(run())
+    assert calls == [["a", "bb", "ccc"]]
+    assert [r[0].tolist() for r in results] == [[1.0, 0.5], [2.0, 0.5], [3.0, 0.5]]
+
+def test_batch_is_sent_early_when_full_and_split_by_size():
+    batcher, calls = make_batcher(max_inputs=2, max_delay=10.0)
+    texts = ["a", "b", "c", "d", "e"]
+    vectors = asyncio.run(batcher.embed("m", texts))
+    assert calls == [["a", "b"], ["c", "d"], ["e"]]
+    assert len(vectors) == 5
+
+def test_cached_and_duplicate_texts_are_not_sent_again():
+    batcher, calls = make_batcher(max_delay=0.0, cache=VectorCache())
+    asyncio.run(batcher.embed("m", ["same", "same", "other"]))
+    asyncio.run(batcher.embed("m", ["same", "new"]))
+    assert calls == [["same", "other"], ["new"]]
+    assert batcher.cache.hits == 1
+
+def test_batch_failure_reaches_every_caller():
+    async def send_batch(model, dimensions, texts):
+        raise RuntimeError("backend down")
+
+    batcher = EmbeddingBatcher(send_batch, max_delay=0.01)
+
+    async def run():
+        return await asyncio.gather(batcher.embed("m", ["a"]), batcher.embed("m", ["b"]), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+def test_vector_cache_stores_float32_and_evicts_by_bytes():
+    cache = VectorCache(max_entries=10, max_bytes=16)
+    cache.put(b"a", array("f", [1.0, 2.0]))
+    cache.put(b"b", array("f", [3.0, 4.0]))
+    cache.put(b"c", array("f", [5.0, 6.0]))
+    assert cache.get(b"a") is None
+    assert cache.get(b"c").itemsize == 4
+    assert cache.stats()["bytes"] == 16
+    assert embedding_key("m", None, "x") != embedding_key("m", 256, "x")
+
+# --- /api/embed and /api/embeddings ---
+
+@pytest.fixture
+def fresh_batcher(monkeypatch):
+    batcher = EmbeddingBatcher(src.utils.post_embeddings, max_delay=0.005, cache=VectorCache())
+    monkeypatch.setattr(src.utils, "embedding_batcher", batcher)
+    monkeypatch.setattr("src.routes.embeddings.embedding_batcher", batcher)
+    return batcher
+
+def embeddings_response(request):
+    texts = json.loads(request.content)["input"]
+    return Response(200, json={"object": "list", "data": [
+        {"object": "embedding", "index": i, "embedding": [0.25 * (i + 1), 1.0]} for i, _ in enumerate(texts)]})
+
+def test_embed_endpoint_translates_to_openai(test_client, fresh_batcher):
+    embeddings_url = src.utils.backend_pool.primary.embeddings_url
+    with respx.mock as mocker:
+        route = mocker.post(embeddings_url).mock(side_effect=embeddings_response)
+        response = test_client.post("/api/embed", json={"model": "nomic", "input": ["one", "two"]})
+        legacy = test_client.post("/api/embeddings", json={"model": "nomic", "prompt": "one"})
+
+    assert response.status_code == 200
+    assert response.json()["embeddings"] == [[0.25, 1.0], [0.5, 1.0]]
+    assert json.loads(route.calls[0].request.content) == {"model": "nomic", "input": ["one", "two"]}
+    # Served from the vector cache.
+    assert legacy.json() == {"embedding": [0.25, 1.0]}
+    assert route.call_count == 1
+
+def test_embed_rejects_non_string_input(test_client, fresh_batcher):
+    response = test_client.post("/api/embed", json={"model": "nomic", "input": [1, 2]})
+    assert response.status_code == 400
@@ -0,0 +1,83 @@
+import asyncio
+import base64
+import io
+import json
+
+import pytest
+
+import src.images
+from src.images import ImagePreprocessor, sniff_image_mime, image_data_url, preprocess_image
+from src.ingest import SpillingJSONReader
+
+# --- Unit Tests for src.images ---
+
+PNG_HEADER = base64.b64encode(b"\x89PNG\r\n\x1a\n" + b"\x00" * 16).decode()
+JPEG_HEADER = base64.b64encode(b"\xff\xd8\xff\xe0" + b"\x00" * 16).decode()
+WEBP_HEADER = base64.b64encode(b"RIFF\x00\x00\x00\x00WEBPVP8 ").decode()
+
+def make_image(fmt: str, size: tuple, mode: str = "RGB") -> str:
+    Image = pytest.importorskip("PIL.Image")
+    out = io.BytesIO()
+    Image.new(mode, size, color=(200, 30, 30) if mode == "RGB" else (200, 30, 30, 128)).save(out, format=fmt)
+    return base64.b64encode(out.getvalue()).decode()
+
+def test_sniff_mime_from_magic_bytes():
+    assert sniff_image_mime(PNG_HEADER) == "image/png"
+    assert sniff_image_mime(JPEG_HEADER) == "image/jpeg"
+    assert sniff_image_mime(WEBP_HEADER.encode()) == "image/webp"
+    assert sniff_image_mime("not an image") is None
+
+def test_data_urls_pass_through_and_bare_base64_is_png():
+    assert image_data_url("data:image/jpeg;base64,AAAA") == "data:image/jpeg;base64,AAAA"
+    assert image_data_url("AAAA") == "data:image/png;base64,AAAA"
+
+def test_disabled_stage_leaves_images_alone():
+    images = [JPEG_HEADER]
+    assert asyncio.run(ImagePreprocessor(enabled=False).prepare_images(images)) is images
+
+def test_without_pillow_images_are_relabelled(monkeypatch):
+    monkeypatch.setattr(src.images, "Image", None)
+    prepared = asyncio.run(ImagePreprocessor(enabled=True).prepare_images([JPEG_HEADER, "AAAA"]))
+    assert prepared == [f"data:image/jpeg;base64,{JPEG_HEADER}", "data:image/png;base64,AAAA"]
+
+def test_without_pillow_spilled_images_keep_their_placeholder(monkeypatch):
+    monkeypatch.setattr(src.images, "Image", None)
+    reader = SpillingJSONReader(spill_threshold=8, max_memory=1024)
+    reader.feed(json.dumps({"images": [JPEG_HEADER]}).encode())
+    data, spool = reader.finish()
+    prepared = asyncio.run(ImagePreprocessor(enabled=True).prepare_images(data["images"], spool))
+    assert prepared == [f"data:image/jpeg;base64,{data['images'][0]}"]
+    spool.close()
+
+def test_oversized_image_is_downsampled():
+    Image = pytest.importorskip("PIL.Image")
+    original = make_image("PNG", (800, 400))
+    mime, data = preprocess_image(original.encode(), max_edge=200, max_pixels=0, quality=80)
+    assert mime == "image/jpeg"
+    with Image.open(io.BytesIO(base64.b64decode(data))) as image:
+        assert image.size == (200, 100)
+
+def test_pixel_budget_and_alpha_are_respected():
+    Image = pytest.importorskip("PIL.Image")
+    original = make_image("PNG", (400, 400), mode="RGBA")
+    mime, data = preprocess_image(original.encode(), max_edge=0, max_pixels=10_000, quality=80)
+    assert mime == "image/png"
+    with Image.open(io.BytesIO(base64.b64decode(data))) as image:
+        assert image.size == (100, 100)
+        assert image.mode == "RGBA"
+
+def test_small_supported_image_is_forwarded_unchanged():
+    original = make_image("JPEG", (64, 64))
+    assert preprocess_image(original.encode(), max_edge=1568, max_pixels=0, quality=80) is None
+
+def test_preprocessor_caches_by_content_digest():
+    original = make_image("PNG", (600, 300))
+    preprocessor = ImagePreprocessor(enabled=True, max_edge=100, workers=1)
+    try:
+        first = asyncio.run(preprocessor.prepare_images([original]))
+        second = asyncio.run(preprocessor.prepare_images([original]))
+    finally:
+        preprocessor.shutdown()
+    assert first == second
+    assert first[0].startswith("data:image/jpeg;base64,")
+    assert (preprocessor.hits, preprocessor.misses, preprocessor.resized) == (1, 1, 1)
@@ -0,0 +1,107 @@
+import asyncio
+import base64
+import json
+import random
+
+import respx
+from httpx import Response
+
+from src.ingest import SpillingJSONReader, is_spilled, read_request_json, upstream_body_kwargs
+
+# --- Unit Tests for src.ingest ---
+
+IMAGE_B64 = base64.b64encode(bytes(range(256)) * 400).decode("ascii")
+
+def read_in_chunks(body: bytes, max_chunk: int, seed: int = 0, spill_threshold: int = 1024):
+    reader = SpillingJSONReader(spill_threshold=spill_threshold, max_memory=4096)
+    rng = random.Random(seed)
+    i = 0
+    while i < len(body):
+        step = rng.randint(1, max_chunk)
+        reader.feed(body[i:i + step])
+        i += step
+    return reader.finish()
+
+async def collect(body) -> bytes:
+    return b"".join([part async for part in body])
+
+def test_long_strings_are_spilled_and_short_ones_kept():
+    document = {"model": "m", "prompt": "what is this?", "images": [IMAGE_B64, IMAGE_B64[:100]]}
+    data, spool = read_in_chunks(json.dumps(document).encode(), max_chunk=4096)
+    try:
+        assert data["prompt"] == "what is this?"
+        assert is_spilled(data["images"][0])
+        assert data["images"][1] == IMAGE_B64[:100]
+        assert spool.read_all(0) == IMAGE_B64.encode()
+    finally:
+        spool.close()
+
+def test_small_document_has_no_spool():
+    data, spool = read_in_chunks(b'{"model": "m", "stream": false}', max_chunk=3)
+    assert data == {"model": "m", "stream": False}
+    assert spool is None
+
+def test_escapes_survive_random_chunk_boundaries():
+    text = 'quote " backslash \\ both \\" unicode é☃ ' * 200
+    document = {"messages": [{"role": "user", "content": text}, {"role": "user", "content": 'tail\\'}]}
+    body = json.dumps(document).encode()
+    for seed in range(20):
+        data, spool = read_in_chunks(body, max_chunk=7, seed=seed)
+        assert is_spilled(data["messages"][0]["content"])
+        assert data["messages"][1]["content"] == "tail\\"
+        spilled = json.loads(b'"' + spool.read_all(0) + b'"')
+        assert spilled == text
+        spool.close()
+
+def test_spliced_body_matches_regular_serialization():
+    document = {"model": "m", "images": [IMAGE_B64, IMAGE_B64[::-1]]}
+    data, spool = read_in_chunks(json.dumps(document).encode(), max_chunk=999)
+    payload = {"model": data["model"], "messages": [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img}"}} for img in data["images"]
+    ]}]}
+    kwargs = upstream_body_kwargs(payload, spool)
+    body = asyncio.run(collect(kwargs["content"]))
+    # Re-iterable, e.g. for a retried request.
+    assert asyncio.run(collect(kwargs["content"])) == body
+    assert int(kwargs["headers"]["Content-Length"]) == len(body)
+    urls = [part["image_url"]["url"] for part in json.loads(body)["messages"][0]["content"]]
+    assert urls == [f"data:image/png;base64,{IMAGE_B64}", f"data:image/png;base64,{IMAGE_B64[::-1]}"]
+    spool.close()
+
+def test_spilled_placeholders_differ_by_content():
+    first, spool_a = read_in_chunks(json.dumps({"images": [IMAGE_B64]}).encode(), max_chunk=4096)
+    second, spool_b = read_in_chunks(json.dumps({"images": [IMAGE_B64[::-1]]}).encode(), max_chunk=4096)
+    assert first["images"][0] != second["images"][0]
+    spool_a.close()
+    spool_b.close()
+
+def test_large_generate_request_streams_images_upstream(test_client, mock_lm_studio_urls, monkeypatch):
+    from src.config import settings
+    monkeypatch.setattr(settings, "LARGE_PAYLOAD_BYTES", 1024)
+    monkeypatch.setattr(settings, "SPILL_STRING_BYTES", 1024)
+    chat_url = mock_lm_studio_urls["chat_url"]
+    answer = {"model": "m", "choices": [{"message": {"role": "assistant", "content": "a cat"}}]}
+
+    with respx.mock as mocker:
+        route = mocker.post(chat_url).mock(return_value=Response(200, json=answer))
+        response = test_client.post("/api/generate", json={
+            "model": "m", "prompt": "describe", "images": [IMAGE_B64], "stream": False
+        })
+
+    assert response.status_code == 200
+    assert response.json()["response"] == "a cat"
+    sent = json.loads(route.calls.last.request.content)
+    assert sent["messages"][0]["content"][1]["image_url"]["url"] == f"data:image/png;base64,{IMAGE_B64}"
+
+def test_malformed_content_length_is_read_as_unsized_body():
+    body = json.dumps({"model": "m", "prompt": "hi"}).encode()
+
+    class FakeRequest:
+        headers = {"content-length": "not-a-number"}
+
+        async def stream(self):
+            yield body
+
+    data, spool = asyncio.run(read_request_json(FakeRequest()))
+    assert data == {"model": "m", "prompt": "hi"}
+    assert spool is None
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import threading
+
+from src.logs import LogPipeline, LogSamplingMiddleware, Redacted, redact, _request_sampled
+
+class ListHandler(logging.Handler):
+    """Collects (thread name, message) for every record it writes."""
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((threading.current_thread().name, self.format(record)))
+
+def make_logger(name, level=logging.DEBUG):
+    logger = logging.getLogger(f"test_logs.{name}")
+    logger.propagate = False
+    logger.setLevel(level)
+    return logger
+
+# --- Unit Tests for src.logs ---
+
+def test_redact_summarizes_images_and_truncates_strings():
+    image = "iVBORw0KGgo" * 1000
+    payload = {
+        "model": "m",
+        "prompt": "x" * 300,
+        "images": [image],
+        "messages": [{"role": "user", "content": [
+            {"type": "text", "text": "What is this?"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64," + image}},
+        ]}],
+        "raw": "QUJD" * 400,
+        "spilled": "\x00spill:0:abc\x00",
+        "options": {"temperature": 0},
+    }
+    redacted = redact(payload, max_chars=10)
+
+    assert redacted["images"] == ["<image: 8.1 KB, 11000 base64 chars>"]
+    assert redacted["messages"][0]["content"][1]["image_url"]["url"] == "<data URL image/png: 8.1 KB, 11000 base64 chars>"
+    assert redacted["messages"][0]["content"][0]["text"] == "What is this?"[:10] + "... (+3 chars)"
+    assert redacted["prompt"] == "x" * 10 + "... (+290 chars)"
+    assert redacted["raw"].startswith("<base64: ")
+    assert redacted["spilled"] == "<spilled string>"
+    assert redacted["options"] == {"temperature": 0}
+    # The payload itself is left alone.
+    assert payload["images"] == [image]
+
+def test_redacted_is_only_rendered_when_emitted():
+    rendered = []
+
+    class Spy(Redacted):
+        __slots__ = ()
+        def __str__(self):
+            rendered.append(1)
+            return super().__str__()
+
+    logger = make_logger("lazy", level=logging.INFO)
+    handler = ListHandler()
+    logger.addHandler(handler)
+    logger.debug("Payload: %s", Spy({"images": ["QUJD" * 1000]}))
+    assert rendered == []
+    logger.info("Payload: %s", Spy({"images": ["QUJD" * 1000]}))
+    logger.removeHandler(handler)
+    assert rendered == [1]
+    assert json.loads(handler.records[0][1][len("Payload: "):]) == {"images": ["<image: 2.9 KB, 4000 base64 chars>"]}
+
+def test_pipeline_writes_on_its_thread_and_restores_handlers():
+    logger = make_logger("pipeline")
+    handler = ListHandler()
+    logger.addHandler(handler)
+    pipeline = LogPipeline(max_queue=100)
+
+    pipeline.attach(logger)
+    assert handler not in logger.handlers
+    for i in range(20):
+        logger.info("line %d", i)
+    pipeline.detach(logger)
+
+    assert logger.handlers == [handler]
+    assert [message for _, message in handler.records] == [f"line {i}" for i in range(20)]
+    assert {thread for thread, _ in handler.records} == {"shim-log-writer"}
+
+def test_pipeline_drops_instead_of_blocking_when_full():
+    release = threading.Event()
+
+    class BlockingHandler(ListHandler):
+        def emit(self, record):
+            release.wait(5)
+            super().emit(record)
+
+    logger = make_logger("full")
+    handler = BlockingHandler()
+    pipeline = LogPipeline(max_queue=2)
+    pipeline.attach(logger, [handler])
+    for i in range(10):
+        logger.warning("line %d", i)
+    release.set()
+    pipeline.detach(logger)
+
+    assert pipeline.dropped > 0
+    assert len(handler.records) + pipeline.dropped == 10
+
+def test_unsampled_requests_keep_only_warnings():
+    logger = make_logger("sampling")
+    handler = ListHandler()
+    pipeline = LogPipeline()
+    pipeline.attach(logger, [handler])
+    token = _request_sampled.set(False)
+    try:
+        logger.info("dropped")
+        logger.warning("kept")
+    finally:
+        _request_sampled.reset(token)
+    logger.info("outside a request")
+    pipeline.detach(logger)
+    assert [message for _, message in handler.records] == ["kept", "outside a request"]
+
+def test_sampling_middleware_decides_per_request():
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(_request_sampled.get())
+
+    async def run(rate):
+        middleware = LogSamplingMiddleware(app, rate=lambda: rate)
+        for _ in range(50):
+            await middleware({"type": "http"}, None, None)
+
+    asyncio.run(run(0.0))
+    assert seen == [False] * 50
+    seen.clear()
+    asyncio.run(run(1.0))
+    assert seen == [True] * 50
+    assert _request_sampled.get() is True
@@ -0,0 +1,55 @@
+import respx
+from httpx import Response
+
+from src.utils import sniff_model
+from src.backends import backend_pool
+
+SSE_BODY = (
+    b'data: {"id":"1","choices":[{"delta":{"content":"Hi"}}]}\n\n'
+    b'data: {"id":"2","choices":[{"delta":{},"finish_reason":"stop"}]}\n\n'
+    b'data: [DONE]\n\n'
+)
+
+# --- Unit Tests ---
+
+def test_sniff_model_without_parsing():
+    assert sniff_model(b'{"model": "qwen/qwen3-8b", "messages": []}') == "qwen/qwen3-8b"
+    assert sniff_model(b'{"messages":[],"model":"m"}') == "m"
+    assert sniff_model(b'{"messages": []}') is None
+    # Past the searched prefix (e.g. behind image data) the model is not looked for.
+    assert sniff_model(b'{"messages": "' + b"A" * 8192 + b'", "model": "m"}') is None
+
+# --- Integration Tests (routes) ---
+
+def test_chat_completions_stream_is_relayed_byte_for_byte(test_client, mock_lm_studio_urls):
+    # Odd spacing and key order survive, so the body was not re-serialized.
+    request_body = b'{"model":"m",  "stream": true, "messages":[{"role":"user","content":"Hi \\u00e9"}]}'
+    with respx.mock as mocker:
+        route = mocker.post(mock_lm_studio_urls["chat_url"]).mock(
+            return_value=Response(200, content=SSE_BODY, headers={"Content-Type": "text/event-stream"})
+        )
+        with test_client.stream("POST", "/v1/chat/completions", content=request_body,
+                                headers={"Content-Type": "application/json"}) as response:
+            relayed = b"".join(response.iter_raw())
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/event-stream"
+    assert relayed == SSE_BODY
+    assert route.calls[0].request.content == request_body
+    assert backend_pool.primary.in_flight == 0
+
+    metrics = test_client.get("/metrics").text
+    labels = 'route="/v1/chat/completions",model="m",backend="http://localhost:1234"'
+    assert f"ollama_shim_requests_total{{{labels}}} 1.0" in metrics
+    assert f"ollama_shim_time_to_first_token_seconds_count{{{labels}}} 1" in metrics
+
+def test_chat_completions_relays_client_errors_as_they_are(test_client, mock_lm_studio_urls):
+    error_body = b'{"error":{"message":"model not loaded"}}'
+    with respx.mock as mocker:
+        mocker.post(mock_lm_studio_urls["chat_url"]).mock(
+            return_value=Response(404, content=error_body, headers={"Content-Type": "application/json"})
+        )
+        response = test_client.post("/v1/chat/completions", content=b'{"model":"missing","messages":[]}')
+
+    assert response.status_code == 404
+    assert response.content == error_body
@@ -0,0 +1,125 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+import respx
+from httpx import Response
+
+from src.retry import RetryBudget, RetryPolicy, hedging_requested, is_retryable
+
+CHAT_RESPONSE = {"model": "m", "choices": [{"index": 0, "message": {"role": "assistant", "content": "Hi."}}]}
+STREAM_BODY = (
+    'data: {"choices":[{"delta":{"content":"Hi."}}]}\n\n'
+    'data: {"choices":[{"delta":{},"finish_reason":"stop"}]}\n\n'
+    'data: [DONE]\n\n'
+)
+
+def status_error(code: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://lm/v1/chat/completions")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(code, request=request))
+
+# --- Unit Tests for src.retry ---
+
+def test_only_connect_errors_and_5xx_are_retryable():
+    assert is_retryable(status_error(503))
+    assert is_retryable(httpx.ConnectError("refused"))
+    assert not is_retryable(status_error(400))
+    assert not is_retryable(httpx.ReadTimeout("slow"))
+    assert hedging_requested({"x-hedge": "on"}, False)
+    assert not hedging_requested({"x-hedge": "off"}, True)
+    assert hedging_requested({}, True)
+
+def test_retries_until_success_on_other_backends():
+    policy = RetryPolicy(retries=2, backoff_base=0.001)
+    seen = []
+
+    async def attempt(tried):
+        seen.append(set(tried))
+        tried.add(f"backend-{len(seen)}")
+        if len(seen) < 3:
+            raise status_error(502)
+        return "ok"
+
+    assert asyncio.run(policy.call(attempt)) == "ok"
+    # Each retry knows which backends were already tried.
+    assert seen == [set(), {"backend-1"}, {"backend-1", "backend-2"}]
+
+def test_client_errors_and_exhausted_budget_are_not_retried():
+    calls = []
+
+    async def attempt(tried):
+        calls.append(1)
+        raise status_error(404) if len(calls) == 1 else httpx.ConnectError("refused")
+
+    policy = RetryPolicy(retries=3, backoff_base=0.001)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(policy.call(attempt))
+    assert len(calls) == 1
+
+    # One token in the bucket and no refill: one retry, then give up.
+    policy.budget = RetryBudget(ratio=0.0, min_per_second=0.0, capacity=1.0)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(policy.call(attempt))
+    assert len(calls) == 3
+
+def test_slow_request_is_hedged_and_loser_cancelled():
+    policy = RetryPolicy(hedge_min_delay=0.01, hedge_min_samples=5)
+    for _ in range(5):
+        policy.observe("m", 0.02)
+    assert policy.hedge_delay("m") == 0.02
+    assert policy.hedge_delay("other") is None
+    cancelled = []
+
+    async def attempt(tried):
+        first = not tried
+        tried.add("primary" if first else "hedge")
+        try:
+            await asyncio.sleep(10 if first else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append("primary" if first else "hedge")
+            raise
+        return "hedge answer"
+
+    async def run():
+        result = await policy.call(attempt, model="m", hedge=True, has_alternative=lambda tried: True)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "hedge answer"
+    assert cancelled == ["primary"]
+
+    # Without another backend to send it to, nothing is duplicated.
+    async def fast(tried):
+        tried.add("only")
+        await asyncio.sleep(0.05)
+        return "single"
+    assert asyncio.run(policy.call(fast, model="m", hedge=True, has_alternative=lambda tried: False)) == "single"
+
+# --- Integration Tests (routes) ---
+
+def test_chat_retries_5xx_before_answering(test_client, mock_lm_studio_urls):
+    with respx.mock as mocker:
+        route = mocker.post(mock_lm_studio_urls["chat_url"]).mock(side_effect=[
+            Response(503, text="model is loading"),
+            Response(200, json=CHAT_RESPONSE),
+        ])
+        response = test_client.post("/api/chat", json={"model": "m", "stream": False, "messages": []})
+
+    assert response.status_code == 200
+    assert response.json()["message"]["content"] == "Hi."
+    assert route.call_count == 2
+
+def test_stream_retried_only_before_first_byte(test_client, mock_lm_studio_urls):
+    with respx.mock as mocker:
+        route = mocker.post(mock_lm_studio_urls["chat_url"]).mock(side_effect=[
+            httpx.ConnectError("refused"),
+            Response(200, text=STREAM_BODY, headers={"Content-Type": "text/event-stream"}),
+        ])
+        response = test_client.post("/api/chat", json={"model": "m", "stream": True, "messages": []})
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0]["message"]["content"] == "Hi."
+    assert lines[-1]["done"] is True
+    assert route.call_count == 2
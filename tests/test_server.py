@@ -0,0 +1,117 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from src.server import server_options, worker_count
+
+# --- Unit Tests for src.server ---
+
+def make_config(**overrides):
+    values = dict(
+        SHIM_HOST="127.0.0.1", SHIM_PORT=11434, LOG_LEVEL="INFO", SHIM_WORKERS=2,
+        SHIM_KEEPALIVE_TIMEOUT=7, SHIM_BACKLOG=512, SHIM_DRAIN_TIMEOUT=12, SHIM_ACCESS_LOG=False,
+    )
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+def test_production_options_drop_reload_and_set_tuning():
+    options = server_options("production", make_config())
+    assert "reload" not in options
+    assert options["workers"] == 2
+    assert options["timeout_keep_alive"] == 7
+    assert options["backlog"] == 512
+    assert options["timeout_graceful_shutdown"] == 12
+    assert options["access_log"] is False
+    assert options["loop"] in ("uvloop", "asyncio")
+    assert options["http"] in ("httptools", "h11")
+
+def test_development_options_reload_and_zero_workers_means_per_cpu():
+    assert server_options("development", make_config())["reload"] is True
+    assert worker_count(make_config(SHIM_WORKERS=0)) == (os.cpu_count() or 1)
+    with pytest.raises(ValueError):
+        server_options("staging", make_config())
+
+# --- SIGTERM draining against a real production-mode process ---
+
+class _SlowBackend(BaseHTTPRequestHandler):
+    """Streams 20 tokens, one every 50 ms."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"data": [{"id": "m"}]}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for _ in range(20):
+            self.wfile.write(b'data: {"choices": [{"delta": {"content": "tok "}}]}\n\n')
+            self.wfile.flush()
+            time.sleep(0.05)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+def test_sigterm_lets_in_flight_stream_finish():
+    backend = ThreadingHTTPServer(("127.0.0.1", 0), _SlowBackend)
+    backend.daemon_threads = True
+    threading.Thread(target=backend.serve_forever, daemon=True).start()
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, SHIM_PORT=str(port), SHIM_HOST="127.0.0.1", SHIM_DRAIN_TIMEOUT="10",
+               LM_STUDIO_BASE_URL=f"http://127.0.0.1:{backend.server_address[1]}", LM_STUDIO_BACKENDS="",
+               LOG_LEVEL="WARNING")
+    shim = subprocess.Popen([sys.executable, "-m", "src.main", "--mode", "production"], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                httpx.get(url + "/", timeout=1)
+                break
+            except httpx.HTTPError:
+                assert time.monotonic() < deadline and shim.poll() is None, "shim did not start"
+                time.sleep(0.1)
+
+        with httpx.Client(base_url=url, timeout=10) as client:
+            with client.stream("POST", "/api/chat", json={
+                "model": "m", "stream": True, "messages": [{"role": "user", "content": "hi"}]
+            }) as response:
+                lines = response.iter_lines()
+                assert "tok" in next(lines)
+                shim.send_signal(signal.SIGTERM)
+                time.sleep(0.3)
+                # No new connections while draining...
+                with pytest.raises(httpx.ConnectError):
+                    httpx.get(url + "/", timeout=1)
+                # ...but the stream that was already running completes.
+                rest = [json.loads(line) for line in lines if line]
+        assert rest[-1]["done"] is True
+        # uvicorn re-raises the signal once it has shut down cleanly.
+        assert shim.wait(10) in (0, -signal.SIGTERM)
+    finally:
+        if shim.poll() is None:
+            shim.kill()
+        backend.shutdown()
+        backend.server_close()
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import random
+import time
+
+from src.sse import SSEParser, aiter_sse_data
+from src.utils import stream_translator
+from src.ndjson import ChunkEncoder, CoarseClock
+from src.flush import FlushPolicy, flush_policy_for
+
+# --- Helpers ---
+
+TOKENS = ["Hello", ", ", "wörld", " ☕", " 日本語", "\n", " \"quoted\"", " 🦙", " done."]
+
+def build_sse_body(tokens, separator="\n"):
+    """Builds an OpenAI-style SSE body with one event per token."""
+    events = [
+        "data: " + json.dumps({"choices": [{"delta": {"content": token}}]}, ensure_ascii=False)
+        for token in tokens
+    ]
+    events.append("data: [DONE]")
+    return (separator * 2).join(events).encode("utf-8") + (separator * 2).encode()
+
+def split_randomly(body: bytes, rng: random.Random) -> list:
+    """Splits a byte string at random offsets, including inside codepoints."""
+    chunks = []
+    i = 0
+    while i < len(body):
+        step = rng.randint(1, 7)
+        chunks.append(body[i:i + step])
+        i += step
+    return chunks
+
+class FakeStream:
+    """Minimal stand-in for an httpx streaming response."""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    async def aiter_bytes(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def aclose(self):
+        self.closed = True
+
+async def collect(agen):
+    return [item async for item in agen]
+
+# --- Unit Tests for src.sse.SSEParser ---
+
+def test_sse_parser_single_event():
+    parser = SSEParser()
+    assert parser.feed(b'data: {"a": 1}\n\n') == ['{"a": 1}']
+
+def test_sse_parser_event_split_across_chunks():
+    parser = SSEParser()
+    assert parser.feed(b'data: {"a"') == []
+    assert parser.feed(b': 1}\n') == []
+    assert parser.feed(b'\n') == ['{"a": 1}']
+
+def test_sse_parser_multiline_data_and_comments():
+    parser = SSEParser()
+    events = parser.feed(b": keep-alive\nevent: message\ndata: line one\ndata:line two\n\n")
+    assert events == ["line one\nline two"]
+
+def test_sse_parser_crlf_split_between_chunks():
+    parser = SSEParser()
+    assert parser.feed(b"data: a\r") == []
+    assert parser.feed(b"\ndata: b\r\n\r\n") == ["a\nb"]
+
+def test_sse_parser_flushes_unterminated_event_on_close():
+    parser = SSEParser()
+    assert parser.feed(b"data: tail") == []
+    assert parser.close() == ["tail"]
+
+def test_sse_parser_random_chunk_boundaries():
+    """Every event survives arbitrary splits, including mid-codepoint ones."""
+    expected = [json.dumps({"choices": [{"delta": {"content": t}}]}, ensure_ascii=False) for t in TOKENS]
+    rng = random.Random(1234)
+    for separator in ("\n", "\r\n", "\r"):
+        body = build_sse_body(TOKENS, separator)
+        for _ in range(200):
+            chunks = split_randomly(body, rng)
+            events = asyncio.run(collect(aiter_sse_data(FakeStream(chunks).aiter_bytes())))
+            assert events == expected
+
+# --- Unit Tests for src.utils.stream_translator ---
+
+def test_stream_translator_generate_random_chunk_boundaries():
+    rng = random.Random(42)
+    body = build_sse_body(TOKENS)
+    for _ in range(50):
+        stream = FakeStream(split_randomly(body, rng))
+        lines = asyncio.run(collect(stream_translator(stream, "generate", "test-model")))
+        chunks = [json.loads(line) for line in lines]
+
+        assert [c["response"] for c in chunks[:-1]] == TOKENS
+        assert chunks[-1]["done"] is True
+        assert chunks[-1]["response"] == "".join(TOKENS)
+        assert stream.closed
+
+def test_stream_translator_chat_lines_are_single_json_objects():
+    stream = FakeStream([build_sse_body(TOKENS)])
+    lines = asyncio.run(collect(stream_translator(stream, "chat", "test-model")))
+    assert all(isinstance(line, bytes) and line.endswith(b"\n") and line.count(b"\n") == 1 for line in lines)
+    chunks = [json.loads(line) for line in lines]
+    assert [c["message"]["content"] for c in chunks[:-1]] == TOKENS
+    final = chunks[-1]
+    assert {k: final[k] for k in ("model", "message", "done")} == {
+        "model": "test-model", "message": {"role": "assistant", "content": ""}, "done": True}
+    # Without upstream usage, eval_count falls back to the streamed chunks.
+    assert final["eval_count"] == len(TOKENS)
+    assert "prompt_eval_count" not in final
+
+# --- Unit Tests for src.ndjson ---
+
+def test_chunk_encoder_matches_dict_serialization():
+    for response_format, key in (("chat", "message"), ("generate", "response")):
+        encoder = ChunkEncoder(response_format, 'model "x" ☕')
+        for token in TOKENS:
+            chunk = json.loads(encoder.token(token))
+            content = chunk[key]["content"] if key == "message" else chunk[key]
+            assert content == token
+            assert chunk["model"] == 'model "x" ☕'
+            assert list(chunk) == ["model", "created_at", key, "done"]
+            assert chunk["done"] is False
+        final = json.loads(encoder.final("all", eval_count=3))
+        assert final["done"] is True and final["eval_count"] == 3
+
+def test_coarse_clock_reuses_timestamp_within_a_tick():
+    clock = CoarseClock(resolution=1e9)
+    first = clock.now()
+    assert clock.now() is first
+    assert first.endswith("Z") and "T" in first
+
+# --- Unit Tests for src.flush ---
+
+class SlowStream(FakeStream):
+    """FakeStream that pauses before the chunks listed in 'pauses'."""
+    def __init__(self, chunks, pauses):
+        super().__init__(chunks)
+        self.pauses = pauses
+
+    async def aiter_bytes(self):
+        for i, chunk in enumerate(self.chunks):
+            if i in self.pauses:
+                await asyncio.sleep(self.pauses[i])
+            yield chunk
+
+def test_stream_translator_reports_usage_and_shim_timings():
+    body = build_sse_body(TOKENS).replace(b"data: [DONE]", (
+        'data: {"choices":[],"usage":{"prompt_tokens":12,"completion_tokens":9,"total_tokens":21}}\n\n'
+        "data: [DONE]").encode())
+    first_event = body.index(b"\n\n") + 2
+    stream = SlowStream([body[:first_event], body[first_event:]], pauses={1: 0.05})
+    request_stats = {"route": "/api/generate", "model": "m", "started": time.perf_counter() - 0.02}
+    request_stats["sent"] = request_stats["started"] + 0.01
+    lines = asyncio.run(collect(stream_translator(stream, "generate", "m", request_stats=request_stats)))
+    final = json.loads(lines[-1])
+
+    assert final["prompt_eval_count"] == 12 and final["eval_count"] == 9
+    assert abs(final["load_duration"] - 10_000_000) <= 1
+    assert final["prompt_eval_duration"] >= 10_000_000
+    assert final["eval_duration"] >= 50_000_000
+    parts = final["load_duration"] + final["prompt_eval_duration"] + final["eval_duration"]
+    assert abs(final["total_duration"] - parts) <= 1
+
+def test_flush_policy_parsing_and_selection():
+    policy = FlushPolicy.parse("tokens=16, bytes=4096, ms=50")
+    assert (policy.max_tokens, policy.max_bytes, policy.max_delay) == (16, 4096, 0.05)
+    assert FlushPolicy.parse("tokens=8").max_delay > 0
+    assert FlushPolicy.parse("token").per_token
+    assert flush_policy_for({"x-stream-flush": "tokens=4"}, {}, "chat").max_tokens == 4
+    assert flush_policy_for({}, {"options": {"stream_flush": "bytes=100"}}, "generate").max_bytes == 100
+    assert flush_policy_for({"x-stream-flush": "bogus"}, {}, "chat").per_token
+
+def test_stream_translator_groups_tokens_after_the_first():
+    events = [build_sse_body([t]).rsplit(b"data: [DONE]", 1)[0] for t in TOKENS]
+    stream = FakeStream(events + [b"data: [DONE]\n\n"])
+    writes = asyncio.run(collect(stream_translator(
+        stream, "generate", "test-model", flush_policy=FlushPolicy(max_tokens=4, max_delay=10))))
+    # First token alone, then groups of four, then the final line.
+    assert [w.count(b"\n") for w in writes] == [1, 4, 4, 1]
+    chunks = [json.loads(line) for w in writes for line in w.splitlines()]
+    assert [c["response"] for c in chunks[:-1]] == TOKENS
+    assert chunks[-1]["done"] is True
+
+def test_stream_translator_flushes_on_time_when_upstream_stalls():
+    events = [build_sse_body([t]).rsplit(b"data: [DONE]", 1)[0] for t in TOKENS[:3]]
+    stream = SlowStream(events + [b"data: [DONE]\n\n"], pauses={3: 0.2})
+    writes = asyncio.run(collect(stream_translator(
+        stream, "chat", "test-model", flush_policy=FlushPolicy(max_tokens=100, max_delay=0.02))))
+    # The two buffered tokens go out during the stall, before the final line.
+    assert [w.count(b"\n") for w in writes] == [1, 2, 1]
+    assert stream.closed
+
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from src.upstream import build_client, prewarm, pool_stats
+
+# --- Unit Tests for src.upstream ---
+
+def make_config(**overrides):
+    values = dict(
+        UPSTREAM_CONNECT_TIMEOUT=2.0, RESPONSE_TIMEOUT=120.0, API_TIMEOUT=15.0, UPSTREAM_POOL_TIMEOUT=3.0,
+        UPSTREAM_MAX_CONNECTIONS=8, UPSTREAM_MAX_KEEPALIVE=4, UPSTREAM_KEEPALIVE_EXPIRY=30.0,
+        UPSTREAM_HTTP2=False, AUTH_TOKEN=None,
+    )
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+class _ModelsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"data": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def local_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ModelsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_client_uses_split_timeouts_and_auth_token():
+    async def check():
+        async with build_client(make_config(AUTH_TOKEN="secret")) as client:
+            assert client.timeout.connect == 2.0
+            assert client.timeout.read == 120.0
+            assert client.timeout.write == 15.0
+            assert client.timeout.pool == 3.0
+            assert client.headers["Authorization"] == "Bearer secret"
+    asyncio.run(check())
+
+def test_client_without_token_sends_no_authorization():
+    async def check():
+        async with build_client(make_config()) as client:
+            assert "Authorization" not in client.headers
+    asyncio.run(check())
+
+def test_prewarm_opens_keepalive_connections(local_server):
+    async def check():
+        async with build_client(make_config()) as client:
+            warmed = await prewarm(client, f"{local_server}/v1/models", 3)
+            return warmed, pool_stats(client)
+    warmed, stats = asyncio.run(check())
+    assert warmed == 3
+    (origin,) = stats["origins"].values()
+    assert origin["connections"] == 3
+    assert origin["idle"] == 3 and origin["active"] == 0
+    assert stats["waiting"] == 0
+
+def test_pool_stats_of_missing_client_are_empty():
+    assert pool_stats(None) == {"origins": {}, "waiting": 0}